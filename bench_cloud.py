@@ -0,0 +1,209 @@
+"""
+Cloud-path benchmark on the fake Gemini backend.
+
+Fires bursts of concurrent generate_cloud calls (the benchmark.py cases)
+and reports:
+  - batching: throughput, latency percentiles and failures for each cloud
+    dispatcher batching window (window 0 is the direct, unbatched path)
+  - hedging: p50/p99 with hedging off and on against a fake with a slow tail
+  - shortlist: declared tools, request bytes, latency and F1 with cloud tool
+    shortlisting off and on, every case offered the whole tool catalog
+  - stream: latency, time to first call and F1 with streaming off and on
+
+Usage:
+    python bench_cloud.py                                   # both sections
+    python bench_cloud.py --only batching --windows 0 10 --clients 32 --concurrency 8
+    python bench_cloud.py --rate-limit 8                    # fake 429s above 8 in flight
+    python bench_cloud.py --only hedging --tail-rate 0.02 --hedge-budget 0.1
+    python bench_cloud.py --only shortlist --decl-ms 15
+    python bench_cloud.py --only stream
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, contextlib, io, statistics, threading, time
+
+import main, fake_backend
+from benchmark import BENCHMARKS, compute_f1
+from bench_load import percentile
+
+
+def _client(cases, offset, per_client, latencies, failures, lock):
+    for i in range(per_client):
+        case = cases[(offset + i) % len(cases)]
+        t0 = time.perf_counter()
+        result = main.generate_cloud(case["messages"], case["tools"])
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            if result["function_calls"]:
+                latencies.append(elapsed_ms)
+            else:
+                failures.append(elapsed_ms)
+
+
+def run_burst(clients, per_client):
+    latencies, failures, lock = [], [], threading.Lock()
+    threads = [
+        threading.Thread(target=_client, args=(BENCHMARKS, i * 7, per_client, latencies, failures, lock))
+        for i in range(clients)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {
+        "ok": len(latencies),
+        "failed": len(failures),
+        "rps": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def bench_batching(windows, clients, per_client, cloud_ms, rate_limit, concurrency):
+    print(f"--- Batching window: {clients} clients x {per_client} calls, cloud={cloud_ms:.0f}ms, "
+          f"dispatcher concurrency={concurrency}, fake rate limit={rate_limit or 'none'} ---\n")
+    print(f"  {'window':>7} | {'ok':>5} | {'failed':>6} | {'req/s':>7} | {'p50 ms':>8} | "
+          f"{'p99 ms':>8} | {'avg batch':>9} | {'peak in flight':>14}")
+    print(f"  {'-'*7}-+-{'-'*5}-+-{'-'*6}-+-{'-'*7}-+-{'-'*8}-+-{'-'*8}-+-{'-'*9}-+-{'-'*14}")
+    dispatcher = main.default_session().cloud_dispatcher
+    dispatcher.concurrency = concurrency
+    for window in windows:
+        _, fake_genai = fake_backend.install(cloud_ms=cloud_ms, cloud_concurrency_limit=rate_limit)
+        dispatcher.window_ms = window
+        main.reset_stats()
+        r = run_burst(clients, per_client)
+        stats = main.get_stats()
+        batches = stats["cloud_batches"]
+        avg_batch = stats["cloud_batched_requests"] / batches if batches else 1.0
+        print(f"  {window:>5.0f}ms | {r['ok']:>5} | {r['failed']:>6} | {r['rps']:>7.1f} | "
+              f"{r['p50_ms']:>8.1f} | {r['p99_ms']:>8.1f} | {avg_batch:>9.1f} | {fake_genai.peak_in_flight:>14}")
+    print()
+
+
+def bench_hedging(clients, per_client, cloud_ms, tail_rate, tail_factor, pct, budget):
+    print(f"--- Hedging: {clients} clients x {per_client} calls, cloud={cloud_ms:.0f}ms, "
+          f"tail={tail_rate:.0%} x{tail_factor:.0f}, hedge at p{pct:.0f}, budget={budget:.0%} ---\n")
+    print(f"  {'hedging':>7} | {'p50 ms':>8} | {'p99 ms':>8} | {'hedged':>7} | {'won':>5} | {'denied':>6} | {'requests':>8}")
+    print(f"  {'-'*7}-+-{'-'*8}-+-{'-'*8}-+-{'-'*7}-+-{'-'*5}-+-{'-'*6}-+-{'-'*8}")
+    session = main.default_session()
+    session.cloud_dispatcher.window_ms = 0
+    rows = {}
+    for enabled in (False, True):
+        _, fake_genai = fake_backend.install(cloud_ms=cloud_ms, cloud_tail_rate=tail_rate,
+                                             cloud_tail_factor=tail_factor)
+        main._HEDGE = enabled
+        session.cloud_hedger = main._CloudHedger(pct, budget)
+        main.reset_stats()
+        r = run_burst(clients, per_client)
+        stats = main.get_stats()
+        calls = r["ok"] + r["failed"]
+        rows[enabled] = r
+        print(f"  {'on' if enabled else 'off':>7} | {r['p50_ms']:>8.1f} | {r['p99_ms']:>8.1f} | "
+              f"{stats['cloud_hedged'] / calls if calls else 0:>7.1%} | {stats['cloud_hedge_won']:>5} | "
+              f"{stats['cloud_hedge_denied']:>6} | {fake_genai.requests:>8}")
+    off, on = rows[False]["p99_ms"], rows[True]["p99_ms"]
+    if off:
+        print(f"\n  p99 {off:.1f}ms -> {on:.1f}ms ({(on - off) / off:+.1%})")
+    print()
+
+
+def bench_shortlist(cloud_ms, decl_ms):
+    catalog = list({t["name"]: t for case in BENCHMARKS for t in case["tools"]}.values())
+    print(f"--- Tool shortlisting: {len(BENCHMARKS)} cases x {len(catalog)}-tool catalog, "
+          f"cloud={cloud_ms:.0f}ms + {decl_ms:.0f}ms/declared tool ---\n")
+    print(f"  {'shortlist':>9} | {'tools/req':>9} | {'bytes/req':>9} | {'p50 ms':>8} | {'mean ms':>8} | "
+          f"{'widened':>7} | {'avg F1':>6}")
+    print(f"  {'-'*9}-+-{'-'*9}-+-{'-'*9}-+-{'-'*8}-+-{'-'*8}-+-{'-'*7}-+-{'-'*6}")
+    main.default_session().cloud_dispatcher.window_ms = 0
+    main._HEDGE = False
+    rows = {}
+    for enabled in (False, True):
+        _, fake_genai = fake_backend.install(cloud_ms=cloud_ms, cloud_jitter=0, cloud_decl_ms_per_tool=decl_ms)
+        main._CLOUD_SHORTLIST = enabled
+        main.reset_stats()
+        latencies, f1s = [], []
+        for case in BENCHMARKS:
+            t0 = time.perf_counter()
+            result = main.generate_cloud(case["messages"], catalog)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            with contextlib.redirect_stdout(io.StringIO()):
+                f1s.append(compute_f1(result["function_calls"], case["expected_calls"]))
+        n = fake_genai.requests
+        rows[enabled] = (fake_genai.declared_bytes / n, statistics.mean(latencies))
+        print(f"  {'on' if enabled else 'off':>9} | {fake_genai.declared_tools / n:>9.1f} | "
+              f"{fake_genai.declared_bytes / n:>9.0f} | {percentile(latencies, 50):>8.1f} | "
+              f"{statistics.mean(latencies):>8.1f} | {main.get_stats()['cloud_shortlist_widened']:>7} | "
+              f"{statistics.mean(f1s):>6.2f}")
+    (bytes_off, ms_off), (bytes_on, ms_on) = rows[False], rows[True]
+    print(f"\n  request size {bytes_off:.0f} -> {bytes_on:.0f} bytes ({(bytes_on - bytes_off) / bytes_off:+.1%}), "
+          f"mean latency {ms_off:.1f} -> {ms_on:.1f}ms ({(ms_on - ms_off) / ms_off:+.1%})")
+    print()
+
+
+def bench_stream(cloud_ms):
+    print(f"--- Streaming: {len(BENCHMARKS)} cases, cloud={cloud_ms:.0f}ms "
+          f"(fake sends the first call at 60%, the finish chunk at 100%) ---\n")
+    print(f"  {'stream':>6} | {'p50 ms':>8} | {'mean ms':>8} | {'ttfc p50':>8} | {'early':>5} | {'avg F1':>6}")
+    print(f"  {'-'*6}-+-{'-'*8}-+-{'-'*8}-+-{'-'*8}-+-{'-'*5}-+-{'-'*6}")
+    session = main.default_session()
+    session.cloud_dispatcher.window_ms = 0
+    main._HEDGE = False
+    for enabled in (False, True):
+        fake_backend.install(cloud_ms=cloud_ms, cloud_jitter=0)
+        main._CLOUD_STREAM = enabled
+        session.cloud_ttfc_ms.clear()
+        main.reset_stats()
+        latencies, f1s = [], []
+        for case in BENCHMARKS:
+            t0 = time.perf_counter()
+            result = main.generate_cloud(case["messages"], case["tools"])
+            latencies.append((time.perf_counter() - t0) * 1000)
+            with contextlib.redirect_stdout(io.StringIO()):
+                f1s.append(compute_f1(result["function_calls"], case["expected_calls"]))
+        stats = main.get_stats()
+        ttfc = stats.get("cloud_ttfc_p50_ms")
+        print(f"  {'on' if enabled else 'off':>6} | {percentile(latencies, 50):>8.1f} | "
+              f"{statistics.mean(latencies):>8.1f} | {ttfc if ttfc is not None else '-':>8} | "
+              f"{stats['cloud_stream_early_return']:>5} | {statistics.mean(f1s):>6.2f}")
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cloud-path benchmark on the fake Gemini backend")
+    parser.add_argument("--windows", type=float, nargs="*", default=[0, 5, 20, 50],
+                        help="Batching windows to compare, in ms")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--per-client", type=int, default=10, help="Sequential calls per client")
+    parser.add_argument("--cloud-ms", type=float, default=150.0, help="Fake Gemini latency")
+    parser.add_argument("--concurrency", type=int, default=main._CLOUD_CONCURRENCY,
+                        help="Dispatcher max requests in flight")
+    parser.add_argument("--rate-limit", type=int, default=0,
+                        help="Fake Gemini answers 429 above this many requests in flight (0 = off)")
+    parser.add_argument("--tail-rate", type=float, default=0.02, help="Share of slow fake Gemini calls")
+    parser.add_argument("--tail-factor", type=float, default=6.0, help="Slowdown of a tail call")
+    parser.add_argument("--hedge-pct", type=float, default=main._HEDGE_PCT)
+    parser.add_argument("--hedge-budget", type=float, default=main._HEDGE_BUDGET)
+    parser.add_argument("--decl-ms", type=float, default=10.0,
+                        help="Fake Gemini prompt-processing cost per declared tool")
+    parser.add_argument("--only", choices=["batching", "hedging", "shortlist", "stream"], help="Run one section")
+    args = parser.parse_args()
+
+    # Distinct concurrent calls only: keep single-flight from merging the bursts
+    main._SINGLE_FLIGHT = False
+    print("=== Cloud benchmark (fake Gemini) ===\n")
+    if args.only in (None, "batching"):
+        main._HEDGE = False
+        bench_batching(args.windows, args.clients, args.per_client, args.cloud_ms,
+                       args.rate_limit, args.concurrency)
+    if args.only in (None, "hedging"):
+        bench_hedging(max(1, args.clients // 4), args.per_client * 10, args.cloud_ms,
+                      args.tail_rate, args.tail_factor, args.hedge_pct, args.hedge_budget)
+    if args.only in (None, "shortlist"):
+        bench_shortlist(args.cloud_ms, args.decl_ms)
+    if args.only in (None, "stream"):
+        bench_stream(args.cloud_ms)
@@ -0,0 +1,157 @@
+"""
+Cold-start benchmark for main.py.
+
+Measures, in fresh interpreter processes:
+  - import time of `main` (via `python -X importtime`), and checks that the
+    Gemini SDK and cactus bindings are NOT loaded by the import itself
+  - time to first result: process start -> first generate_hybrid() return
+    for an on-device query (needs the cactus build and weights)
+
+Usage:
+    python bench_coldstart.py                    # run, compare against the stored baseline
+    python bench_coldstart.py --save-baseline    # store this run as the new baseline
+    python bench_coldstart.py --skip-first-result
+"""
+
+import sys, os
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, json, statistics, subprocess
+
+from microbench import load_baseline, save_baseline, compare, DEFAULT_THRESHOLD_PCT
+
+
+BASELINE_PATH = os.path.join("bench_baselines", "coldstart.json")
+
+# Modules that must stay unloaded after a bare `import main`
+LAZY_MODULES = ("google.genai", "cactus")
+
+_FIRST_RESULT_SCRIPT = r"""
+import sys, os, time, json
+t0 = time.perf_counter()
+sys.path.insert(0, "cactus/python/src")
+import main
+t_import = time.perf_counter()
+tools = [{
+    "name": "get_weather",
+    "description": "Get current weather for a location",
+    "parameters": {
+        "type": "object",
+        "properties": {"location": {"type": "string", "description": "City name"}},
+        "required": ["location"],
+    },
+}]
+result = main.generate_hybrid([{"role": "user", "content": "What is the weather in Paris?"}], tools)
+t_done = time.perf_counter()
+print(json.dumps({
+    "import_us": (t_import - t0) * 1e6,
+    "first_result_us": (t_done - t0) * 1e6,
+    "source": result.get("source"),
+    "cloud_loaded": "google.genai" in sys.modules,
+}))
+"""
+
+
+def _parse_importtime(stderr):
+    """Parse `-X importtime` output into {module: cumulative_us}."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cum = int(parts[1].strip())
+        except ValueError:
+            continue  # header line
+        cumulative[parts[2].strip()] = cum
+    return cumulative
+
+
+def measure_import(repeats):
+    """Import `main` in fresh processes; return (median cumulative us, loaded lazy modules)."""
+    samples = []
+    loaded = set()
+    for _ in range(repeats):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import sys; sys.path.insert(0, 'cactus/python/src'); import main"],
+            capture_output=True, text=True,
+        )
+        if proc.returncode != 0:
+            raise RuntimeError("import main failed:\n" + proc.stderr[-2000:])
+        modules = _parse_importtime(proc.stderr)
+        samples.append(modules.get("main", 0))
+        loaded |= {m for m in modules if any(m == l or m.startswith(l + ".") for l in LAZY_MODULES)}
+    return samples, sorted(loaded)
+
+
+def measure_first_result(repeats):
+    """Run one generate_hybrid call per fresh process; return samples or None if unavailable."""
+    samples = []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, "-c", _FIRST_RESULT_SCRIPT], capture_output=True, text=True)
+        if proc.returncode != 0:
+            print("  time-to-first-result unavailable (is cactus built?):")
+            print("    " + (proc.stderr.strip().splitlines() or ["<no output>"])[-1])
+            return None
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return samples
+
+
+def _summary(samples):
+    return {
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+        "stdev_us": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "loops": 1,
+        "repeats": len(samples),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for main.py")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON path")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PCT,
+                        help="Max allowed slowdown in percent before failing (default: %(default)s)")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--skip-first-result", action="store_true", help="Only measure import time")
+    args = parser.parse_args()
+
+    print("=== Cold-start benchmark ===\n")
+    results = {}
+    failed = False
+
+    samples, loaded = measure_import(args.repeats)
+    results["import_main"] = _summary(samples)
+    print(f"  import main: {results['import_main']['median_us'] / 1000:.1f}ms (median of {len(samples)})")
+    if loaded:
+        print(f"  FAIL: `import main` eagerly loaded {', '.join(loaded)}")
+        failed = True
+    else:
+        print(f"  lazy modules not loaded at import: {', '.join(LAZY_MODULES)}")
+
+    if not args.skip_first_result:
+        runs = measure_first_result(args.repeats)
+        if runs:
+            results["first_result"] = _summary([r["first_result_us"] for r in runs])
+            sources = sorted({r["source"] for r in runs})
+            cloud = sum(1 for r in runs if r["cloud_loaded"])
+            print(f"  time to first result: {results['first_result']['median_us'] / 1000:.1f}ms "
+                  f"(source={', '.join(map(str, sources))}, cloud SDK loaded in {cloud}/{len(runs)} runs)")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+        sys.exit(1 if failed else 0)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+    if regressions:
+        print(f"\nFAIL: regressed more than {args.threshold:.0f}%: " + ", ".join(regressions))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,98 @@
+"""
+Multi-turn benchmark on the fake backend.
+
+Plays one long conversation built from the single-action benchmark.py cases,
+offered the whole tool catalog, and reports per-turn latency and prefilled
+tokens as the history grows:
+  - stateless: generate_hybrid with the full history every turn (reset + full prefill)
+  - conversation: Conversation.generate (prefills only the new messages)
+An edited history (a rewritten earlier message) is replayed at the end to
+show the fallback to a full prefill.
+
+Usage:
+    python bench_conversation.py                    # 30 turns
+    python bench_conversation.py --turns 40 --prefill-ms 0.5
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, contextlib, io, statistics, time
+
+import main, fake_backend
+from benchmark import BENCHMARKS, compute_f1
+
+
+def _turns(n):
+    cases = [c for c in BENCHMARKS if len(c["expected_calls"]) == 1]
+    return [cases[i % len(cases)] for i in range(n)]
+
+
+def _catalog():
+    return list({t["name"]: t for case in BENCHMARKS for t in case["tools"]}.values())
+
+
+def _f1(result, case):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return compute_f1(result["function_calls"], case["expected_calls"])
+
+
+def run(mode, turns, tools, local_ms, prefill_ms):
+    """Play the conversation; returns one (ms, prefill tokens, cached tokens, F1) row per turn."""
+    fake_cactus, _ = fake_backend.install(local_ms=local_ms, cloud_ms=150)
+    fake_cactus.prefill_ms_per_token = prefill_ms
+    rows, history = [], []
+    with main.HybridSession(route_stats_path=None) as session:
+        conversation = session.conversation(tools)
+        for case in turns:
+            history = history + [{"role": "user", "content": case["messages"][-1]["content"]}]
+            prefill, cached = fake_cactus.prefill_tokens, fake_cactus.cached_tokens
+            t0 = time.perf_counter()
+            if mode == "conversation":
+                result = conversation.generate(history)
+            else:
+                result = session.generate_hybrid(history, tools)
+            ms = (time.perf_counter() - t0) * 1000
+            rows.append((ms, fake_cactus.prefill_tokens - prefill, fake_cactus.cached_tokens - cached,
+                         _f1(result, case)))
+        if mode == "conversation":
+            edited = [dict(history[0], content=history[0]["content"] + " please")] + history[1:]
+            prefill = fake_cactus.prefill_tokens
+            t0 = time.perf_counter()
+            conversation.generate(edited)
+            edit_row = ((time.perf_counter() - t0) * 1000, fake_cactus.prefill_tokens - prefill)
+            stats = session.get_stats()
+            print(f"  conversation: {stats['conversation_prefill_incremental']} incremental / "
+                  f"{stats['conversation_prefill_reset']} full prefills; edited history at turn {len(history)}: "
+                  f"{edit_row[0]:.1f}ms, {edit_row[1]} tokens prefilled")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-turn benchmark on the fake backend")
+    parser.add_argument("--turns", type=int, default=30)
+    parser.add_argument("--local-ms", type=float, default=20.0, help="Fake FunctionGemma decode latency")
+    parser.add_argument("--prefill-ms", type=float, default=0.3, help="Fake prefill cost per token")
+    args = parser.parse_args()
+
+    # Every turn goes through STEP 1, so the prefill cost is visible
+    main._SLOT_FILL = False
+    tools, turns = _catalog(), _turns(args.turns)
+    print(f"=== Conversation benchmark (fake backend): {args.turns} turns, {len(tools)}-tool catalog, "
+          f"local={args.local_ms:.0f}ms + {args.prefill_ms}ms/prefilled token ===\n")
+    results = {mode: run(mode, turns, tools, args.local_ms, args.prefill_ms)
+               for mode in ("stateless", "conversation")}
+
+    print(f"\n  {'turn':>4} | {'stateless ms':>12} | {'prefill tok':>11} | {'conversation ms':>15} | "
+          f"{'prefill tok':>11} | {'cached tok':>10}")
+    print(f"  {'-'*4}-+-{'-'*12}-+-{'-'*11}-+-{'-'*15}-+-{'-'*11}-+-{'-'*10}")
+    marks = sorted({1, 2, 5, 10, 15, 20, 25, 30, 40, args.turns} & set(range(1, args.turns + 1)))
+    for turn in marks:
+        s, c = results["stateless"][turn - 1], results["conversation"][turn - 1]
+        print(f"  {turn:>4} | {s[0]:>12.1f} | {s[1]:>11} | {c[0]:>15.1f} | {c[1]:>11} | {c[2]:>10}")
+    for mode, rows in results.items():
+        tail = rows[len(rows) // 2:]
+        print(f"\n  {mode:>12}: mean {statistics.mean(r[0] for r in rows):.1f}ms/turn, "
+              f"second half {statistics.mean(r[0] for r in tail):.1f}ms/turn, "
+              f"{sum(r[1] for r in rows)} tokens prefilled, avg F1 {statistics.mean(r[3] for r in rows):.2f}")
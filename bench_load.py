@@ -0,0 +1,141 @@
+"""
+Load test for server.py.
+
+Drives /v1/chat/completions with the benchmark.py cases from N concurrent
+keep-alive clients and reports requests/s and latency percentiles.
+By default it starts an in-process server on the fake backend.
+
+Usage:
+    python bench_load.py                              # fake backend, 8 clients, 10s
+    python bench_load.py --clients 32 --duration 30 --handles 4
+    python bench_load.py --url http://127.0.0.1:8000  # against a running server
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, http.client, json, threading, time
+from collections import Counter
+from urllib.parse import urlparse
+
+from benchmark import BENCHMARKS
+
+
+def _payloads():
+    return [
+        json.dumps({
+            "model": "functiongemma-hybrid",
+            "messages": case["messages"],
+            "tools": [{"type": "function", "function": t} for t in case["tools"]],
+        }).encode("utf-8")
+        for case in BENCHMARKS
+    ]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an unsorted list."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _client(host, port, payloads, offset, deadline, latencies, statuses, lock):
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    i = offset
+    while time.time() < deadline:
+        body = payloads[i % len(payloads)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request("POST", "/v1/chat/completions", body=body,
+                         headers={"Content-Type": "application/json"})
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=60)
+            status = "conn_error"
+        elapsed_ms = (time.perf_counter() - t0) * 1000
+        with lock:
+            statuses[status] += 1
+            if status == 200:
+                latencies.append(elapsed_ms)
+    conn.close()
+
+
+def run_load(host, port, clients, duration):
+    payloads = _payloads()
+    latencies, statuses, lock = [], Counter(), threading.Lock()
+    deadline = time.time() + duration
+    threads = [
+        threading.Thread(target=_client, args=(host, port, payloads, i * 7, deadline, latencies, statuses, lock))
+        for i in range(clients)
+    ]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {
+        "wall_s": wall,
+        "ok": statuses.get(200, 0),
+        "statuses": dict(statuses),
+        "rps": statuses.get(200, 0) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else 0.0,
+    }
+
+
+def _health(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    conn.request("GET", "/health")
+    data = json.loads(conn.getresponse().read())
+    conn.close()
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test for server.py")
+    parser.add_argument("--url", help="Target a running server instead of starting one")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds")
+    parser.add_argument("--handles", type=int, default=1, help="Model handles for the in-process server")
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--local-ms", type=float, default=40.0, help="Fake FunctionGemma latency")
+    parser.add_argument("--cloud-ms", type=float, default=350.0, help="Fake Gemini latency")
+    args = parser.parse_args()
+
+    httpd = None
+    if args.url:
+        u = urlparse(args.url)
+        host, port = u.hostname, u.port or 80
+    else:
+        import main, fake_backend, server
+        main.set_default_session(main.HybridSession(model_handles=args.handles))
+        fake_backend.install(local_ms=args.local_ms, cloud_ms=args.cloud_ms)
+        httpd = server.serve("127.0.0.1", 0, queue_size=args.queue_size, warm=False)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        host, port = httpd.server_address
+        main.warmup()
+
+    print(f"=== Load test: {args.clients} clients x {args.duration:.0f}s -> {host}:{port} ===\n")
+    r = run_load(host, port, args.clients, args.duration)
+    health = _health(host, port)
+
+    print(f"  requests ok : {r['ok']}  statuses={r['statuses']}")
+    print(f"  throughput  : {r['rps']:.1f} req/s")
+    print(f"  latency     : p50={r['p50_ms']:.1f}ms  p90={r['p90_ms']:.1f}ms  "
+          f"p99={r['p99_ms']:.1f}ms  max={r['max_ms']:.1f}ms")
+    print(f"  server      : handles={health['model_handles']} workers={health['workers']} "
+          f"rejected={health['rejected']} completed={health['completed']}")
+
+    if httpd is not None:
+        httpd.shutdown()
+        httpd.server_close()
@@ -0,0 +1,107 @@
+"""
+Throughput vs workers on the fake backend.
+
+For each worker count N, closed-loop clients replay the benchmark.py cases
+for a fixed time against:
+  - threads: one in-process HybridSession with N model handles
+  - processes: a ProcessPoolBackend with N workers (one handle each)
+Fake inference sleeps (releasing the GIL like the real bindings), so what
+separates the two is the Python-side cascade work that threads serialize.
+Also reports the average request payload sent to a worker against the
+JSON of the full (messages, tools) request.
+
+Usage:
+    python bench_pool.py                              # 1, 2, 4, 8 workers
+    python bench_pool.py --workers 1 2 4 8 16 32 --duration 10
+    python bench_pool.py --local-ms 2 --prefill-ms 0  # cascade CPU dominates
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+# Distinct concurrent requests only, in this process and the spawned workers
+os.environ["HYBRID_SINGLE_FLIGHT"] = "0"
+
+import argparse, json, statistics, threading, time
+
+import main, fake_backend
+from benchmark import BENCHMARKS
+from bench_load import percentile
+
+
+def _fake_worker(local_ms, cloud_ms, prefill_ms):
+    """Pool worker initializer (module level so spawned workers can import it)."""
+    fake_cactus, _ = fake_backend.install(local_ms=local_ms, cloud_ms=cloud_ms)
+    fake_cactus.prefill_ms_per_token = prefill_ms
+
+
+def _client(generate, offset, stop_at, latencies, lock):
+    i = offset
+    while time.perf_counter() < stop_at:
+        case = BENCHMARKS[i % len(BENCHMARKS)]
+        t0 = time.perf_counter()
+        generate(case["messages"], case["tools"])
+        with lock:
+            latencies.append((time.perf_counter() - t0) * 1000)
+        i += 1
+
+
+def drive(generate, clients, duration):
+    latencies, lock = [], threading.Lock()
+    stop_at = time.perf_counter() + duration
+    threads = [threading.Thread(target=_client, args=(generate, i * 7, stop_at, latencies, lock))
+               for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    return {"rps": len(latencies) / wall, "p50_ms": percentile(latencies, 50),
+            "p99_ms": percentile(latencies, 99)}
+
+
+def run_threads(n, clients, duration, args):
+    _fake_worker(args.local_ms, args.cloud_ms, args.prefill_ms)
+    with main.HybridSession(model_handles=n, route_stats_path=None) as session:
+        session.warmup()
+        return drive(session.generate_hybrid, clients, duration)
+
+
+def run_processes(n, clients, duration, args):
+    _fake_worker(args.local_ms, args.cloud_ms, args.prefill_ms)
+    with main.HybridSession(route_stats_path=None) as session, \
+            main.ProcessPoolBackend(n, _fake_worker, (args.local_ms, args.cloud_ms, args.prefill_ms),
+                                    session=session) as pool:
+        r = drive(pool.generate_hybrid, clients, duration)
+        r["payload"] = pool.get_stats()["pool_payload_avg_bytes"]
+        return r
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput vs workers on the fake backend")
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per run")
+    parser.add_argument("--clients-per-worker", type=int, default=main._POOL_WORKER_THREADS)
+    parser.add_argument("--local-ms", type=float, default=5.0, help="Fake FunctionGemma decode latency")
+    parser.add_argument("--prefill-ms", type=float, default=0.05, help="Fake prefill cost per token")
+    parser.add_argument("--cloud-ms", type=float, default=150.0, help="Fake Gemini latency")
+    args = parser.parse_args()
+
+    full = statistics.mean(len(json.dumps([c["messages"], c["tools"]])) for c in BENCHMARKS)
+    print(f"=== Process pool benchmark (fake backend): {os.cpu_count()} core(s), "
+          f"local={args.local_ms:.0f}ms + {args.prefill_ms}ms/prefilled token, cloud={args.cloud_ms:.0f}ms, "
+          f"{args.duration:.0f}s per run ===\n")
+    print(f"  {'workers':>7} | {'clients':>7} | {'threads req/s':>13} | {'p50 ms':>7} | "
+          f"{'procs req/s':>11} | {'p50 ms':>7} | {'p99 ms':>7} | {'speedup':>7}")
+    print(f"  {'-'*7}-+-{'-'*7}-+-{'-'*13}-+-{'-'*7}-+-{'-'*11}-+-{'-'*7}-+-{'-'*7}-+-{'-'*7}")
+    payload = None
+    for n in args.workers:
+        clients = n * args.clients_per_worker
+        t = run_threads(n, clients, args.duration, args)
+        p = run_processes(n, clients, args.duration, args)
+        payload = p["payload"]
+        print(f"  {n:>7} | {clients:>7} | {t['rps']:>13.1f} | {t['p50_ms']:>7.1f} | "
+              f"{p['rps']:>11.1f} | {p['p50_ms']:>7.1f} | {p['p99_ms']:>7.1f} | {p['rps'] / t['rps']:>6.2f}x")
+    if payload is not None:
+        print(f"\n  request payload to a worker: {payload} bytes avg (full messages+tools JSON: {full:.0f} bytes)")
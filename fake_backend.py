@@ -0,0 +1,364 @@
+"""
+Fake FunctionGemma (cactus) and Gemini backends for load tests and benchmarks.
+
+Lets the server, load tests and cloud-path benchmarks run the full cascade
+without weights, a Mac or an API key. Answers come from the same
+schema-guided extraction the cascade uses for synthetic calls, and latency
+is simulated with sleeps (which release the GIL, like the real bindings).
+
+Usage:
+    import fake_backend
+    fake_backend.install(local_ms=40, cloud_ms=350)
+    main.generate_hybrid(messages, tools)
+"""
+
+import asyncio, json, random, threading, time
+
+import main
+
+
+############## Fake cactus ##############
+
+class FakeModel:
+    """A model handle. Raises if two threads use it at once, like a real KV cache would corrupt."""
+
+    def __init__(self, path):
+        self.path = path
+        self.busy = threading.Lock()
+        self.kv = []   # prompt blocks (tool declarations, then messages) held in the KV cache
+
+
+def _user_query(messages):
+    for m in reversed(messages):
+        if m.get("role") == "user":
+            content = m.get("content", "")
+            # Strip the "[tool description] " augmentation added by _augment_query
+            if content.startswith("[") and "] " in content:
+                content = content.split("] ", 1)[1]
+            return content
+    return ""
+
+
+def _answer(query, tools):
+    """Build calls for a query using the cascade's own tool matching and extraction."""
+    calls = []
+    for seg in main.QueryContext(query).segment_contexts():
+        for tool in main._match_tools_to_segment(seg, tools)[:1]:
+            call = main._construct_synthetic_call(seg, tool)
+            if call:
+                calls.append(call)
+    return calls
+
+
+def _tokens(text):
+    return len(text) // 4
+
+
+class FakeCactus:
+    """
+    Stands in for the `cactus` module. Until cactus_reset, a handle keeps its
+    last prompt in the KV cache and a completion prefills only the blocks
+    after the longest common prefix with it; `prefill_tokens` and
+    `cached_tokens` add up what was prefilled and what was reused.
+    """
+
+    def __init__(self, local_ms=40.0, prefill_ms_per_token=0.3, fail_rate=0.0, seed=0):
+        self.local_ms = local_ms
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.fail_rate = fail_rate
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.prefill_tokens = 0
+        self.cached_tokens = 0
+        self.lock = threading.Lock()
+
+    def cactus_init(self, model_path, corpus_dir=None):
+        time.sleep(self.local_ms * 5 / 1000)
+        return FakeModel(model_path)
+
+    def cactus_destroy(self, model):
+        pass
+
+    def cactus_reset(self, model):
+        model.kv = []
+
+    def cactus_complete(self, model, messages, tools=None, max_tokens=256, **options):
+        if not model.busy.acquire(blocking=False):
+            raise RuntimeError("fake cactus: model handle used concurrently")
+        try:
+            with self.lock:
+                self.calls += 1
+                failed = self.rng.random() < self.fail_rate
+            tools = [t.get("function", t) for t in (tools or [])]
+            prompt = [("tools", json.dumps(tools))]
+            prompt += [(m.get("role", ""), str(m.get("content", ""))) for m in messages]
+            reused = 0
+            while reused < min(len(prompt), len(model.kv)) and prompt[reused] == model.kv[reused]:
+                reused += 1
+            prompt_tokens = sum(_tokens(text) for _, text in prompt[reused:])
+            cached_tokens = sum(_tokens(text) for _, text in prompt[:reused])
+            model.kv = prompt   # generated tokens follow; the next prompt diverges there
+            with self.lock:
+                self.prefill_tokens += prompt_tokens
+                self.cached_tokens += cached_tokens
+            elapsed_ms = self.local_ms + prompt_tokens * self.prefill_ms_per_token
+            time.sleep(elapsed_ms / 1000)
+            calls = [] if failed else _answer(_user_query(messages), tools)
+            return json.dumps({
+                "success": True,
+                "error": None,
+                "cloud_handoff": False,
+                "response": "",
+                "function_calls": calls,
+                "confidence": 0.9 if calls else 0.2,
+                "total_time_ms": elapsed_ms,
+                "prefill_tokens": prompt_tokens,
+            })
+        finally:
+            model.busy.release()
+
+
+############## Fake Gemini ##############
+
+class _Obj:
+    """Keyword bag standing in for google.genai.types classes."""
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeTypes:
+    """Stands in for `google.genai.types`."""
+    Tool = _Obj
+    FunctionDeclaration = _Obj
+    Schema = _Obj
+    GenerateContentConfig = _Obj
+
+
+def _declared_tools(config):
+    """Turn fake FunctionDeclarations back into the dict tool shape."""
+    tools = []
+    for tool in getattr(config, "tools", None) or []:
+        for fd in tool.function_declarations:
+            params = fd.parameters
+            tools.append({
+                "name": fd.name,
+                "description": fd.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        k: {"type": v.type.lower(), "description": getattr(v, "description", "")}
+                        for k, v in params.properties.items()
+                    },
+                    "required": list(params.required),
+                },
+            })
+    return tools
+
+
+class _FakeModels:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, model=None):
+        time.sleep(self.backend.cloud_ms / 4000)
+        return _Obj(name=model)
+
+    def generate_content(self, model=None, contents=None, config=None):
+        b = self.backend
+        delay, failed, throttled = b._begin(config)
+        try:
+            if throttled:
+                time.sleep(b.cloud_ms / 10000)
+                raise RuntimeError("fake gemini: 429 RESOURCE_EXHAUSTED")
+            time.sleep(delay / 1000)
+        finally:
+            b._end()
+        if failed:
+            raise RuntimeError("fake gemini: 503 UNAVAILABLE")
+        return _response(contents, config)
+
+
+    def generate_content_stream(self, model=None, contents=None, config=None):
+        b = self.backend
+        delay, failed, throttled = b._begin(config)
+        try:
+            if throttled:
+                time.sleep(b.cloud_ms / 10000)
+                raise RuntimeError("fake gemini: 429 RESOURCE_EXHAUSTED")
+            if failed:
+                time.sleep(delay / 1000)
+                raise RuntimeError("fake gemini: 503 UNAVAILABLE")
+            for wait_ms, chunk in _stream_plan(delay, contents, config):
+                time.sleep(wait_ms / 1000)
+                yield chunk
+        except GeneratorExit:
+            with b.lock:
+                b.streams_closed_early += 1
+            raise
+        finally:
+            b._end()
+
+
+class _FakeAsyncModels:
+    """client.aio.models: cancelling the awaiting task aborts the request mid-flight."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def generate_content(self, model=None, contents=None, config=None):
+        b = self.backend
+        delay, failed, throttled = b._begin(config)
+        try:
+            if throttled:
+                await asyncio.sleep(b.cloud_ms / 10000)
+                raise RuntimeError("fake gemini: 429 RESOURCE_EXHAUSTED")
+            await asyncio.sleep(delay / 1000)
+        except asyncio.CancelledError:
+            with b.lock:
+                b.aborted += 1
+            raise
+        finally:
+            b._end()
+        if failed:
+            raise RuntimeError("fake gemini: 503 UNAVAILABLE")
+        return _response(contents, config)
+
+
+    async def generate_content_stream(self, model=None, contents=None, config=None):
+        return self._stream(contents, config)
+
+    async def _stream(self, contents, config):
+        b = self.backend
+        delay, failed, throttled = b._begin(config)
+        try:
+            if throttled:
+                await asyncio.sleep(b.cloud_ms / 10000)
+                raise RuntimeError("fake gemini: 429 RESOURCE_EXHAUSTED")
+            if failed:
+                await asyncio.sleep(delay / 1000)
+                raise RuntimeError("fake gemini: 503 UNAVAILABLE")
+            for wait_ms, chunk in _stream_plan(delay, contents, config):
+                await asyncio.sleep(wait_ms / 1000)
+                yield chunk
+        except asyncio.CancelledError:
+            with b.lock:
+                b.aborted += 1
+            raise
+        except GeneratorExit:
+            with b.lock:
+                b.streams_closed_early += 1
+            raise
+        finally:
+            b._end()
+
+
+def _stream_plan(delay, contents, config):
+    """
+    Chunk schedule for a streamed answer of total latency `delay` ms:
+    the first call at 60%, the rest spread up to 90%, then a final
+    (finish-reason) chunk at 100%. Returns [(sleep_ms, chunk)].
+    """
+    calls = _response(contents, config).candidates[0].content.parts
+    plan = []
+    elapsed = 0.0
+    for i, part in enumerate(calls):
+        at = delay * (0.6 + 0.3 * i / max(1, len(calls) - 1))
+        plan.append((at - elapsed, _Obj(candidates=[_Obj(content=_Obj(parts=[part]))])))
+        elapsed = at
+    plan.append((delay - elapsed, _Obj(candidates=[_Obj(content=_Obj(parts=[]))])))
+    return plan
+
+
+def _response(contents, config):
+    query = " and ".join(c if isinstance(c, str) else str(c) for c in (contents or []))
+    parts = [
+        _Obj(function_call=_Obj(name=c["name"], args=c["arguments"]))
+        for c in _answer(query, _declared_tools(config))
+    ]
+    return _Obj(candidates=[_Obj(content=_Obj(parts=parts))])
+
+
+class FakeClient:
+    def __init__(self, backend):
+        self.models = _FakeModels(backend)
+        self.aio = _Obj(models=_FakeAsyncModels(backend))
+
+
+class FakeGenai:
+    """
+    Stands in for `google.genai`. Latency is cloud_ms * (1 + jitter*U), with an
+    optional slow tail. With concurrency_limit set, requests beyond that many
+    in flight fail fast with a 429, like a per-key rate limit, and each
+    declared tool adds decl_ms_per_tool of prompt processing. Client().aio
+    mirrors the async SDK; `aborted` counts requests cancelled mid-flight.
+    generate_content_stream sends one chunk per function call, then a
+    finish chunk; `streams_closed_early` counts streams dropped before it.
+    """
+
+    def __init__(self, cloud_ms=350.0, jitter=0.3, tail_rate=0.0, tail_factor=5.0, error_rate=0.0,
+                 concurrency_limit=0, decl_ms_per_tool=0.0, seed=0):
+        self.cloud_ms = cloud_ms
+        self.jitter = jitter
+        self.tail_rate = tail_rate
+        self.tail_factor = tail_factor
+        self.error_rate = error_rate
+        self.concurrency_limit = concurrency_limit
+        self.decl_ms_per_tool = decl_ms_per_tool
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.throttled = 0
+        self.aborted = 0
+        self.declared_tools = 0
+        self.declared_bytes = 0
+        self.streams_closed_early = 0
+        self.lock = threading.Lock()
+
+    def _begin(self, config=None):
+        """Count a request in; returns (delay_ms, failed, throttled)."""
+        declared = _declared_tools(config)
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            throttled = bool(self.concurrency_limit) and self.in_flight > self.concurrency_limit
+            if throttled:
+                self.throttled += 1
+            self.declared_tools += len(declared)
+            self.declared_bytes += len(json.dumps(declared))
+            delay = (self.cloud_ms + self.decl_ms_per_tool * len(declared)) * (1 + self.jitter * self.rng.random())
+            if self.rng.random() < self.tail_rate:
+                delay *= self.tail_factor
+            failed = self.rng.random() < self.error_rate
+        return delay, failed, throttled
+
+    def _end(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def Client(self, api_key=None, **kwargs):
+        return FakeClient(self)
+
+
+############## Install ##############
+
+def install(local_ms=40.0, cloud_ms=350.0, local_fail_rate=0.0, cloud_jitter=0.3,
+            cloud_tail_rate=0.0, cloud_tail_factor=5.0, cloud_error_rate=0.0,
+            cloud_concurrency_limit=0, cloud_decl_ms_per_tool=0.0, seed=0):
+    """
+    Point main.py's lazy backend loaders at the fakes. Open sessions drop
+    their model handles and cloud clients and recreate them on the fakes.
+    Returns (fake_cactus, fake_genai) so callers can read counters.
+    """
+    fake_cactus = FakeCactus(local_ms=local_ms, fail_rate=local_fail_rate, seed=seed)
+    fake_genai = FakeGenai(cloud_ms=cloud_ms, jitter=cloud_jitter, tail_rate=cloud_tail_rate,
+                           tail_factor=cloud_tail_factor, error_rate=cloud_error_rate,
+                           concurrency_limit=cloud_concurrency_limit,
+                           decl_ms_per_tool=cloud_decl_ms_per_tool, seed=seed)
+    main._cleanup()
+    main._cactus_mod = fake_cactus
+    main._genai_mod = fake_genai
+    main._genai_types = FakeTypes
+    return fake_cactus, fake_genai
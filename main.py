@@ -2,37 +2,124 @@ import sys
 sys.path.insert(0, "cactus/python/src")
 functiongemma_path = "cactus/weights/functiongemma-270m-it"
 
-import json, os, time, re, string, atexit, concurrent.futures, logging
-from cactus import cactus_init, cactus_complete, cactus_destroy, cactus_reset
-from google import genai
-from google.genai import types
+import json, os, time, re, string, atexit, concurrent.futures, logging, threading, contextlib
+import collections, contextvars, hashlib, heapq, itertools, random, weakref
 
 _log = logging.getLogger("hybrid")
 
 
+# ──────────────────────────────────────────────
+# Lazy backends (cactus bindings and Gemini SDK load on first use)
+# ──────────────────────────────────────────────
+
+_cactus_mod = None
+_genai_mod = None
+_genai_types = None
+
+
+def _cactus():
+    """Import the cactus bindings on first use."""
+    global _cactus_mod
+    if _cactus_mod is None:
+        import cactus
+        _cactus_mod = cactus
+    return _cactus_mod
+
+
+def _genai():
+    """Import google.genai on first use. Returns (genai, types)."""
+    global _genai_mod, _genai_types
+    if _genai_mod is None:
+        from google import genai
+        from google.genai import types
+        _genai_types = types
+        _genai_mod = genai
+    return _genai_mod, _genai_types
+
+
+# ──────────────────────────────────────────────
+# Current session (state lives on a HybridSession, see the end of the file)
+# ──────────────────────────────────────────────
+
+_session_ctx = contextvars.ContextVar("hybrid_session", default=None)
+_live_sessions = weakref.WeakSet()   # every session not yet closed
+_default_session = None
+
+
+def _session():
+    """The HybridSession serving this call: the one bound in this context, else the default."""
+    return _session_ctx.get() or _default_session
+
+
+def _session_bound(fn):
+    """Wrap fn to run against the calling session (for work handed to another thread)."""
+    session = _session()
+
+    def run(*args, **kwargs):
+        token = _session_ctx.set(session)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _session_ctx.reset(token)
+    return run
+
+
 # ──────────────────────────────────────────────
 # Stage hit counters (reset between benchmark runs)
 # ──────────────────────────────────────────────
 
-_stats = {
-    "step4_accepted": 0,
-    "step4_5_accepted": 0,
-    "step5_decomp_full": 0,
-    "step5_decomp_partial": 0,
-    "step6_retry_accepted": 0,
-    "cloud_fallback": 0,
-}
+_STAT_COUNTERS = (
+    "slot_fill_accepted",
+    "step4_accepted",
+    "step4_5_accepted",
+    "step5_decomp_full",
+    "step5_decomp_partial",
+    "step6_retry_accepted",
+    "cloud_fallback",
+    "shed_to_cloud",
+    "admission_step1_only",
+    "stages_pruned",
+    "early_cloud",
+    "route_explore",
+    "route_reordered",
+    "negative_cache_hits",
+    "negative_cache_expired",
+    "singleflight_hybrid_shared",
+    "singleflight_cloud_shared",
+    "cloud_batches",
+    "cloud_batched_requests",
+    "cloud_hedged",
+    "cloud_hedge_won",
+    "cloud_hedge_denied",
+    "circuit_opened",
+    "circuit_short_circuited",
+    "circuit_local_fallback",
+    "cloud_timeouts",
+    "cloud_budget_exhausted",
+    "spec_cloud_started",
+    "spec_cloud_completed",
+    "spec_cloud_aborted",
+    "spec_cloud_wasted_ms",
+    "cloud_shortlisted",
+    "cloud_shortlist_widened",
+    "cloud_tools_dropped",
+    "cloud_decl_bytes_saved",
+    "cloud_stream_early_return",
+    "conversation_turns",
+    "conversation_prefill_incremental",
+    "conversation_prefill_reset",
+    "conversation_calls_dropped",
+)
 
 
 def reset_stats():
-    """Reset all counters. Call before a benchmark run."""
-    for k in _stats:
-        _stats[k] = 0
+    """Reset the current session's counters. Call before a benchmark run."""
+    _session().reset_stats()
 
 
 def get_stats():
-    """Return a copy of current counters."""
-    return dict(_stats)
+    """Return a copy of the current session's counters plus scheduler / cloud gauges."""
+    return _session().get_stats()
 
 
 # ──────────────────────────────────────────────
@@ -188,7 +275,7 @@ def _extract_from_response_field(raw_str, tools):
     return []
 
 
-def _construct_synthetic_call(query, tool):
+def _construct_synthetic_call(ctx, tool):
     """
     Last-resort: construct a function call by extracting parameter values
     directly from the query using the tool schema as a guide.
@@ -217,11 +304,14 @@ def _construct_synthetic_call(query, tool):
         pinfo = props.get(pname, {})
         ptype = pinfo.get("type", "string")
 
-        if ptype == "integer":
-            # Extract the first number from the query
-            m = re.search(r'(\d+)', query)
-            if m:
-                args[pname] = int(m.group(1))
+        slot = _slot_value(ctx, tool, pname)
+        if slot is not None:
+            args[pname] = slot
+
+        elif ptype == "integer":
+            # The first number in the query
+            if ctx.numbers:
+                args[pname] = ctx.numbers[0]
 
         elif ptype == "string":
             pdesc = pinfo.get("description", "").lower()
@@ -232,15 +322,14 @@ def _construct_synthetic_call(query, tool):
                 "name" in pdesc and any(w in pdesc for w in ("person", "contact", "search"))
             )
             if is_person_name:
-                names = re.findall(r'\b([A-Z][a-z]+)\b', query)
                 # Filter out stop words (capitalized at sentence start)
-                names = [n for n in names if n.lower() not in stop and n.lower() not in tool_keywords]
+                names = [n for n in ctx.names if n.lower() not in stop and n.lower() not in tool_keywords]
                 if names:
                     args[pname] = names[0]
 
             # For "message" fields: extract text after "saying"
             elif pname == "message":
-                m = re.search(r'\bsaying\s+(.+?)(?:\s+and\s+|[.]?\s*$)', query, re.IGNORECASE)
+                m = re.search(r'\bsaying\s+(.+?)(?:\s+and\s+|[.]?\s*$)', ctx.text, re.IGNORECASE)
                 if m:
                     args[pname] = m.group(1).strip().rstrip('.')
 
@@ -248,9 +337,8 @@ def _construct_synthetic_call(query, tool):
             # Remove stop words and standalone tool keywords; keep tool keywords
             # that follow a content word (part of a phrase like "classical music")
             elif len(required) == 1:
-                words = query.split()
                 value_words = []
-                for w in words:
+                for w in ctx.tokens:
                     clean = _strip_punct(w).lower()
                     # Normalize contractions: "how's"→"hows", "what's"→"whats"
                     clean_norm = clean.replace("'", "").replace("\u2019", "")
@@ -273,28 +361,341 @@ def _construct_synthetic_call(query, tool):
 
 
 # ──────────────────────────────────────────────
-# Global model cache (saves ~100-200ms per call)
+# Request options (priority class + deadline, context-local)
+# ──────────────────────────────────────────────
+
+PRIORITY_INTERACTIVE = 0   # a person is waiting (saas_assistant.py)
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2         # offline / bulk jobs
+
+# Default per-request deadline; unset means no admission control
+_DEFAULT_DEADLINE_MS = float(os.environ.get("HYBRID_DEADLINE_MS", "0")) or None
+
+
+class _RequestState:
+    """Per-request settings and counters, carried in a ContextVar."""
+
+    __slots__ = ("priority", "deadline_ms", "arrival", "start", "local_calls", "pruned", "cloud_now",
+                 "neg_key", "local_exhausted", "cloud_spec", "conversation")
+
+    def __init__(self, priority=PRIORITY_NORMAL, deadline_ms=None, arrival=None):
+        self.priority = priority
+        self.deadline_ms = deadline_ms
+        self.arrival = arrival  # time.time() the request arrived (queued), if known
+        self.start = arrival if arrival is not None else time.time()
+        self.local_calls = 0
+        self.pruned = []        # cascade stages skipped to meet the deadline
+        self.cloud_now = False  # only cloud can still meet the deadline
+        self.neg_key = None     # negative-cache key for this query
+        self.local_exhausted = False  # every local stage ran and failed
+        self.cloud_spec = None  # speculative cloud call, aborted if still unused at the end
+        self.conversation = None  # Conversation whose handle runs STEP 1 over the whole history
+
+    def elapsed_ms(self):
+        return (time.time() - self.start) * 1000
+
+    def remaining_ms(self):
+        return self.deadline_ms - self.elapsed_ms()
+
+
+_request_ctx = contextvars.ContextVar("hybrid_request", default=None)
+
+
+@contextlib.contextmanager
+def request_options(priority=None, deadline_ms=None, start=None):
+    """
+    Set the priority class and/or deadline for generate_hybrid calls made
+    inside this block (the benchmark signature stays unchanged). `start`
+    is the time.time() the request arrived, e.g. when a server queued it;
+    the deadline then runs from there, so time spent queued counts.
+    Without it each call's deadline runs from the call itself.
+
+        with request_options(priority=PRIORITY_INTERACTIVE, deadline_ms=800):
+            generate_hybrid(messages, tools)
+    """
+    outer = _request_ctx.get()
+    state = _RequestState(
+        priority if priority is not None else (outer.priority if outer else PRIORITY_NORMAL),
+        deadline_ms if deadline_ms is not None else (outer.deadline_ms if outer else None),
+        start if start is not None else (outer.arrival if outer else None),
+    )
+    token = _request_ctx.set(state)
+    try:
+        yield state
+    finally:
+        _request_ctx.reset(token)
+
+
+def _begin_request():
+    """Fresh request state for one generate_hybrid call, inheriting request_options()."""
+    outer = _request_ctx.get()
+    if outer is None:
+        return _RequestState(PRIORITY_NORMAL, _DEFAULT_DEADLINE_MS)
+    return _RequestState(outer.priority, outer.deadline_ms or _DEFAULT_DEADLINE_MS, outer.arrival)
+
+
+# ──────────────────────────────────────────────
+# Model pool + scheduler, one per session (saves ~100-200ms per call)
 # ──────────────────────────────────────────────
 
-_fg_model = None
+# Default number of FunctionGemma handles per session; each serves one completion at a time
+_MODEL_HANDLES = max(1, int(os.environ.get("HYBRID_MODEL_HANDLES", "1")))
+
+
+class _LocalScheduler:
+    """
+    Owns the FunctionGemma handles and hands them to waiting completions
+    in (priority, arrival) order. Keeps running estimates of per-completion
+    service time and completions per request so callers can project how
+    long a new request would wait.
+    """
+
+    def __init__(self, max_handles=_MODEL_HANDLES):
+        self.max_handles = max_handles
+        self.lock = threading.Lock()
+        self.handles = []     # every handle created so far (for cleanup)
+        self.dedicated = []   # handles owned elsewhere (conversations) whose completions are counted here
+        self.idle = []        # LIFO keeps the hottest handle busy
+        self.creating = 0
+        self.waiters = []     # heap of (priority, seq, event, slot)
+        self.seq = itertools.count()
+        self.service_ms = 150.0        # EWMA of one local completion
+        self.calls_per_request = 2.0   # EWMA of completions per generate_hybrid
+        self.wait_ms_total = 0.0
+        self.waits = 0
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """Return an idle handle, creating one if under the limit, else wait our turn."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            create = len(self.handles) + self.creating < self.max_handles
+            if create:
+                self.creating += 1
+            else:
+                event, slot = threading.Event(), []
+                heapq.heappush(self.waiters, (priority, next(self.seq), event, slot))
+        if create:
+            try:
+                model = _cactus().cactus_init(functiongemma_path)
+            finally:
+                with self.lock:
+                    self.creating -= 1
+            with self.lock:
+                self.handles.append(model)
+            return model
+        t0 = time.time()
+        event.wait()
+        with self.lock:
+            self.wait_ms_total += (time.time() - t0) * 1000
+            self.waits += 1
+        return slot[0]
+
+    def release(self, model):
+        """Hand the handle straight to the most urgent waiter, or park it."""
+        with self.lock:
+            if self.waiters:
+                _, _, event, slot = heapq.heappop(self.waiters)
+                slot.append(model)
+                event.set()
+            else:
+                self.idle.append(model)
+
+    def add_dedicated(self, model):
+        with self.lock:
+            self.dedicated.append(model)
+
+    def remove_dedicated(self, model):
+        with self.lock:
+            if model in self.dedicated:
+                self.dedicated.remove(model)
+
+    def record_service(self, ms):
+        with self.lock:
+            self.service_ms += 0.2 * (ms - self.service_ms)
+
+    def record_request(self, local_calls):
+        with self.lock:
+            self.calls_per_request += 0.2 * (local_calls - self.calls_per_request)
+
+    def projected_wait_ms(self, priority):
+        """Expected queue wait for one completion submitted now at this priority."""
+        with self.lock:
+            if self.idle or len(self.handles) + self.creating < self.max_handles:
+                return 0.0
+            ahead = sum(1 for w in self.waiters if w[0] <= priority)
+            return (ahead + 0.5) / self.max_handles * self.service_ms
+
+    def drain(self):
+        """Forget all handles and return them (caller destroys)."""
+        with self.lock:
+            handles = list(self.handles)
+            self.handles.clear()
+            self.idle.clear()
+            return handles
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "local_handles": len(self.handles),
+                "local_dedicated_handles": len(self.dedicated),
+                "local_waiting": len(self.waiters),
+                "local_service_ms": round(self.service_ms, 1),
+                "local_calls_per_request": round(self.calls_per_request, 2),
+                "local_queue_wait_ms_avg": round(self.wait_ms_total / self.waits, 1) if self.waits else 0.0,
+            }
+
+
+@contextlib.contextmanager
+def _acquire_model():
+    """Check out a model handle for one completion (in priority order) and return it."""
+    state = _request_ctx.get()
+    scheduler = _session().scheduler
+    model = scheduler.acquire(state.priority if state else PRIORITY_NORMAL)
+    try:
+        with _counted_completion():
+            yield model
+    finally:
+        scheduler.release(model)
+
+
+@contextlib.contextmanager
+def _counted_completion():
+    """Service-time and per-request accounting for one local completion, pooled or dedicated."""
+    state = _request_ctx.get()
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        _session().scheduler.record_service((time.time() - t0) * 1000)
+        if state is not None:
+            state.local_calls += 1
+
 
+def _load_all_models():
+    """Create every handle up front and return them, checked out. Caller must release them."""
+    scheduler = _session().scheduler
+    return [scheduler.acquire(PRIORITY_INTERACTIVE) for _ in range(scheduler.max_handles)]
 
-def _get_model():
-    """Lazy-init FunctionGemma model; reuse across all calls."""
-    global _fg_model
-    if _fg_model is None:
-        _fg_model = cactus_init(functiongemma_path)
-    return _fg_model
+
+def _get_cloud_client():
+    """Lazy-init the session's Gemini client; reused so its HTTP connection stays open."""
+    session = _session()
+    if session.cloud_client is None:
+        genai, _ = _genai()
+        session.cloud_client = genai.Client(api_key=session.api_key or os.environ.get("GEMINI_API_KEY"))
+    return session.cloud_client
 
 
 def _cleanup():
-    global _fg_model
-    if _fg_model is not None:
-        cactus_destroy(_fg_model)
-        _fg_model = None
+    """Release the model handles and cloud clients of every open session (backend swap)."""
+    for session in list(_live_sessions):
+        session.release_backends()
+
+
+def _close_sessions():
+    for session in list(_live_sessions):
+        session.close()
+
+
+atexit.register(_close_sessions)
+
+
+# ──────────────────────────────────────────────
+# Warm-up (model load + throwaway prefill off the request path)
+# ──────────────────────────────────────────────
+
+# Used when warmup() is called without a tool set
+_WARMUP_TOOL = {
+    "name": "get_weather",
+    "description": "Get current weather for a location",
+    "parameters": {
+        "type": "object",
+        "properties": {"location": {"type": "string", "description": "City name"}},
+        "required": ["location"],
+    },
+}
+
+
+def _warmup_locked(tools):
+    """Do the warm-up work. Caller must hold the session's warmup_lock."""
+    tools = tools or [_WARMUP_TOOL]
+    timings = {}
+
+    t0 = time.time()
+    models = _load_all_models()
+    timings["model_load_ms"] = (time.time() - t0) * 1000
+
+    # Throwaway completions with each system prompt the cascade uses, on every handle
+    t0 = time.time()
+    probe = [{"role": "user", "content": "hello"}]
+    try:
+        for t in tools:
+            _get_tool_keywords(t)
+        for model in models:
+            _complete_local(model, probe, tools, 8, _DEFAULT_PROMPT)
+            _complete_local(model, probe, tools[:1], 8, _SINGLE_CALL_PROMPT)
+            for t in tools:
+                _complete_local(model, probe, [t], 8, _build_rich_prompt(t))
+            _cactus().cactus_reset(model)
+    finally:
+        for model in models:
+            _session().scheduler.release(model)
+    timings["prefill_ms"] = (time.time() - t0) * 1000
+
+    # Import the SDK and open the connection the fallback path will reuse
+    timings["cloud_ms"] = 0
+    if os.environ.get("GEMINI_API_KEY") and _session().cloud_proxy is None:
+        t0 = time.time()
+        try:
+            _get_cloud_client().models.get(model="gemini-2.5-flash")
+        except Exception as e:
+            _log.info("  [WARMUP] cloud warm-up failed: %s", e)
+        timings["cloud_ms"] = (time.time() - t0) * 1000
+
+    _log.info("  [WARMUP] done: %s", timings)
+    return timings
+
+
+def warmup(tools=None):
+    """
+    Load the model, run throwaway completions against the cascade's system
+    prompts and the given tool set, and open the cloud connection, so the
+    first real request sees steady-state latency.
+    Returns a dict of timings in ms.
+    """
+    with _session().warmup_lock:
+        return _warmup_locked(tools)
 
 
-atexit.register(_cleanup)
+def warmup_async(tools=None):
+    """
+    Start warm-up in a background thread and return the thread.
+    The lock is taken before returning, so requests made right after
+    this call wait for warm-up instead of racing it.
+    """
+    lock = _session().warmup_lock
+    lock.acquire()
+
+    def run():
+        try:
+            _warmup_locked(tools)
+        except Exception as e:
+            _log.warning("  [WARMUP] failed: %s", e)
+        finally:
+            lock.release()
+
+    thread = threading.Thread(target=_session_bound(run), name="hybrid-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def _wait_for_warmup():
+    """Block until an in-progress warm-up of the current session finishes."""
+    lock = _session().warmup_lock
+    if lock.locked():
+        with lock:
+            pass
 
 
 # ──────────────────────────────────────────────
@@ -302,16 +703,20 @@ atexit.register(_cleanup)
 # ──────────────────────────────────────────────
 
 def _run_local(messages, tools, max_tokens=360, system_prompt=None):
-    """Run FunctionGemma on the cached model."""
-    model = _get_model()
-    cactus_reset(model)
-
+    """Run FunctionGemma on a pooled model handle."""
     if system_prompt is None:
         system_prompt = _DEFAULT_PROMPT
+    with _acquire_model() as model:
+        raw_str = _complete_local(model, messages, tools, max_tokens, system_prompt)
+    return _parse_local_output(raw_str, tools)
 
-    cactus_tools = [{"type": "function", "function": t} for t in tools]
 
-    raw_str = cactus_complete(
+def _complete_local(model, messages, tools, max_tokens, system_prompt):
+    """Reset the handle and run one raw cactus completion."""
+    cactus = _cactus()
+    cactus.cactus_reset(model)
+    cactus_tools = [{"type": "function", "function": t} for t in tools]
+    return cactus.cactus_complete(
         model,
         [{"role": "system", "content": system_prompt}] + messages,
         tools=cactus_tools,
@@ -320,6 +725,12 @@ def _run_local(messages, tools, max_tokens=360, system_prompt=None):
         stop_sequences=["<|im_end|>", "<end_of_turn>"],
     )
 
+
+def _parse_local_output(raw_str, tools):
+    """
+    Turn a raw cactus_complete string into a result dict.
+    Sanitizes broken JSON, then falls back to response-field and regex recovery.
+    """
     # ── Parse JSON (with sanitization fallback) ──
     raw = None
     try:
@@ -376,11 +787,139 @@ def _run_local(messages, tools, max_tokens=360, system_prompt=None):
 # Structural validation (lightweight, zero-latency)
 # ──────────────────────────────────────────────
 
+# Per-tool validators are generated as Python source from the parameter
+# schema (in the spirit of fastjsonschema) and cached per session (tool name
+# → (parameters dict, validator)): each returns None or an issue type,
+# coercing repairable values in place.
+_BOOL_WORDS = {"true": True, "false": False, "yes": True, "no": False, "1": True, "0": False}
+
+
+class _SchemaCodegen:
+    """Emit the body of one validator; constants (enums) go into the namespace."""
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {"_BOOL_WORDS": _BOOL_WORDS}
+        self.names = itertools.count()
+
+    def emit(self, indent, line):
+        self.lines.append("    " * indent + line)
+
+    def const(self, value):
+        name = "_c%d" % next(self.names)
+        self.namespace[name] = value
+        return name
+
+    def properties(self, schema, obj, indent, depth):
+        """Required keys first, then each known property of dict `obj`."""
+        for req in schema.get("required", []):
+            self.emit(indent, "if %r not in %s: return 'missing_arg'" % (req, obj))
+        for key, prop in schema.get("properties", {}).items():
+            var = "v%d" % depth
+            self.emit(indent, "if %r in %s:" % (key, obj))
+            self.emit(indent + 1, "%s = %s[%r]" % (var, obj, key))
+            if not self.value(prop, var, "%s[%r]" % (obj, key), indent + 1, depth):
+                self.emit(indent + 1, "pass")
+
+    def value(self, schema, var, target, indent, depth):
+        """Check `var` (stored at `target`) against schema; returns whether code was emitted."""
+        start = len(self.lines)
+        kind = schema.get("type")
+        if kind == "string":
+            self.emit(indent, "if not isinstance(%s, str): return 'bad_type'" % var)
+        elif kind == "integer":
+            self.emit(indent, "if not isinstance(%s, int):" % var)
+            self.emit(indent + 1, "try: %s = %s = int(float(%s))" % (target, var, var))
+            self.emit(indent + 1, "except (ValueError, TypeError, OverflowError): return 'bad_type'")
+        elif kind == "number":
+            self.emit(indent, "if isinstance(%s, bool): return 'bad_type'" % var)
+            self.emit(indent, "if not isinstance(%s, (int, float)):" % var)
+            self.emit(indent + 1, "try: %s = %s = float(%s)" % (target, var, var))
+            self.emit(indent + 1, "except (ValueError, TypeError, OverflowError): return 'bad_type'")
+        elif kind == "boolean":
+            self.emit(indent, "if not isinstance(%s, bool):" % var)
+            self.emit(indent + 1, "%s = _BOOL_WORDS.get(str(%s).strip().lower())" % (var, var))
+            self.emit(indent + 1, "if %s is None: return 'bad_type'" % var)
+            self.emit(indent + 1, "%s = %s" % (target, var))
+        elif kind == "array":
+            # A lone value where a list is expected becomes a one-item list
+            self.emit(indent, "if not isinstance(%s, list): %s = %s = [%s]" % (var, target, var, var))
+            if "items" in schema:
+                item, idx = "v%d" % (depth + 1), "i%d" % (depth + 1)
+                self.emit(indent, "for %s, %s in enumerate(%s):" % (idx, item, var))
+                if not self.value(schema["items"], item, "%s[%s]" % (var, idx), indent + 1, depth + 1):
+                    self.lines.pop()
+        elif kind == "object":
+            self.emit(indent, "if not isinstance(%s, dict): return 'bad_type'" % var)
+            self.properties(schema, var, indent, depth + 1)
+        if "enum" in schema:
+            allowed = self.const(frozenset(schema["enum"]))
+            folded = self.const({v.lower(): v for v in schema["enum"] if isinstance(v, str)})
+            # Case-insensitive match repairs to the canonical spelling; lists/dicts are unhashable
+            self.emit(indent, "if not isinstance(%s, (str, int, float, bool)) or %s not in %s:"
+                      % (var, var, allowed))
+            self.emit(indent + 1, "%s = %s.get(%s.lower()) if isinstance(%s, str) else None"
+                      % (var, folded, var, var))
+            self.emit(indent + 1, "if %s is None: return 'bad_enum'" % var)
+            self.emit(indent + 1, "%s = %s" % (target, var))
+        return len(self.lines) > start
+
+
+def _compile_validator(parameters):
+    """Generate fn(args) -> None | issue for one tool's parameter schema."""
+    gen = _SchemaCodegen()
+    gen.properties(parameters, "args", 1, 0)
+    source = "def validate(args):\n" + "\n".join(gen.lines + ["    return None"])
+    exec(compile(source, "<validator>", "exec"), gen.namespace)
+    validate = gen.namespace["validate"]
+    validate.source = source
+    return validate
+
+
+class _SchemaCache:
+    """
+    Artefacts compiled per tool schema, keyed by tool name. A call with the
+    schema dict last compiled under that name, or with one of the few equal
+    dicts already seen (held by reference, so their ids cannot be reused),
+    is a lookup by identity. A new equal dict is compared once and then
+    remembered, so callers that rebuild their tool dicts per request pay one
+    comparison per dict instead of one per call.
+    """
+
+    def __init__(self, compile_fn, max_aliases=8):
+        self.compile_fn = compile_fn
+        self.max_aliases = max_aliases
+        self.by_name = {}   # name → (schema, artefact, {id: equal schema dict})
+
+    def get(self, name, schema):
+        entry = self.by_name.get(name)
+        if entry is not None:
+            compiled_for, artefact, aliases = entry
+            if schema is compiled_for or (id(schema) in aliases and aliases[id(schema)] is schema):
+                return artefact
+            if schema == compiled_for:
+                if len(aliases) >= self.max_aliases:
+                    aliases.clear()
+                aliases[id(schema)] = schema
+                return artefact
+        artefact = self.compile_fn(name, schema)
+        self.by_name[name] = (schema, artefact, {})
+        return artefact
+
+    def clear(self):
+        self.by_name.clear()
+
+
+def _schema_validator(tool):
+    return _session().validators.get(tool["name"], tool["parameters"])
+
+
 def _validate(result, tools):
     """
-    Check tool calls are structurally valid.
+    Check tool calls are structurally valid against their schemas.
     Returns (is_valid, issue_type).
-    Auto-repairs string->int casts in place.
+    Auto-repairs castable values (string->int/number/boolean, enum case,
+    lone value -> array) in place.
     """
     calls = result.get("function_calls", [])
     if not calls:
@@ -389,29 +928,12 @@ def _validate(result, tools):
     tool_map = {t["name"]: t for t in tools}
 
     for call in calls:
-        name = call.get("name", "")
-        if name not in tool_map:
+        tool = tool_map.get(call.get("name", ""))
+        if tool is None:
             return False, "bad_tool_name"
-
-        schema = tool_map[name]
-        args = call.get("arguments", {})
-        required = schema["parameters"].get("required", [])
-
-        for req in required:
-            if req not in args:
-                return False, "missing_arg"
-
-        props = schema["parameters"].get("properties", {})
-        for key, val in list(args.items()):
-            if key in props and props[key].get("type") == "integer":
-                if not isinstance(val, int):
-                    try:
-                        call["arguments"][key] = int(float(val))
-                    except (ValueError, TypeError):
-                        return False, "bad_type"
-            if key in props and props[key].get("type") == "string":
-                if not isinstance(val, str):
-                    return False, "bad_type"
+        issue = _schema_validator(tool)(call.get("arguments", {}))
+        if issue:
+            return False, issue
 
     return True, None
 
@@ -420,115 +942,225 @@ def _validate(result, tools):
 # Value-fixing heuristics (zero-latency F1 boost)
 # ──────────────────────────────────────────────
 
-_TIME_PATTERN = re.compile(r'(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)?')
-_HOUR_PATTERN = re.compile(r'(\d{1,2})\s*(AM|PM|am|pm)')
-_MINUTES_PATTERN = re.compile(r'(\d+)\s*minute')
 _REMINDER_TIME_PATTERN = re.compile(r'at\s+(\d{1,2}:\d{2}\s*(?:AM|PM|am|pm)?)', re.IGNORECASE)
 _REMINDER_TITLE_PATTERN = re.compile(
     r'(?:remind\s+me\s+(?:about|to)\s+)(.+?)(?:\s+at\s+\d)',
     re.IGNORECASE,
 )
+# "remind me [in two hours] to ..." for titles ended by a parsed time expression
+_REMINDER_LEAD_PATTERN = re.compile(r'\bremind\s+me\s+(?:(?:in|at)\s+.+?\s+)?(?:about|to)\s+', re.IGNORECASE)
+_TITLE_TAIL_PATTERN = re.compile(r'[\s,]+(?:at|in|on|by|for)?\s*$', re.IGNORECASE)
+_TIMER_KEYWORD = re.compile(r'\btimer\b', re.IGNORECASE)
+
+
+_FILLER_PATTERN = re.compile(
+    r'\s+(?:in\s+(?:my\s+)?contacts?|from\s+\w+|\'s?\s+name).*$', re.IGNORECASE,
+)
+_SOME_PATTERN = re.compile(r'\bsome\b', re.IGNORECASE)
+_ARTICLE_PATTERN = re.compile(r'^(the|a|an)\s+', re.IGNORECASE)
+
+# Rules run in ascending order. Parameter rules are bound to schema keys when
+# a tool's fixer is compiled; tool rules fix whole argument dicts by tool name.
+_PARAM_RULES = []                              # (order, binds(key, prop), fn(value, ctx) -> value)
+_TOOL_RULES = collections.defaultdict(list)    # tool name (None = all) → [(order, fn(args, ctx))]
+# Compiled rule lists live in each session's `fixers` (a _SchemaCache): tool name and its
+# parameters dict (None without a schema) → rules
+
+
+def _clear_fixer_caches():
+    for session in list(_live_sessions):
+        session.fixers.clear()
+
+
+def param_fixer(binds, order=50):
+    """
+    Decorator: register fn(value, ctx) -> value for every parameter where
+    binds(key, prop) is true; ctx is the QueryContext. Binding is decided
+    once per tool schema.
+    """
+    def register(fn):
+        _PARAM_RULES.append((order, binds, fn))
+        _clear_fixer_caches()
+        return fn
+    return register
+
+
+def value_fixer(tool_name, order=40):
+    """
+    Decorator: register fn(args, ctx) to fix the arguments of every
+    `tool_name` call (every call when None) in place, typically by
+    re-extracting slots from the QueryContext.
+    """
+    def register(fn):
+        _TOOL_RULES[tool_name].append((order, fn))
+        _clear_fixer_caches()
+        return fn
+    return register
+
+
+def _bind_param_rule(fn, keys):
+    def apply(args, ctx):
+        for key in keys:
+            if key in args:
+                args[key] = fn(args[key], ctx)
+    return apply
+
 
+def _compile_fixer(name, tool):
+    """Ordered fn(args, ctx) list for one tool; cached per (name, schema) in the session."""
+    return _session().fixers.get(name, tool["parameters"] if tool else None)
 
-def _fix_values(result, tools, query):
+
+def _bind_fixer_rules(name, parameters):
+    props = parameters.get("properties", {}) if parameters else {}
+    bound = []
+    for order, binds, fn in _PARAM_RULES:
+        keys = tuple(k for k, p in props.items() if binds(k, p))
+        if keys:
+            bound.append((order, _bind_param_rule(fn, keys)))
+    bound.extend(_TOOL_RULES.get(None, ()))
+    bound.extend(_TOOL_RULES.get(name, ()))
+    bound.sort(key=lambda r: r[0])
+    return tuple(fn for _, fn in bound)
+
+
+# ── Built-in rules ──
+
+@param_fixer(lambda key, prop: prop.get("type") == "string", order=10)
+def _unwrap_list(val, ctx):
+    # Model sometimes returns ["val"] instead of "val"
+    return str(val[0]) if isinstance(val, list) and val else val
+
+
+@value_fixer(None, order=20)
+def _strip_punctuation(args, ctx):
+    # Every string argument, in the schema or not
+    for key, val in args.items():
+        if isinstance(val, str):
+            args[key] = val.strip().rstrip(".!?,;:")
+
+
+@param_fixer(lambda key, prop: prop.get("type") == "integer", order=30)
+def _abs_int(val, ctx):
+    return abs(val) if isinstance(val, int) and val < 0 else val
+
+
+@param_fixer(lambda key, prop: "name" in prop.get("description", "").lower()
+             or key in ("query", "recipient"), order=50)
+def _strip_filler(val, ctx):
+    # "Tom in my contacts" → "Tom", "Alice from work" → "Alice"
+    if not isinstance(val, str):
+        return val
+    cleaned = _FILLER_PATTERN.sub('', val).strip()
+    return cleaned if cleaned and len(cleaned) < len(val) else val
+
+
+@value_fixer("set_alarm")
+def _fix_alarm(args, ctx):
+    if ctx.times:
+        args["hour"], args["minute"] = ctx.times[0].hour, ctx.times[0].minute
+
+
+@value_fixer("set_timer")
+def _fix_timer(args, ctx):
+    # The timer's own duration: "timer for 5 minutes", else "a 15 minute timer"
+    m = _TIMER_KEYWORD.search(ctx.text)
+    if not m:
+        return
+    spans = [d for d in ctx.durations if not d.relative]
+    after = [d for d in spans if d.start > m.start()]
+    before = [d for d in spans if d.start < m.start()]
+    dur = after[0] if after else before[-1] if before else None
+    if dur and dur.seconds % 60 == 0:
+        args["minutes"] = dur.seconds // 60
+
+
+@value_fixer("play_music")
+def _fix_music(args, ctx):
+    # "play some X music" → genre is X, strip filler "music"
+    song = args.get("song", "")
+    if song.lower().endswith(" music") and len(song.split()) >= 2 and _SOME_PATTERN.search(ctx.text):
+        args["song"] = song.rsplit(" ", 1)[0].strip()
+
+
+# After the name cleanup: a title re-extracted from the query is final
+@value_fixer("create_reminder", order=60)
+def _fix_reminder(args, ctx):
+    m = _REMINDER_TIME_PATTERN.search(ctx.text)
+    if m:
+        args["time"] = m.group(1).strip()
+    elif ctx.time_strings:
+        args["time"] = ctx.time_strings[0]
+    m = _REMINDER_TITLE_PATTERN.search(ctx.text)
+    if m:
+        args["title"] = _ARTICLE_PATTERN.sub('', m.group(1).strip())
+        return
+    m = _REMINDER_LEAD_PATTERN.search(ctx.text)
+    if m:
+        # Up to the next time expression ("... at noon", "... in an hour") or segment boundary
+        ends = [s.start for s in ctx.times if s.start >= m.end()]
+        ends += [d.start for d in ctx.durations if d.relative and d.start >= m.end()]
+        ends += [b.start() for b in _SPLIT_PATTERN.finditer(ctx.text) if b.start() >= m.end()]
+        title = ctx.text[m.end():min(ends, default=len(ctx.text))]
+        title = _TITLE_TAIL_PATTERN.sub('', title).strip().rstrip(".!?,;:")
+        if title:
+            args["title"] = _ARTICLE_PATTERN.sub('', title)
+
+
+def _call_contexts(calls, tool_map, ctx):
+    """
+    The context each call's rules read: on a multi-action query, the most
+    relevant segment for the call's tool not already claimed by an earlier
+    call, so one action's slots never overwrite another's. Reuses the
+    segment contexts the request built for routing; None when the query
+    has a single segment.
     """
-    Fix common FunctionGemma value errors:
-    - Negative integers -> abs()
-    - set_alarm hour/minute -> parse from query
-    - set_timer minutes -> parse from query
-    - Strip trailing punctuation from string args
+    subs = ctx.segment_contexts()
+    if len(subs) <= 1:
+        return None
+    expanded = [_expand_query_words(sub.words) for sub in subs]
+    taken, out = set(), []
+    for call in calls:
+        tool = tool_map.get(call.get("name", ""))
+        best, best_rank = None, None
+        if tool is not None:
+            kw = _get_tool_keywords(tool)
+            for i, words in enumerate(expanded):
+                score = len(words & kw)
+                rank = (i not in taken, score)
+                if score and (best_rank is None or rank > best_rank):
+                    best, best_rank = i, rank
+        if best is None:
+            out.append(ctx)
+        else:
+            taken.add(best)
+            out.append(subs[best])
+    return out
+
+
+def _fix_values(result, tools, ctx):
+    """
+    Fix common FunctionGemma value errors by running the rules compiled for
+    each call's tool: key/whitespace cleanup, list -> string, trailing
+    punctuation, negative integers, filler phrases, slot re-extraction.
+    Slots are re-extracted from the segment the call answers.
     """
-    for call in result.get("function_calls", []):
+    calls = result.get("function_calls", [])
+    if not calls:
+        return
+    tool_map = {t["name"]: t for t in tools}
+    call_ctxs = _call_contexts(calls, tool_map, ctx)
+    for i, call in enumerate(calls):
+        call_ctx = call_ctxs[i] if call_ctxs else ctx
         name = call.get("name", "")
         args = call.get("arguments", {})
 
         # Strip whitespace from argument keys (model sometimes outputs "location " instead of "location")
-        clean_args = {k.strip(): v for k, v in args.items()}
-        if clean_args != args:
-            call["arguments"] = clean_args
-            args = call["arguments"]
-
-        # Fix list-typed string arguments (model sometimes returns ["val"] instead of "val")
-        tool = next((t for t in tools if t["name"] == name), None)
-        if tool:
-            props = tool["parameters"].get("properties", {})
-            for key, val in list(args.items()):
-                if key in props and props[key].get("type") == "string" and isinstance(val, list) and val:
-                    args[key] = str(val[0])
-
-        # Strip trailing punctuation from all string arguments
-        for key, val in list(args.items()):
-            if isinstance(val, str):
-                args[key] = val.strip().rstrip(".!?,;:")
-
-        # Fix negative integers
-        tool = next((t for t in tools if t["name"] == name), None)
-        if tool:
-            props = tool["parameters"].get("properties", {})
-            for key, val in list(args.items()):
-                if key in props and props[key].get("type") == "integer" and isinstance(val, int):
-                    if val < 0:
-                        args[key] = abs(val)
-
-        # Fix alarm values by parsing query
-        if name == "set_alarm":
-            m = _TIME_PATTERN.search(query)
-            if m:
-                hour = int(m.group(1))
-                minute = int(m.group(2))
-                if m.group(3) and m.group(3).upper() == "PM" and hour < 12:
-                    hour += 12
-                args["hour"] = hour
-                args["minute"] = minute
-            else:
-                m = _HOUR_PATTERN.search(query)
-                if m:
-                    hour = int(m.group(1))
-                    if m.group(2).upper() == "PM" and hour < 12:
-                        hour += 12
-                    args["hour"] = hour
-                    args["minute"] = 0
-
-        # Fix timer values by parsing query
-        if name == "set_timer":
-            m = _MINUTES_PATTERN.search(query)
-            if m:
-                args["minutes"] = int(m.group(1))
-
-        # Fix play_music: "play some X music" → genre is X, strip filler "music"
-        if name == "play_music":
-            song = args.get("song", "")
-            if (song.lower().endswith(" music")
-                    and len(song.split()) >= 2
-                    and re.search(r'\bsome\b', query, re.IGNORECASE)):
-                args["song"] = song.rsplit(" ", 1)[0].strip()
-
-        # Fix name/query string params: strip filler context the model may include
-        # e.g. "Tom in my contacts" → "Tom", "Alice from work" → "Alice"
-        if tool:
-            props = tool["parameters"].get("properties", {})
-            for key, val in list(args.items()):
-                if isinstance(val, str) and key in props:
-                    pdesc = props[key].get("description", "").lower()
-                    if "name" in pdesc or key in ("query", "recipient"):
-                        # Strip trailing filler phrases
-                        cleaned = re.sub(
-                            r'\s+(?:in\s+(?:my\s+)?contacts?|from\s+\w+|\'s?\s+name).*$',
-                            '', val, flags=re.IGNORECASE,
-                        ).strip()
-                        if cleaned and len(cleaned) < len(val):
-                            args[key] = cleaned
-
-        # Fix reminder time and title by parsing query
-        if name == "create_reminder":
-            m = _REMINDER_TIME_PATTERN.search(query)
-            if m:
-                args["time"] = m.group(1).strip()
-            m = _REMINDER_TITLE_PATTERN.search(query)
-            if m:
-                title = m.group(1).strip()
-                title = re.sub(r'^(the|a|an)\s+', '', title, flags=re.IGNORECASE)
-                args["title"] = title
+        if any(k != k.strip() for k in args):
+            args = call["arguments"] = {k.strip(): v for k, v in args.items()}
+
+        for rule in _compile_fixer(name, tool_map.get(name)):
+            rule(args, call_ctx)
 
 
 # ──────────────────────────────────────────────
@@ -551,10 +1183,10 @@ _TOOL_DISCRIMINATORS = {
 }
 
 
-def _tool_matches_query(call, query):
+def _tool_matches_query(call, ctx):
     """Reject if the query clearly refers to a different tool than predicted."""
     tool_name = call.get("name", "")
-    query_words = {_strip_punct(w) for w in query.lower().split()} - {""}
+    query_words = ctx.words
 
     own = _TOOL_DISCRIMINATORS.get(tool_name, set())
     if query_words & own:
@@ -569,18 +1201,18 @@ def _tool_matches_query(call, query):
     return True
 
 
-def _check_args(call, query):
+def _check_args(call, ctx):
     """
     Heuristic check: do the argument values look plausible given the query?
     Returns None if OK, or a reason string if the args look hallucinated.
     """
     # Tool-query consistency: reject if query clearly refers to a different tool
-    if not _tool_matches_query(call, query):
+    if not _tool_matches_query(call, ctx):
         return "tool_mismatch: %s not indicated by query" % call.get("name", "?")
 
     args = call.get("arguments", {})
-    query_lower = query.lower()
-    query_words_clean = {_strip_punct(w) for w in query_lower.split()} - {""}
+    query_words_clean = ctx.words
+    query_len = len(ctx.text)
 
     for key, val in args.items():
         if not isinstance(val, str):
@@ -592,8 +1224,12 @@ def _check_args(call, query):
         if val.endswith("'") or val.endswith('"'):
             return "trailing_quote: %s=%r" % (key, val)
         # Value is excessively long relative to query
-        if len(val) > len(query):
-            return "value_too_long: %s=%r (%d > %d)" % (key, val, len(val), len(query))
+        if len(val) > query_len:
+            return "value_too_long: %s=%r (%d > %d)" % (key, val, len(val), query_len)
+
+        # Times the slot parser read off the query ("half past six" -> "6:30")
+        if val in ctx.time_strings:
+            continue
 
         val_words = {_strip_punct(w).lower() for w in val.split()} - {""}
 
@@ -618,9 +1254,9 @@ def _check_args(call, query):
     return None
 
 
-def _args_look_good(call, query):
+def _args_look_good(call, ctx):
     """Thin wrapper: returns True if args pass validation, False otherwise."""
-    reason = _check_args(call, query)
+    reason = _check_args(call, ctx)
     if reason:
         _log.debug("    _check_args REJECT: %s | %s(%s)",
                    reason, call.get("name"), json.dumps(call.get("arguments", {})))
@@ -632,7 +1268,7 @@ def _args_look_good(call, query):
 # Per-tool focused inference (model-based, no regex)
 # ──────────────────────────────────────────────
 
-def _try_each_tool(messages, tools, query, time_so_far):
+def _try_each_tool(messages, tools, ctx, time_so_far):
     """
     Try running the model with each tool individually.
     Reduces the tool-selection problem: model only needs to extract args.
@@ -642,15 +1278,14 @@ def _try_each_tool(messages, tools, query, time_so_far):
     total_time = time_so_far
 
     # Order tools by keyword relevance (most likely tool first → fewer model calls)
-    query_words = {_strip_punct(w) for w in query.lower().split()} - {""}
-    ordered = sorted(tools, key=lambda t: _tool_relevance(t, query_words), reverse=True)
+    ordered = sorted(tools, key=lambda t: _tool_relevance(t, ctx.words), reverse=True)
     # Try the single most-relevant tool (avoids false positives from wrong tools)
     relevant = ordered[:1]
 
     for t in relevant:
         # Build rich prompt from tool schema and augment query with description
         rich_prompt = _build_rich_prompt(t)
-        aug_query = _augment_query(query, t)
+        aug_query = _augment_query(ctx.text, t)
         aug_messages = messages[:-1] + [{"role": "user", "content": aug_query}]
 
         focused = _run_local(
@@ -660,10 +1295,10 @@ def _try_each_tool(messages, tools, query, time_so_far):
             system_prompt=rich_prompt,
         )
         total_time += focused["total_time_ms"]
-        _fix_values(focused, tools, query)
+        _fix_values(focused, tools, ctx)
         f_valid, _ = _validate(focused, tools)
         if f_valid and focused["function_calls"]:
-            if all(_args_look_good(c, query) for c in focused["function_calls"]):
+            if all(_args_look_good(c, ctx) for c in focused["function_calls"]):
                 focused["source"] = "on-device"
                 focused["total_time_ms"] = total_time
                 return focused, total_time
@@ -671,24 +1306,413 @@ def _try_each_tool(messages, tools, query, time_so_far):
     return None, total_time
 
 
+# ──────────────────────────────────────────────
+# Temporal and number slot parsing (finite-state, one pass)
+# ──────────────────────────────────────────────
+
+# Answer time/number-only tools (alarm, timer) straight from the parsed query
+_SLOT_FILL = os.environ.get("HYBRID_SLOT_FILL", "1") != "0"
+
+# Lexer: clock times, digit runs, words (with apostrophes), single punctuation marks
+_SLOT_TOKEN = re.compile(r"(\d{1,2}):(\d{2})|\d+|[A-Za-z]+(?:['’][A-Za-z]+)?|[^\s\w]")
+
+_NUMBER_WORDS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+    "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+_TENS_WORDS = {
+    "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+    "sixty": 60, "seventy": 70, "eighty": 80, "ninety": 90,
+}
+_DURATION_UNITS = {
+    "second": 1, "seconds": 1, "sec": 1, "secs": 1,
+    "minute": 60, "minutes": 60, "min": 60, "mins": 60,
+    "hour": 3600, "hours": 3600, "hr": 3600, "hrs": 3600,
+}
+_NAMED_TIMES = {"noon": (12, 0, "PM"), "midday": (12, 0, "PM"), "midnight": (0, 0, "AM")}
+_DAYPARTS = {"morning": "AM", "afternoon": "PM", "evening": "PM", "night": "PM"}
+_PAST_WORDS = {"past", "after"}
+_TO_WORDS = {"to", "till", "til", "before"}
+
+# hour is 24h when the meridiem is known, as spoken otherwise; start is a char offset
+_TimeSlot = collections.namedtuple("_TimeSlot", "hour minute meridiem start")
+# relative: "in two hours" (an offset from now) rather than "for two hours"
+_Duration = collections.namedtuple("_Duration", "seconds relative start")
+
+
+def _slot_tokens(text):
+    """
+    Lex into (kind, value, start) with number words folded into "num"
+    ("twenty-five" -> 25) and "a.m."/"p.m." into "mer".
+    Kinds: clock (hour, minute), num, mer, word, punct.
+    """
+    raw = []
+    for m in _SLOT_TOKEN.finditer(text):
+        tok = m.group(0)
+        if m.group(1) is not None:
+            raw.append(("clock", (int(m.group(1)), int(m.group(2))), m.start()))
+        elif tok.isdigit():
+            raw.append(("num", int(tok), m.start()))
+        elif tok[0].isalpha():
+            raw.append(("word", tok.lower(), m.start()))
+        else:
+            raw.append(("punct", tok, m.start()))
+
+    out = []
+    i, n = 0, len(raw)
+    while i < n:
+        kind, val, start = raw[i]
+        if kind == "word":
+            if val in _TENS_WORDS:
+                total, i = _TENS_WORDS[val], i + 1
+                # "twenty five" / "twenty-five"
+                j = i + 1 if i < n and raw[i][1] == "-" else i
+                if j < n and raw[j][0] == "word" and 0 < _NUMBER_WORDS.get(raw[j][1], 0) < 10:
+                    total, i = total + _NUMBER_WORDS[raw[j][1]], j + 1
+                out.append(("num", total, start))
+                continue
+            if val in _NUMBER_WORDS:
+                out.append(("num", _NUMBER_WORDS[val], start))
+                i += 1
+                continue
+            if val in ("am", "pm"):
+                out.append(("mer", val.upper(), start))
+                i += 1
+                continue
+            # "a.m." / "p.m."
+            if (val in ("a", "p") and i + 2 < n and raw[i + 1][1] == "."
+                    and raw[i + 2][0] == "word" and raw[i + 2][1] == "m"):
+                i += 4 if i + 3 < n and raw[i + 3][1] == "." else 3
+                out.append(("mer", val.upper() + "M", start))
+                continue
+        out.append((kind, val, start))
+        i += 1
+    return out
+
+
+def _word_at(toks, i):
+    return toks[i][1] if i < len(toks) and toks[i][0] == "word" else None
+
+
+def _meridiem(toks, i):
+    """Consume am/pm, "o'clock", "in the morning", "tonight"... Returns (meridiem_or_None, next_i, matched)."""
+    if i < len(toks) and toks[i][0] == "mer":
+        return toks[i][1], i + 1, True
+    w = _word_at(toks, i)
+    if w in ("o'clock", "o’clock", "oclock"):
+        mer, j, _ = _meridiem(toks, i + 1)
+        return mer, j, True
+    if w == "tonight":
+        return "PM", i + 1, True
+    if w == "in" and _word_at(toks, i + 1) == "the" and _word_at(toks, i + 2) in _DAYPARTS:
+        return _DAYPARTS[toks[i + 2][1]], i + 3, True
+    if w == "at" and _word_at(toks, i + 1) == "night":
+        return "PM", i + 2, True
+    return None, i, False
+
+
+def _time_slot(hour, minute, meridiem, start):
+    if meridiem == "PM" and hour < 12:
+        hour += 12
+    elif meridiem == "AM" and hour == 12:
+        hour = 0
+    return _TimeSlot(hour, minute, meridiem, start)
+
+
+def _duration_at(toks, i):
+    """
+    Match [num | a | an | half a(n) | couple of] [and a half] unit [and a half]
+    [and <duration>] at i. Returns (seconds, next_i) or None.
+    """
+    n = len(toks)
+    kind, val, _ = toks[i]
+    j = i + 1
+    if kind == "num":
+        amount = val
+    elif val in ("a", "an"):
+        amount = 1
+    elif val == "half" and _word_at(toks, j) in ("a", "an"):
+        amount, j = 0.5, j + 1
+    elif val == "couple":
+        amount = 2
+        j += _word_at(toks, j) == "of"
+    else:
+        return None
+    if _word_at(toks, j) == "and" and _word_at(toks, j + 1) == "a" and _word_at(toks, j + 2) == "half":
+        amount, j = amount + 0.5, j + 3
+    unit = _DURATION_UNITS.get(_word_at(toks, j))
+    if unit is None:
+        return None
+    seconds, j = amount * unit, j + 1
+    if _word_at(toks, j) == "and" and _word_at(toks, j + 1) == "a" and _word_at(toks, j + 2) == "half":
+        seconds, j = seconds + unit / 2, j + 3
+    elif _word_at(toks, j) == "and" and j + 1 < n:
+        more = _duration_at(toks, j + 1)
+        if more:
+            seconds, j = seconds + more[0], more[1]
+    return int(seconds), j
+
+
+def _parse_slots(text):
+    """
+    One left-to-right pass over the lexed query with bounded lookahead.
+    Returns (numbers, times, durations, number_starts):
+      numbers    every integer, digits or spelled out, in order
+      times      _TimeSlot for "10:30 AM", "7pm", "noon", "half past six",
+                 "quarter to 8", "ten past nine", "six thirty pm", "at 6"
+      durations  _Duration for "5 minutes", "an hour and a half",
+                 "half an hour", "in two hours"
+      number_starts  char offset of each number
+    """
+    toks = _slot_tokens(text)
+    numbers, times, durations, starts = [], [], [], []
+    i, n = 0, len(toks)
+    while i < n:
+        kind, val, start = toks[i]
+        prev = _word_at(toks, i - 1) if i else None
+
+        if kind == "clock":
+            hour, minute = val
+            numbers += (hour, minute)
+            starts += (start, start)
+            mer, i, _ = _meridiem(toks, i + 1)
+            times.append(_time_slot(hour, minute, mer, start))
+            continue
+
+        if kind == "word" and val in _NAMED_TIMES:
+            hour, minute, mer = _NAMED_TIMES[val]
+            times.append(_TimeSlot(hour, minute, mer, start))
+            i += 1
+            continue
+
+        # "half past six", "quarter to 8", "ten (minutes) past nine"
+        if ((kind == "num" and 0 < val < 60) or val in ("half", "quarter")) and prev not in ("from", "between"):
+            j = i + 1
+            if kind == "num" and _word_at(toks, j) in ("minute", "minutes"):
+                j += 1
+            rel = _word_at(toks, j)
+            if (rel in _PAST_WORDS or (rel in _TO_WORDS and val != "half")) \
+                    and j + 1 < n and toks[j + 1][0] == "num" and toks[j + 1][1] <= 12:
+                minutes = 30 if val == "half" else 15 if val == "quarter" else val
+                hour = toks[j + 1][1]
+                if kind == "num":
+                    numbers.append(val)
+                    starts.append(start)
+                numbers.append(hour)
+                starts.append(toks[j + 1][2])
+                mer, i, _ = _meridiem(toks, j + 2)
+                if rel not in _TO_WORDS:
+                    times.append(_time_slot(hour, minutes, mer, start))
+                elif mer is None:
+                    times.append(_TimeSlot((hour - 1) % 12 or 12, 60 - minutes, None, start))
+                else:
+                    # The meridiem belongs to the named hour: "quarter to 12 am" is 11:45 PM
+                    hour = (_time_slot(hour, 0, mer, start).hour - 1) % 24
+                    times.append(_TimeSlot(hour, 60 - minutes, "PM" if hour >= 12 else "AM", start))
+                continue
+
+        # Durations: "5 minutes", "an hour", "half an hour", "in 2 hours"
+        if kind in ("num", "word"):
+            dur = _duration_at(toks, i)
+            if dur:
+                seconds, j = dur
+                for t in toks[i:j]:
+                    if t[0] == "num":
+                        numbers.append(t[1])
+                        starts.append(t[2])
+                durations.append(_Duration(seconds, prev == "in", start))
+                i = j
+                continue
+
+        if kind == "num":
+            numbers.append(val)
+            starts.append(start)
+            i += 1
+            # "six thirty pm", "at 7 15"
+            minute = 0
+            if (val <= 12 and i < n and toks[i][0] == "num" and toks[i][1] < 60
+                    and _DURATION_UNITS.get(_word_at(toks, i + 1)) is None):
+                mer, j, matched = _meridiem(toks, i + 1)
+                if matched or prev == "at":
+                    minute = toks[i][1]
+                    numbers.append(minute)
+                    starts.append(toks[i][2])
+                    times.append(_time_slot(val, minute, mer, start))
+                    i = j
+                    continue
+            if val <= 23:
+                mer, j, matched = _meridiem(toks, i)
+                if matched or prev == "at":
+                    times.append(_time_slot(val, 0, mer, start))
+                    i = j
+            continue
+
+        i += 1
+    return tuple(numbers), tuple(times), tuple(durations), tuple(starts)
+
+
+def _format_time(hour, minute, meridiem):
+    """"3:00 PM" style when the meridiem is known, "6:30" otherwise."""
+    if meridiem is None:
+        return "%d:%02d" % (hour, minute)
+    return "%d:%02d %s" % (hour % 12 or 12, minute, "PM" if hour >= 12 else "AM")
+
+
+def _time_strings(times, durations):
+    """Formatted clock times, then relative times ("in 2 hours") resolved against now."""
+    out = [_format_time(t.hour, t.minute, t.meridiem) for t in times]
+    now = None
+    for d in durations:
+        if d.relative:
+            now = now or time.time()
+            at = time.localtime(now + d.seconds)
+            out.append(_format_time(at.tm_hour, at.tm_min, "AM" if at.tm_hour < 12 else "PM"))
+    return tuple(out)
+
+
+# String parameters that take a clock time; "timezone", "timestamp" or "lifetime" do not
+_TIME_PARAM_NAMES = {"time", "when", "at", "time_of_day"}
+
+
+def _slot_value(ctx, tool, pname):
+    """
+    Value for a required integer or time-string parameter from the parsed
+    slots, by schema semantics (hour/minute of a time of day, a duration in
+    minutes/seconds/hours, a string named "time"/"when" or with format
+    "time"). None when nothing fits.
+    """
+    props = tool.get("parameters", {}).get("properties", {})
+    pinfo = props.get(pname, {})
+    ptype = pinfo.get("type", "string")
+    label = (pname + " " + pinfo.get("description", "")).lower()
+    if ptype == "integer":
+        time_of_day = "hour" in props and "minute" in props
+        if time_of_day and ctx.times:
+            if pname == "hour":
+                return ctx.times[0].hour
+            if pname == "minute":
+                return ctx.times[0].minute
+        if not time_of_day and ctx.durations:
+            seconds = ctx.durations[0].seconds
+            for unit, size in (("second", 1), ("minute", 60), ("hour", 3600)):
+                if unit in label:
+                    return seconds // size if seconds % size == 0 else None
+        return None
+    clock = pname.lower() in _TIME_PARAM_NAMES or pinfo.get("format") == "time"
+    if ptype == "string" and clock and ctx.time_strings:
+        return ctx.time_strings[0]
+    return None
+
+
+def _slot_fill_call(ctx, tool):
+    """
+    A call for `tool` with every required time/number parameter the parsed
+    slots can fill, or None when they fill none. The caller runs the value
+    fixers (which re-extract e.g. a reminder title) and validates the rest.
+    """
+    args = {}
+    for pname in tool.get("parameters", {}).get("required", []):
+        val = _slot_value(ctx, tool, pname)
+        if val is not None:
+            args[pname] = val
+    return {"name": tool["name"], "arguments": args} if args else None
+
+
 # ──────────────────────────────────────────────
 # Query analysis helpers
 # ──────────────────────────────────────────────
 
+# No split on the "and" inside a duration: "an hour and a half", "one hour and ten minutes"
+# ("<unit> and <number> <unit>"); "Text Ann and ten minutes later call Bob" still splits
 _SPLIT_PATTERN = re.compile(
-    r',\s*and\s+|\s+and\s+(?=[a-zA-Z])|,\s+(?=[a-zA-Z])',
+    r',\s*and\s+'
+    r'|(?<!second)(?<!seconds)(?<!minute)(?<!minutes)(?<!hour)(?<!hours)\s+and\s+(?=[a-zA-Z])(?!a\s+half\b)'
+    r'|\s+and\s+(?=[a-zA-Z])(?!a\s+half\b|(?:[a-z]+[\s-])?[a-z]+\s+(?:seconds?|minutes?|hours?)\b)'
+    r'|,\s+(?=[a-zA-Z])',
     re.IGNORECASE,
 )
 
 
-def _count_expected_actions(query):
-    """Estimate how many tool calls a query requires."""
-    parts = _SPLIT_PATTERN.split(query)
-    parts = [p.strip() for p in parts if p.strip()]
-    return max(1, len(parts))
+_NAME_PATTERN = re.compile(r'\b([A-Z][a-z]+)\b')
+_PRONOUN_PATTERN = re.compile(r'\b(?:him|her|them)\b', re.IGNORECASE)
+
+
+class QueryContext:
+    """
+    A query analysed once: every helper that looks at the query reads these
+    fields instead of re-lowercasing, re-splitting and re-scanning the text.
+      text      the query as given
+      lower     text.lower()
+      tokens    whitespace tokens of text
+      words     lowercase tokens with punctuation stripped (set)
+      names     capitalized-word candidates, in order
+      numbers   integers, digits or spelled out, in order
+      times     _TimeSlot per time expression ("10:30 AM", "half past six", "noon")
+      durations _Duration per duration ("5 minutes", "in two hours")
+      time_strings  times formatted as "3:00 PM", then relative times resolved
+      segments  the multi-action split, stripped
+    """
 
+    __slots__ = ("text", "lower", "tokens", "words", "names", "numbers", "times", "durations",
+                 "time_strings", "segments", "_number_starts", "_spans", "_subs")
+
+    def __init__(self, text):
+        self._set_text(text)
+        self.numbers, self.times, self.durations, self._number_starts = _parse_slots(text)
+        self.time_strings = _time_strings(self.times, self.durations)
+        spans, pos = [], 0
+        for m in _SPLIT_PATTERN.finditer(text):
+            spans.append((pos, m.start()))
+            pos = m.end()
+        spans.append((pos, len(text)))
+        self._spans = []
+        for lo, hi in spans:
+            piece = text[lo:hi]
+            stripped = piece.strip()
+            if stripped:
+                lo += len(piece) - len(piece.lstrip())
+                self._spans.append((lo, lo + len(stripped)))
+        self.segments = tuple(text[lo:hi] for lo, hi in self._spans)
+        self._subs = None
+
+    def _set_text(self, text):
+        self.text = text
+        self.lower = text.lower()
+        self.tokens = text.split()
+        self.words = frozenset(_strip_punct(w) for w in self.lower.split()) - {""}
+        self.names = tuple(_NAME_PATTERN.findall(text))
+
+    def _segment(self, lo, hi):
+        """The context of text[lo:hi], sliced from this one's slots instead of re-parsing."""
+        sub = QueryContext.__new__(QueryContext)
+        sub._set_text(self.text[lo:hi])
+        pairs = [(v, s - lo) for v, s in zip(self.numbers, self._number_starts) if lo <= s < hi]
+        sub.numbers = tuple(v for v, _ in pairs)
+        sub._number_starts = tuple(s for _, s in pairs)
+        sub.times = tuple(t._replace(start=t.start - lo) for t in self.times if lo <= t.start < hi)
+        sub.durations = tuple(d._replace(start=d.start - lo) for d in self.durations if lo <= d.start < hi)
+        sub.time_strings = _time_strings(sub.times, sub.durations)
+        sub.segments = (sub.text,)
+        sub._spans = [(0, hi - lo)]
+        sub._subs = (sub,)
+        return sub
+
+    @property
+    def expected_count(self):
+        """Estimate how many tool calls the query requires."""
+        return max(1, len(self.segments))
+
+    def segment_contexts(self):
+        """A context per segment (just this one for a single-action query), built once."""
+        if self._subs is None:
+            if len(self.segments) <= 1:
+                self._subs = (self,)
+            else:
+                self._subs = tuple(self._segment(lo, hi) for lo, hi in self._spans)
+        return self._subs
 
-_TOOL_KEYWORDS_CACHE = {}   # tool name → set of keywords (built once per tool set)
 
 # Stop words to exclude from description keyword extraction
 _STOP_WORDS = {
@@ -703,11 +1727,12 @@ def _get_tool_keywords(tool):
     """
     Extract all meaningful keywords from a tool definition.
     Pulls from: tool name, description, parameter names, parameter descriptions.
-    Cached per tool name to avoid recomputing.
+    Cached per tool name in the session's tool index to avoid recomputing.
     """
     name = tool["name"]
-    if name in _TOOL_KEYWORDS_CACHE:
-        return _TOOL_KEYWORDS_CACHE[name]
+    index = _session().tool_keywords
+    if name in index:
+        return index[name]
 
     kw = set()
     # Tool name words (e.g. "send_message" → {"send", "message"})
@@ -721,7 +1746,7 @@ def _get_tool_keywords(tool):
         pdesc = pinfo.get("description", "")
         kw |= {w.lower().strip(string.punctuation) for w in pdesc.split()} - _STOP_WORDS - {""}
 
-    _TOOL_KEYWORDS_CACHE[name] = kw
+    index[name] = kw
     return kw
 
 
@@ -738,21 +1763,23 @@ _QUERY_SYNONYMS = {
 
 def _tool_relevance(tool, query_words):
     """Score a tool against a set of query words using description keywords + synonyms."""
-    kw = _get_tool_keywords(tool)
-    # Expand query words with synonyms
+    return len(_expand_query_words(query_words) & _get_tool_keywords(tool))
+
+
+def _expand_query_words(query_words):
+    """Query words plus their synonyms."""
     expanded = set(query_words)
     for qw in query_words:
         if qw in _QUERY_SYNONYMS:
             expanded |= _QUERY_SYNONYMS[qw]
-    return len(expanded & kw)
+    return expanded
 
 
-def _match_tools_to_segment(segment, tools):
-    """Score each tool against a query segment by keyword overlap from descriptions."""
-    seg_words = {_strip_punct(w) for w in segment.lower().split()} - {""}
+def _match_tools_to_segment(seg_ctx, tools):
+    """Score each tool against a query segment's context by keyword overlap from descriptions."""
     scored = []
     for tool in tools:
-        overlap = _tool_relevance(tool, seg_words)
+        overlap = _tool_relevance(tool, seg_ctx.words)
         if overlap > 0:
             scored.append((overlap, tool))
     scored.sort(key=lambda x: -x[0])
@@ -761,17 +1788,15 @@ def _match_tools_to_segment(segment, tools):
     return tools
 
 
-def _decompose_and_solve(query, tools, time_so_far):
+def _decompose_and_solve(ctx, tools, time_so_far):
     """
     Split a multi-action query into sub-queries, solve each locally.
     Includes pronoun propagation across segments.
     Returns merged result dict or None if decomposition fails entirely.
     """
-    segments = _SPLIT_PATTERN.split(query)
-    segments = [s.strip() for s in segments if s.strip()]
-
-    if len(segments) <= 1:
+    if len(ctx.segments) <= 1:
         return None
+    segments = list(ctx.segment_contexts())
 
     # ── Pronoun propagation ──
     # Find proper nouns in earlier segments and replace pronouns in later ones
@@ -782,28 +1807,25 @@ def _decompose_and_solve(query, tools, time_so_far):
     }
     found_name = None
     for i, seg in enumerate(segments):
-        for name_match in re.finditer(r'\b([A-Z][a-z]+)\b', seg):
-            candidate = name_match.group(1)
+        for candidate in seg.names:
             if candidate.lower() not in _skip_words:
                 found_name = candidate
                 break
-        if found_name and i > 0:
-            seg = re.sub(r'\bhim\b', found_name, seg, flags=re.IGNORECASE)
-            seg = re.sub(r'\bher\b', found_name, seg, flags=re.IGNORECASE)
-            seg = re.sub(r'\bthem\b', found_name, seg, flags=re.IGNORECASE)
-            segments[i] = seg
+        if found_name and i > 0 and _PRONOUN_PATTERN.search(seg.text):
+            segments[i] = QueryContext(_PRONOUN_PATTERN.sub(found_name, seg.text))
 
     all_calls = []
+    seen = set()   # _call_key of every collected call
     total_time = time_so_far
     failed_segments = []
 
     for seg in segments:
         matched_tools = _match_tools_to_segment(seg, tools)
-        _log.info("    decomp seg=%r matched=%s", seg[:50], [t["name"] for t in matched_tools[:1]])
+        _log.info("    decomp seg=%r matched=%s", seg.text[:50], [t["name"] for t in matched_tools[:1]])
 
         # ── Try model with top matched tool (reduces selection ambiguity) ──
         sub_result = _run_local(
-            [{"role": "user", "content": seg}],
+            [{"role": "user", "content": seg.text}],
             matched_tools[:1],
             max_tokens=64,
             system_prompt=_SINGLE_CALL_PROMPT,
@@ -814,10 +1836,8 @@ def _decompose_and_solve(query, tools, time_so_far):
         valid, _ = _validate(sub_result, tools)
         if valid and sub_result["function_calls"]:
             if all(_args_look_good(c, seg) for c in sub_result["function_calls"]):
-                # Reject exact duplicates of already-collected calls
-                new_calls = [c for c in sub_result["function_calls"]
-                             if not any(c["name"] == e["name"] and c.get("arguments") == e.get("arguments")
-                                        for e in all_calls)]
+                # Reject duplicates of already-collected calls
+                new_calls = _new_calls(sub_result["function_calls"], seen)
                 if new_calls:
                     all_calls.extend(new_calls)
                     _log.info("    decomp seg OK: %s", [c["name"] for c in new_calls])
@@ -829,7 +1849,7 @@ def _decompose_and_solve(query, tools, time_so_far):
         found = False
         for t in matched_tools[:1]:
             rich_prompt = _build_rich_prompt(t)
-            aug_seg = _augment_query(seg, t)
+            aug_seg = _augment_query(seg.text, t)
             focused = _run_local(
                 [{"role": "user", "content": aug_seg}],
                 [t],
@@ -841,9 +1861,7 @@ def _decompose_and_solve(query, tools, time_so_far):
             f_valid, _ = _validate(focused, tools)
             if f_valid and focused["function_calls"]:
                 if all(_args_look_good(c, seg) for c in focused["function_calls"]):
-                    new_calls = [c for c in focused["function_calls"]
-                                 if not any(c["name"] == e["name"] and c.get("arguments") == e.get("arguments")
-                                            for e in all_calls)]
+                    new_calls = _new_calls(focused["function_calls"], seen)
                     if new_calls:
                         all_calls.extend(new_calls)
                         _log.info("    decomp seg OK (retry): %s", [c["name"] for c in new_calls])
@@ -858,14 +1876,17 @@ def _decompose_and_solve(query, tools, time_so_far):
                     _fix_values({"function_calls": [synthetic]}, tools, seg)
                     s_valid, _ = _validate({"function_calls": [synthetic]}, tools)
                     if s_valid and _args_look_good(synthetic, seg):
-                        all_calls.append(synthetic)
-                        _log.info("    decomp seg OK (synthetic): %s", synthetic["name"])
-                        found = True
-                        break
+                        # A duplicate of an earlier segment's call leaves this one unsolved
+                        new_calls = _new_calls([synthetic], seen)
+                        if new_calls:
+                            all_calls.extend(new_calls)
+                            _log.info("    decomp seg OK (synthetic): %s", synthetic["name"])
+                            found = True
+                            break
 
         if not found:
-            _log.info("    decomp seg FAILED (all tries): %r", seg[:50])
-            failed_segments.append(seg)
+            _log.info("    decomp seg FAILED (all tries): %r", seg.text[:50])
+            failed_segments.append(seg.text)
 
     if not all_calls:
         return None
@@ -884,14 +1905,14 @@ def _decompose_and_solve(query, tools, time_so_far):
 
 def generate_cactus(messages, tools):
     """Run function calling on-device via FunctionGemma + Cactus."""
-    model = cactus_init(functiongemma_path)
+    model = _cactus().cactus_init(functiongemma_path)
 
     cactus_tools = [{
         "type": "function",
         "function": t,
     } for t in tools]
 
-    raw_str = cactus_complete(
+    raw_str = _cactus().cactus_complete(
         model,
         [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + messages,
         tools=cactus_tools,
@@ -900,7 +1921,7 @@ def generate_cactus(messages, tools):
         stop_sequences=["<|im_end|>", "<end_of_turn>"],
     )
 
-    cactus_destroy(model)
+    _cactus().cactus_destroy(model)
 
     try:
         raw = json.loads(raw_str)
@@ -920,9 +1941,88 @@ def generate_cactus(messages, tools):
 
 def generate_cloud(messages, tools):
     """Run function calling via Gemini Cloud API."""
-    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+    session = _session()
+    if session.cloud_proxy is not None:
+        return session.cloud_proxy(messages, tools)
+    ticket = session.cloud_breaker.allow()
+    if not ticket:
+        session.stats["circuit_short_circuited"] += 1
+        return {"function_calls": [], "total_time_ms": 0, "_circuit_open": True}
+    watch = _cloud_watch.get()
+    if watch is not None:
+        watch.ticket = ticket   # for the timeout, recorded by the waiting thread
+    return _with_ticket(ticket, _shortlisted_cloud)(messages, tools)
+
+
+def _shortlisted_cloud(messages, tools):
+    """Try the shortlisted tools first, widening to all of them if no call comes back."""
+    shortlist = _shortlist_cloud_tools(messages, tools)
+    if shortlist is not None:
+        result = _cloud_call(messages, shortlist)
+        if _shortlist_settled(result, tools, shortlist):
+            return result
+        widened = _cloud_call(messages, tools)
+        widened.pop("_error", None)
+        widened["total_time_ms"] += result["total_time_ms"]
+        return widened
+    result = _cloud_call(messages, tools)
+    result.pop("_error", None)
+    return result
+
+
+def _cloud_call(messages, tools):
+    if not _SINGLE_FLIGHT:
+        return _dispatch_cloud(messages, tools)
+    return _session().cloud_flights.do(_flight_key(messages, tools), _dispatch_cloud, messages, tools)
+
+
+# Declare only the tools the local relevance scoring shortlists (widen on no call)
+_CLOUD_SHORTLIST = os.environ.get("HYBRID_CLOUD_SHORTLIST", "1") != "0"
+
+
+def _shortlist_cloud_tools(messages, tools):
+    """
+    Narrow the tools declared to Gemini to the ones the local relevance
+    scoring links to some segment of the query (top 3 per segment).
+    Returns None when that would not drop anything, or when some segment
+    matches no tool and the model needs the whole catalog to decide.
+    """
+    if not _CLOUD_SHORTLIST or len(tools) < 2:
+        return None
+    ctx = QueryContext(" ".join(m["content"] for m in messages if m["role"] == "user"))
+    keep = set()
+    for seg in ctx.segment_contexts():
+        matched = _match_tools_to_segment(seg, tools)
+        if matched is tools:
+            return None
+        keep.update(t["name"] for t in matched)
+    if len(keep) >= len(tools):
+        return None
+    return [t for t in tools if t["name"] in keep]
+
+
+def _shortlist_settled(result, tools, shortlist):
+    """
+    Bookkeeping after a call with shortlisted tools. True if the result
+    stands; False if it came back without calls and the caller should
+    widen to the full tool set. Errors stand (widening won't fix them).
+    """
+    stats = _session().stats
+    errored = result.pop("_error", False)
+    if not result["function_calls"] and not errored:
+        stats["cloud_shortlist_widened"] += 1
+        return False
+    kept = {t["name"] for t in shortlist}
+    stats["cloud_shortlisted"] += 1
+    stats["cloud_tools_dropped"] += len(tools) - len(shortlist)
+    stats["cloud_decl_bytes_saved"] += len(json.dumps([t for t in tools if t["name"] not in kept]))
+    return True
 
-    gemini_tools = [
+
+def _gemini_tools(tools):
+    """Convert tool dicts to Gemini function declarations."""
+    _, types = _genai()
+    return [
         types.Tool(function_declarations=[
             types.FunctionDeclaration(
                 name=t["name"],
@@ -940,75 +2040,1336 @@ def generate_cloud(messages, tools):
         ])
     ]
 
+
+# Stream Gemini responses and stop reading once the expected call is in (when that count is certain)
+_CLOUD_STREAM = os.environ.get("HYBRID_CLOUD_STREAM", "1") != "0"
+
+def _generate_cloud_once(messages, tools, gemini_tools=None):
+    _, types = _genai()
+    client = _get_cloud_client()
+    if gemini_tools is None:
+        gemini_tools = _gemini_tools(tools)
+
     contents = [m["content"] for m in messages if m["role"] == "user"]
+    config = types.GenerateContentConfig(tools=gemini_tools)
+
+    def request():
+        if _CLOUD_STREAM:
+            stream = client.models.generate_content_stream(
+                model="gemini-2.5-flash", contents=contents, config=config)
+            return _read_stream(stream, _expected_cloud_calls(contents, tools), time.time())
+        return _extract_calls(client.models.generate_content(
+            model="gemini-2.5-flash", contents=contents, config=config))
 
     start_time = time.time()
 
     try:
-        gemini_response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=contents,
-            config=types.GenerateContentConfig(tools=gemini_tools),
-        )
+        function_calls = _session().cloud_hedger.call(request) if _HEDGE else request()
     except Exception as e:
-        total_time_ms = (time.time() - start_time) * 1000
-        print(f"[cloud error: {e}]", end=" ", flush=True)
-        return {"function_calls": [], "total_time_ms": total_time_ms}
+        return _cloud_error(e, start_time)
+    return _cloud_result(function_calls, tools, start_time)
 
-    total_time_ms = (time.time() - start_time) * 1000
 
+async def _generate_cloud_async(messages, tools):
+    """_generate_cloud_once over the SDK's async transport, so the request can be aborted."""
+    _, types = _genai()
+    client = _get_cloud_client()
+    contents = [m["content"] for m in messages if m["role"] == "user"]
+    config = types.GenerateContentConfig(tools=_gemini_tools(tools))
+
+    async def request():
+        if _CLOUD_STREAM:
+            stream = await client.aio.models.generate_content_stream(
+                model="gemini-2.5-flash", contents=contents, config=config)
+            return await _aread_stream(stream, _expected_cloud_calls(contents, tools), time.time())
+        return _extract_calls(await client.aio.models.generate_content(
+            model="gemini-2.5-flash", contents=contents, config=config))
+
+    start_time = time.time()
+    try:
+        function_calls = await (_session().cloud_hedger.acall(request) if _HEDGE else request())
+    except Exception as e:
+        return _cloud_error(e, start_time)
+    return _cloud_result(function_calls, tools, start_time)
+
+
+async def _cloud_call_async(messages, tools):
+    """Async _cloud_call: joins (or leads) the same single-flight table as the blocking path."""
+    if not _SINGLE_FLIGHT:
+        return await _generate_cloud_async(messages, tools)
+    return await _session().cloud_flights.ado(_flight_key(messages, tools), _generate_cloud_async, messages, tools)
+
+
+_SEQUENCE_WORDS = {"then", "also", "plus", "after", "afterwards", "before"}
+
+
+def _expected_cloud_calls(contents, tools):
+    """
+    1 when the answer is surely a single call (one declared tool, one
+    segment, no "then"/"also"), else None: expected_count undercounts
+    actions chained without "and" or a comma, so the stream is read to
+    the finish chunk.
+    """
+    if len(tools) != 1:
+        return None
+    ctx = QueryContext(" ".join(contents))
+    if len(ctx.segments) != 1 or ctx.words & _SEQUENCE_WORDS:
+        return None
+    return 1
+
+
+def _extract_calls(gemini_response):
+    """Function calls in a Gemini response (or one streamed chunk of it)."""
     function_calls = []
-    for candidate in gemini_response.candidates:
-        for part in candidate.content.parts:
+    for candidate in gemini_response.candidates or []:
+        content = candidate.content
+        for part in (content.parts if content else None) or []:
             if part.function_call:
                 function_calls.append({
                     "name": part.function_call.name,
                     "arguments": dict(part.function_call.args),
                 })
+    return function_calls
 
-    return {
+
+def _stream_chunk(function_calls, chunk, expected, start):
+    """Add one chunk's calls; True once `expected` calls are in (never when it is None)."""
+    calls = _extract_calls(chunk)
+    if calls and not function_calls:
+        _session().cloud_ttfc_ms.append((time.time() - start) * 1000)
+    function_calls.extend(calls)
+    return expected is not None and len(function_calls) >= expected
+
+
+def _read_stream(stream, expected, start):
+    """Collect streamed function calls, closing the stream early once `expected` are in."""
+    function_calls = []
+    try:
+        for chunk in stream:
+            if _stream_chunk(function_calls, chunk, expected, start):
+                _session().stats["cloud_stream_early_return"] += 1
+                break
+    finally:
+        close = getattr(stream, "close", None)
+        if close:
+            close()
+    return function_calls
+
+
+async def _aread_stream(stream, expected, start):
+    function_calls = []
+    try:
+        async for chunk in stream:
+            if _stream_chunk(function_calls, chunk, expected, start):
+                _session().stats["cloud_stream_early_return"] += 1
+                break
+    finally:
+        aclose = getattr(stream, "aclose", None)
+        if aclose:
+            await aclose()
+    return function_calls
+
+
+class _CloudWatch:
+    """
+    One logical call under generate_cloud_with_timeout. The breaker hears its
+    outcome once: the first of the timeout and the (possibly late) answer.
+    """
+
+    __slots__ = ("lock", "settled", "ticket")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.settled = False
+        self.ticket = None
+
+    def settle(self):
+        """True for the first caller only."""
+        with self.lock:
+            first, self.settled = not self.settled, True
+        return first
+
+
+_cloud_watch = contextvars.ContextVar("hybrid_cloud_watch", default=None)
+# The breaker ticket of the generate_cloud call in progress (see _CircuitBreaker.allow)
+_breaker_ticket = contextvars.ContextVar("hybrid_breaker_ticket", default=None)
+
+
+def _with_ticket(ticket, fn):
+    """Wrap fn so the cloud calls it makes record their outcome under `ticket`."""
+    def run(*args, **kwargs):
+        token = _breaker_ticket.set(ticket)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _breaker_ticket.reset(token)
+    return run
+
+
+def _breaker_record(ok):
+    watch = _cloud_watch.get()
+    if watch is None or watch.settle():
+        _session().cloud_breaker.record(ok, _breaker_ticket.get())
+
+
+def _cloud_error(e, start_time):
+    total_time_ms = (time.time() - start_time) * 1000
+    _breaker_record(False)
+    print(f"[cloud error: {e}]", end=" ", flush=True)
+    return {"function_calls": [], "total_time_ms": total_time_ms, "_error": True}
+
+
+def _cloud_result(function_calls, tools, start_time):
+    """Record a successful cloud call and wrap its function calls."""
+    total_time_ms = (time.time() - start_time) * 1000
+    session = _session()
+    session.stage_costs.record("cloud", total_time_ms)
+    session.cloud_latency.record(tools, total_time_ms)
+    _breaker_record(total_time_ms < _BREAKER_SLOW_MS)
+    return {
         "function_calls": function_calls,
         "total_time_ms": total_time_ms,
     }
 
 
-def generate_cloud_with_timeout(messages, tools, timeout_sec=5):
-    """Wrap generate_cloud with a hard timeout to prevent 30+ second hangs."""
-    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-        future = executor.submit(generate_cloud, messages, tools)
-        try:
-            result = future.result(timeout=timeout_sec)
-            return result
-        except concurrent.futures.TimeoutError:
-            return {
-                "function_calls": [],
-                "total_time_ms": timeout_sec * 1000,
-                "source": "cloud (fallback)",
-            }
+def generate_cloud_with_timeout(messages, tools, timeout_sec=None):
+    """
+    Wrap generate_cloud with a hard timeout to prevent 30+ second hangs.
+    By default the timeout is learned from recent cloud latency and capped
+    by what is left of the current request's budget (see _cloud_timeout_s).
+    """
+    if timeout_sec is None:
+        timeout_sec = _cloud_timeout_s(tools)
+    session = _session()
+    if timeout_sec <= 0:
+        session.stats["cloud_budget_exhausted"] += 1
+        return {"function_calls": [], "total_time_ms": 0, "source": "cloud (fallback)"}
+    watch = _CloudWatch()
+
+    def call():
+        _cloud_watch.set(watch)   # the executor thread's own context
+        return generate_cloud(messages, tools)
+
+    # Not a `with` block: its exit would wait for a hung call, defeating the timeout
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(_session_bound(call))
+    executor.shutdown(wait=False)
+    try:
+        return future.result(timeout=timeout_sec)
+    except concurrent.futures.TimeoutError:
+        if watch.settle():   # a late answer won't be recorded again
+            session.cloud_breaker.record(False, watch.ticket)
+        session.stats["cloud_timeouts"] += 1
+        return {
+            "function_calls": [],
+            "total_time_ms": timeout_sec * 1000,
+            "source": "cloud (fallback)",
+        }
 
 
-def _log_local_failure(label, local, query, issue=None):
+def _log_local_failure(label, local, ctx, issue=None):
     """Log the local result, raw model response, and rejection reasons when falling back."""
     calls = local.get("function_calls", [])
     raw = local.get("_raw", "<no raw captured>")
-    _log.info("  [%s] query: %s", label, query[:120])
+    _log.info("  [%s] query: %s", label, ctx.text[:120])
     if issue:
         _log.info("  [%s] validation_issue: %s", label, issue)
     _log.info("  [%s] local_calls=%s", label, json.dumps(calls, ensure_ascii=False))
     for c in calls:
-        reason = _check_args(c, query)
+        reason = _check_args(c, ctx)
         if reason:
             _log.info("  [%s]   REJECT %s(%s): %s",
                       label, c.get("name"), json.dumps(c.get("arguments", {})), reason)
     _log.info("  [%s] raw_response: %.500s", label, raw)
 
 
-def _cancel_cloud(cloud_future, cloud_executor):
-    """Best-effort cancellation of parallel cloud request."""
-    if cloud_future is not None:
-        cloud_future.cancel()
-    if cloud_executor is not None:
-        cloud_executor.shutdown(wait=False)
+def _cancel_cloud(cloud_spec):
+    """Abort a speculative cloud call that is no longer needed."""
+    if cloud_spec is not None:
+        cloud_spec.cancel()
+
+
+# ──────────────────────────────────────────────
+# Speculative cloud calls (abortable, with spend accounting)
+# ──────────────────────────────────────────────
+
+_aio_loop = None
+_aio_lock = threading.Lock()
+_spec_lock = threading.Lock()
+
+
+def _aio_submit(coro):
+    """Run a coroutine on the process-wide background event loop; returns a concurrent Future."""
+    global _aio_loop
+    import asyncio
+    with _aio_lock:
+        if _aio_loop is None:
+            _aio_loop = asyncio.new_event_loop()
+            threading.Thread(target=_aio_loop.run_forever, name="hybrid-cloud-aio", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _aio_loop)
+
+
+class _Speculation:
+    """
+    A speculative cloud call. On the async transport cancel() aborts the
+    HTTP request mid-flight; on the thread fallback (SDK without client.aio)
+    the call runs to completion and only its result is dropped. Spend is
+    accounted once the speculation is settled: used, or cancelled.
+    """
+
+    __slots__ = ("future", "stats", "start", "abortable", "used", "settled")
+
+    def __init__(self, future, abortable):
+        self.future = future
+        self.stats = _session().stats   # callbacks run on other threads
+        self.start = time.time()
+        self.abortable = abortable
+        self.used = False
+        self.settled = False
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        if future.cancelled():
+            return
+        with _spec_lock:
+            self.stats["spec_cloud_completed"] += 1
+            if self.settled and not self.used:
+                # Cancelled too late (or not abortable): the whole call was wasted
+                self.stats["spec_cloud_wasted_ms"] += (time.time() - self.start) * 1000
+
+    def result(self, timeout):
+        result = self.future.result(timeout=timeout)
+        with _spec_lock:
+            self.used = self.settled = True
+        return result
+
+    def cancel(self):
+        with _spec_lock:
+            if self.settled:
+                return
+            self.settled = True
+            if self.future.done():
+                if not self.future.cancelled():
+                    self.stats["spec_cloud_wasted_ms"] += (time.time() - self.start) * 1000
+                return
+        if self.abortable and self.future.cancel():
+            with _spec_lock:
+                self.stats["spec_cloud_aborted"] += 1
+                self.stats["spec_cloud_wasted_ms"] += (time.time() - self.start) * 1000
+
+
+def _speculate_cloud(messages, tools):
+    """Fire a cloud call in the background; returns a _Speculation."""
+    session = _session()
+    ticket = session.cloud_breaker.allow()
+    if not ticket:
+        session.stats["circuit_short_circuited"] += 1
+        future = concurrent.futures.Future()
+        future.set_result({"function_calls": [], "total_time_ms": 0, "_circuit_open": True})
+        return _Speculation(future, abortable=False)
+    session.stats["spec_cloud_started"] += 1
+    # The batching dispatcher is thread-based: with a window set, speculation goes through it unabortable
+    if (session.cloud_proxy is None and session.cloud_dispatcher.window_ms <= 0
+            and hasattr(_get_cloud_client(), "aio")):
+        return _Speculation(_aio_submit(_speculative_cloud(session, ticket, messages, tools)), abortable=True)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(_session_bound(_with_ticket(ticket, session.cloud_proxy or _shortlisted_cloud)),
+                             messages, tools)
+    executor.shutdown(wait=False)
+    return _Speculation(future, abortable=False)
+
+
+async def _speculative_cloud(session, ticket, messages, tools):
+    """Async counterpart of generate_cloud's shortlist-then-widen, single-flighted and hedged alike."""
+    _session_ctx.set(session)   # the task runs in its own context copy
+    _breaker_ticket.set(ticket)
+    shortlist = _shortlist_cloud_tools(messages, tools)
+    if shortlist is not None:
+        result = await _cloud_call_async(messages, shortlist)
+        if _shortlist_settled(result, tools, shortlist):
+            return result
+        widened = await _cloud_call_async(messages, tools)
+        widened.pop("_error", None)
+        widened["total_time_ms"] += result["total_time_ms"]
+        return widened
+    result = await _cloud_call_async(messages, tools)
+    result.pop("_error", None)
+    return result
+
+
+# ──────────────────────────────────────────────
+# Cloud dispatcher (micro-batching of concurrent fallbacks)
+# ──────────────────────────────────────────────
+
+# 0 sends each cloud call straight away; >0 collects calls for this long first
+_CLOUD_BATCH_MS = float(os.environ.get("HYBRID_CLOUD_BATCH_MS", "0"))
+# Flush early once this many calls are pending
+_CLOUD_BATCH_MAX = int(os.environ.get("HYBRID_CLOUD_BATCH_MAX", "16"))
+# Max Gemini requests in flight from the dispatcher
+_CLOUD_CONCURRENCY = int(os.environ.get("HYBRID_CLOUD_CONCURRENCY", "8"))
+
+
+class _CloudDispatcher:
+    """
+    Collects cloud calls for up to `window_ms` after the first pending one,
+    groups them by tool fingerprint, builds each group's Gemini declarations
+    once and sends the group's requests concurrently over the shared client
+    from a pool of `concurrency` threads. Results fan back out via futures.
+
+    Gemini has no synchronous multi-prompt request, so a batch is a burst of
+    concurrent requests, not one call.
+    """
+
+    def __init__(self, window_ms=0.0, max_batch=16, concurrency=8):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.concurrency = concurrency
+        self.cond = threading.Condition()
+        self.pending = []   # (fingerprint, messages, tools, future, caller's contextvars.Context)
+        self.flusher = None
+        self.pool = None
+        self.closed = False
+
+    def submit(self, messages, tools):
+        """Queue one cloud call; returns a Future with the generate_cloud result."""
+        future = concurrent.futures.Future()
+        with self.cond:
+            self.pending.append((_tool_fingerprint(tools), messages, tools, future, contextvars.copy_context()))
+            if self.flusher is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.concurrency, thread_name_prefix="hybrid-cloud")
+                self.flusher = threading.Thread(target=_session_bound(self._run), name="hybrid-cloud-batcher",
+                                                daemon=True)
+                self.flusher.start()
+            self.cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if self.closed and not self.pending:
+                    return
+                flush_at = time.time() + self.window_ms / 1000
+                while len(self.pending) < self.max_batch:
+                    remaining = flush_at - time.time()
+                    if remaining <= 0:
+                        break
+                    self.cond.wait(remaining)
+                batch, self.pending = self.pending, []
+            self._send(batch)
+
+    def _send(self, batch):
+        groups = collections.defaultdict(list)
+        for fingerprint, messages, tools, future, context in batch:
+            groups[fingerprint].append((messages, tools, future, context))
+        stats = _session().stats
+        stats["cloud_batches"] += 1
+        stats["cloud_batched_requests"] += len(batch)
+        for items in groups.values():
+            try:
+                gemini_tools = _gemini_tools(items[0][1])
+            except Exception as e:
+                for _, _, future, _ in items:
+                    future.set_exception(e)
+                continue
+            for messages, tools, future, context in items:
+                self.pool.submit(self._call, messages, tools, gemini_tools, future, context)
+
+    @staticmethod
+    def _call(messages, tools, gemini_tools, future, context):
+        # In the submitter's context: its session, timeout watch and breaker ticket
+        try:
+            future.set_result(context.run(_generate_cloud_once, messages, tools, gemini_tools))
+        except Exception as e:
+            future.set_exception(e)
+
+    def close(self):
+        """Stop the flusher once pending calls are sent; the pool finishes what it has."""
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+            pool = self.pool
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def snapshot(self):
+        with self.cond:
+            return {"cloud_batch_pending": len(self.pending)}
+
+
+def _dispatch_cloud(messages, tools):
+    """Send one cloud call, through the batching dispatcher when a window is set."""
+    dispatcher = _session().cloud_dispatcher
+    if dispatcher.window_ms <= 0:
+        return _generate_cloud_once(messages, tools)
+    start = time.time()
+    result = dispatcher.submit(messages, tools).result()
+    result["total_time_ms"] = (time.time() - start) * 1000   # include time spent batching
+    return result
+
+
+# ──────────────────────────────────────────────
+# Hedged cloud requests (duplicate slow calls, take the first answer)
+# ──────────────────────────────────────────────
+
+_HEDGE = os.environ.get("HYBRID_HEDGE", "1") != "0"
+# Hedge once a request outlives this percentile of recent cloud latency
+_HEDGE_PCT = float(os.environ.get("HYBRID_HEDGE_PCT", "95"))
+# Max share of cloud calls that may send a hedge
+_HEDGE_BUDGET = float(os.environ.get("HYBRID_HEDGE_BUDGET", "0.1"))
+
+
+def _percentile(samples, pct):
+    """Nearest-rank percentile of an unsorted sequence."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+class _CloudHedger:
+    """
+    Runs a blocking cloud request and, if it hasn't answered within the
+    `pct` percentile of recent latency, sends a duplicate and returns
+    whichever succeeds first. Hedges are paid for from a token bucket that
+    earns `budget` tokens per call, so at most ~budget of calls are hedged.
+
+    Latency of the first request is kept even when the hedge wins, which
+    gives the unhedged distribution to compare the effective one against.
+    """
+
+    def __init__(self, pct=95.0, budget=0.1, window=256, min_samples=20, max_tokens=10.0):
+        self.pct = pct
+        self.budget = budget
+        self.min_samples = min_samples
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.lock = threading.Lock()
+        self.primary_ms = collections.deque(maxlen=window)     # first request of each call
+        self.effective_ms = collections.deque(maxlen=window)   # what the caller waited
+        self.pool = None
+
+    def hedge_delay_ms(self):
+        """Current hedge trigger, or None while there are too few samples."""
+        with self.lock:
+            if len(self.primary_ms) < self.min_samples:
+                return None
+            return _percentile(self.primary_ms, self.pct)
+
+    def _take_token(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def call(self, fn):
+        with self.lock:
+            if self.pool is None:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="hybrid-hedge")
+            self.tokens = min(self.max_tokens, self.tokens + self.budget)
+        delay_ms = self.hedge_delay_ms()
+        start = time.time()
+
+        fn = _session_bound(fn)
+        stats = _session().stats
+        primary = self.pool.submit(fn)
+        primary.add_done_callback(lambda f: self._record(self.primary_ms, start) if not f.exception() else None)
+        pending = {primary}
+        if delay_ms is not None and not concurrent.futures.wait(pending, timeout=delay_ms / 1000).done:
+            if self._take_token():
+                stats["cloud_hedged"] += 1
+                pending.add(self.pool.submit(fn))
+            else:
+                stats["cloud_hedge_denied"] += 1
+
+        error = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is not primary:
+                        stats["cloud_hedge_won"] += 1
+                    self._record(self.effective_ms, start)
+                    return f.result()
+                error = f.exception()
+        raise error
+
+    async def acall(self, coro_fn):
+        """call() for a coroutine function on the running loop; the losing request is aborted."""
+        import asyncio
+        with self.lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.budget)
+        delay_ms = self.hedge_delay_ms()
+        start = time.time()
+
+        stats = _session().stats
+        primary = asyncio.ensure_future(coro_fn())
+        primary.add_done_callback(
+            lambda f: self._record(self.primary_ms, start) if not f.cancelled() and not f.exception() else None)
+        pending = {primary}
+        try:
+            if delay_ms is not None and not (await asyncio.wait(pending, timeout=delay_ms / 1000))[0]:
+                if self._take_token():
+                    stats["cloud_hedged"] += 1
+                    pending.add(asyncio.ensure_future(coro_fn()))
+                else:
+                    stats["cloud_hedge_denied"] += 1
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for f in done:
+                    if f.exception() is None:
+                        if f is not primary:
+                            stats["cloud_hedge_won"] += 1
+                        self._record(self.effective_ms, start)
+                        return f.result()
+                    error = f.exception()
+            raise error
+        finally:
+            for f in pending:
+                f.cancel()
+
+    def _record(self, samples, start):
+        with self.lock:
+            samples.append((time.time() - start) * 1000)
+
+    def close(self):
+        with self.lock:
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def snapshot(self):
+        delay = self.hedge_delay_ms()
+        with self.lock:
+            return {
+                "cloud_hedge_delay_ms": round(delay, 1) if delay is not None else None,
+                "cloud_p99_ms": round(_percentile(self.effective_ms, 99), 1),
+                "cloud_p99_unhedged_ms": round(_percentile(self.primary_ms, 99), 1),
+            }
+
+
+
+# ──────────────────────────────────────────────
+# Adaptive cloud timeouts (learned per tool-set size and region)
+# ──────────────────────────────────────────────
+
+_CLOUD_REGION = os.environ.get("HYBRID_CLOUD_REGION") or os.environ.get("GOOGLE_CLOUD_LOCATION", "global")
+# Learned timeout = p99 of recent latency x factor, clamped to [floor, ceiling]
+_CLOUD_TIMEOUT_FACTOR = float(os.environ.get("HYBRID_CLOUD_TIMEOUT_FACTOR", "1.5"))
+_CLOUD_TIMEOUT_FLOOR_MS = float(os.environ.get("HYBRID_CLOUD_TIMEOUT_FLOOR_MS", "1000"))
+_CLOUD_TIMEOUT_CEIL_MS = float(os.environ.get("HYBRID_CLOUD_TIMEOUT_CEIL_MS", "10000"))
+# Used until a bucket has enough samples
+_CLOUD_TIMEOUT_DEFAULT_MS = float(os.environ.get("HYBRID_CLOUD_TIMEOUT_DEFAULT_MS", "5000"))
+# Whole-request budget when no deadline is set; local time spent comes out of it
+_CLOUD_BUDGET_MS = float(os.environ.get("HYBRID_CLOUD_BUDGET_MS", "10000"))
+
+
+def _tool_count_bucket(n):
+    """1, 2-3, 4-7, 8+ tools: declaration size drives Gemini prefill time."""
+    return ("1", "2-3", "4-7", "8+")[min(max(n, 1), 8).bit_length() - 1]
+
+
+class _CloudLatency:
+    """Rolling window of successful cloud latencies per (region, tool-count bucket)."""
+
+    def __init__(self, region="global", window=200, min_samples=20, factor=1.5,
+                 floor_ms=1000.0, ceil_ms=10000.0, default_ms=5000.0):
+        self.region = region
+        self.window = window
+        self.min_samples = min_samples
+        self.factor = factor
+        self.floor_ms = floor_ms
+        self.ceil_ms = ceil_ms
+        self.default_ms = default_ms
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def _key(self, tools):
+        return f"{self.region}/{_tool_count_bucket(len(tools))}"
+
+    def record(self, tools, ms):
+        key = self._key(tools)
+        with self.lock:
+            window = self.samples.get(key)
+            if window is None:
+                window = self.samples[key] = collections.deque(maxlen=self.window)
+            window.append(ms)
+
+    def timeout_ms(self, tools):
+        return self._timeout_for(self._key(tools))
+
+    def _timeout_for(self, key):
+        with self.lock:
+            window = self.samples.get(key)
+            if window is None or len(window) < self.min_samples:
+                return self.default_ms
+            p99 = _percentile(window, 99)
+        return min(self.ceil_ms, max(self.floor_ms, p99 * self.factor))
+
+    def snapshot(self):
+        with self.lock:
+            keys = list(self.samples)
+        return {f"cloud_timeout_ms[{k}]": round(self._timeout_for(k), 1) for k in keys}
+
+
+
+def _cloud_timeout_s(tools):
+    """
+    How long to wait for a cloud answer: the learned timeout for this tool
+    set, but never past the current request's deadline (or _CLOUD_BUDGET_MS
+    when it has none), counting time already spent locally.
+    """
+    timeout_ms = _session().cloud_latency.timeout_ms(tools)
+    state = _request_ctx.get()
+    if state is not None:
+        budget_ms = state.deadline_ms or _CLOUD_BUDGET_MS
+        timeout_ms = min(timeout_ms, budget_ms - state.elapsed_ms())
+    return max(0.0, timeout_ms) / 1000
+
+
+# ──────────────────────────────────────────────
+# Cloud circuit breaker (fail fast while Gemini is down)
+# ──────────────────────────────────────────────
+
+_BREAKER_WINDOW = int(os.environ.get("HYBRID_BREAKER_WINDOW", "20"))
+_BREAKER_MIN_CALLS = int(os.environ.get("HYBRID_BREAKER_MIN_CALLS", "5"))
+_BREAKER_FAILURE_RATE = float(os.environ.get("HYBRID_BREAKER_FAILURE_RATE", "0.5"))
+_BREAKER_OPEN_S = float(os.environ.get("HYBRID_BREAKER_OPEN_S", "30"))
+# A call that answers but takes longer than this counts as a failure
+_BREAKER_SLOW_MS = float(os.environ.get("HYBRID_BREAKER_SLOW_MS", "5000"))
+
+
+class _CircuitBreaker:
+    """
+    closed -> open once at least `min_calls` of the last `window` cloud calls
+    are in and `failure_rate` of them failed (error, timeout or slow).
+    open -> every call fails fast for `open_s` seconds.
+    half_open -> one probe call goes through; success closes the circuit,
+    failure opens it again. allow() hands the probe a ticket, and only the
+    outcome recorded with that ticket resolves half-open: a slow call sent
+    before the circuit opened cannot close it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, open_s=30.0):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_s = open_s
+        self.lock = threading.Lock()
+        self.outcomes = collections.deque(maxlen=window)   # True = success
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_at = None
+        self.probe = None
+
+    def allow(self):
+        """A truthy ticket if a cloud call may go out now (pass it to record()), else False."""
+        with self.lock:
+            now = time.time()
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if now - self.opened_at < self.open_s:
+                    return False
+                self.state = self.HALF_OPEN
+                self.probe_at = None
+                _log.info("  [BREAKER] half-open, probing cloud")
+            # Half-open: one probe at a time (a lost probe is replaced after open_s)
+            if self.probe_at is not None and now - self.probe_at < self.open_s:
+                return False
+            self.probe_at = now
+            self.probe = object()
+            return self.probe
+
+    def record(self, ok, ticket=None):
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if ticket is None or ticket is not self.probe:
+                    return   # not the probe: a straggler from before the circuit opened
+                self.probe = None
+                if ok:
+                    self.state = self.CLOSED
+                    self.outcomes.clear()
+                    _log.info("  [BREAKER] closed")
+                else:
+                    self._open()
+                return
+            if self.state == self.OPEN:
+                return   # stragglers sent before the circuit opened
+            self.outcomes.append(ok)
+            n = len(self.outcomes)
+            if n >= self.min_calls and self.outcomes.count(False) / n >= self.failure_rate:
+                self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.probe_at = None
+        self.probe = None
+        self.outcomes.clear()
+        _session().stats["circuit_opened"] += 1
+        _log.warning("  [BREAKER] cloud circuit open for %.0fs", self.open_s)
+
+    def reset(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.outcomes.clear()
+            self.probe_at = None
+            self.probe = None
+
+    def snapshot(self):
+        with self.lock:
+            n = len(self.outcomes)
+            return {
+                "cloud_circuit": self.state,
+                "cloud_failure_rate": round(self.outcomes.count(False) / n, 3) if n else 0.0,
+            }
+
+
+
+# ──────────────────────────────────────────────
+# Latency budget: per-stage cost estimates + pruning
+# ──────────────────────────────────────────────
+
+class _StageCosts:
+    """Running (EWMA) wall-clock cost of each cascade stage, in ms."""
+
+    _DEFAULTS = {
+        "step1": 150.0,
+        "step4_5": 150.0,
+        "step5": 200.0,     # per segment
+        "step6": 250.0,
+        "cloud": 800.0,
+    }
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self.lock = threading.Lock()
+        self.costs = dict(self._DEFAULTS)
+
+    def record(self, stage, ms):
+        with self.lock:
+            self.costs[stage] += self.alpha * (ms - self.costs[stage])
+
+    def estimate(self, stage, units=1):
+        with self.lock:
+            return self.costs[stage] * units
+
+    def snapshot(self):
+        with self.lock:
+            return {"stage_ms_" + k: round(v, 1) for k, v in self.costs.items()}
+
+
+
+@contextlib.contextmanager
+def _timed_stage(stage, units=1):
+    """Record the wall-clock cost of a stage (per unit) into the session's stage_costs; yields {"ms": ...}."""
+    timer = {"ms": 0.0}
+    t0 = time.time()
+    try:
+        yield timer
+    finally:
+        timer["ms"] = (time.time() - t0) * 1000
+        _session().stage_costs.record(stage, timer["ms"] / max(1, units))
+
+
+def _plan_stage(state, stage, units=1):
+    """
+    Decide whether a local stage fits the request's remaining budget.
+    Returns "run", "prune" (skip it) or "cloud" (skip all remaining local
+    stages: only a cloud call can still meet the deadline).
+    """
+    if not state.deadline_ms:
+        return "run"
+    remaining = state.remaining_ms()
+    stage_costs = _session().stage_costs
+    stage_ms = stage_costs.estimate(stage, units)
+    cloud_ms = stage_costs.estimate("cloud")
+    if stage_ms + cloud_ms <= remaining:
+        return "run"        # room to try it and still fall back
+    if cloud_ms <= remaining:
+        return "cloud"
+    if stage_ms <= remaining:
+        return "run"        # cloud can't make it either: best-effort local
+    return "prune"
+
+
+# ──────────────────────────────────────────────
+# Learned stage ordering (per predicted tool + query shape)
+# ──────────────────────────────────────────────
+
+# Stage statistics are kept in memory unless a file is named here
+_ROUTE_STATS_PATH = os.environ.get("HYBRID_STAGE_STATS") or None
+_ROUTE_EXPLORE = float(os.environ.get("HYBRID_ROUTE_EXPLORE", "0.1"))
+_ROUTE_MIN_SUCCESS = float(os.environ.get("HYBRID_ROUTE_MIN_SUCCESS", "0.2"))
+
+
+def _query_shape(ctx, expected_count):
+    """Coarse query shape: action count, length bucket, has numbers, has names."""
+    words = ctx.tokens
+    length = "s" if len(words) <= 5 else ("m" if len(words) <= 10 else "l")
+    has_num = "num" if ctx.numbers else "-"
+    has_name = "name" if any(w[:1].isupper() for w in words[1:]) else "-"
+    return "n%d:%s:%s:%s" % (min(expected_count, 3), length, has_num, has_name)
+
+
+def _route_key(ctx, expected_count, tools):
+    """Stats key: predicted tool(s) + query shape."""
+    if expected_count == 1:
+        best = max(tools, key=lambda t: _tool_relevance(t, ctx.words))
+        predicted = best["name"] if _tool_relevance(best, ctx.words) > 0 else "*"
+    else:
+        predicted = "+".join(sorted({_match_tools_to_segment(seg, tools)[0]["name"]
+                                     for seg in ctx.segment_contexts()}))
+    return predicted + "|" + _query_shape(ctx, expected_count)
+
+
+class _StageRouter:
+    """
+    Online success-rate / cost statistics per (route key, stage), persisted
+    as JSON. plan() orders the candidate local stages by expected cost to
+    success (cost / p_success, the optimal order for a sequential cascade)
+    and drops stages whose success rate is below the target, exploring the
+    default order with probability `explore` so estimates stay fresh.
+    """
+
+    def __init__(self, path, explore=0.1, min_success=0.2, min_samples=8, save_every=50):
+        self.path = path
+        self.explore = explore
+        self.min_success = min_success
+        self.min_samples = min_samples
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.rng = random.Random()
+        self.table = None      # key -> stage -> [runs, successes, total_ms]
+        self.dirty = 0
+
+    def _load(self):
+        if self.table is not None:
+            return
+        self.table = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.table = json.load(f)
+            except (OSError, ValueError) as e:
+                _log.warning("  [ROUTE] ignoring unreadable stage stats %s: %s", self.path, e)
+
+    def save(self):
+        with self.lock:
+            if not self.path or not self.dirty or self.table is None:
+                return
+            data = json.dumps(self.table)
+            self.dirty = 0
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            _log.warning("  [ROUTE] could not save stage stats: %s", e)
+
+    def record(self, key, stage, success, ms):
+        with self.lock:
+            self._load()
+            entry = self.table.setdefault(key, {}).setdefault(stage, [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += 1 if success else 0
+            entry[2] += ms
+            self.dirty += 1
+            flush = self.dirty >= self.save_every
+        if flush:
+            self.save()
+
+    def estimate(self, key, stage):
+        """(runs, p_success with a Beta(1,1) prior, mean ms) for one stage."""
+        with self.lock:
+            self._load()
+            runs, succ, total = self.table.get(key, {}).get(stage, (0, 0, 0.0))
+        return runs, (succ + 1) / (runs + 2), (total / runs if runs else 0.0)
+
+    def plan(self, key, stages, reorder=True):
+        """Return the subset of `stages` to run, in cost order (given order unless `reorder`)."""
+        if self.rng.random() < self.explore:
+            _session().stats["route_explore"] += 1
+            return list(stages)
+        est = {st: self.estimate(key, st) for st in stages}
+        if any(runs < self.min_samples for runs, _, _ in est.values()):
+            return list(stages)
+        keep = [st for st in stages if est[st][1] >= self.min_success]
+        if not keep:
+            keep = [max(stages, key=lambda st: est[st][1])]
+        if reorder:
+            keep.sort(key=lambda st: est[st][2] / est[st][1])
+        if keep != list(stages):
+            _session().stats["route_reordered"] += 1
+        return keep
+
+    def snapshot(self):
+        with self.lock:
+            self._load()
+            return {"route_keys": len(self.table)}
+
+
+def _focused_stage(messages, tools, ctx, total_time, route_key):
+    """Run STEP 4.5 (_try_each_tool) with cost tracking. Returns (result_or_None, total_time)."""
+    with _timed_stage("step4_5") as timer:
+        focused, total_time = _try_each_tool(messages, tools, ctx, total_time)
+    _session().stage_router.record(route_key, "step4_5", focused is not None, timer["ms"])
+    return focused, total_time
+
+
+def _stage_allowed(state, stage, units=1):
+    """Gate a local stage on the latency budget, recording it when pruned."""
+    decision = "cloud" if state.cloud_now else _plan_stage(state, stage, units)
+    if decision == "run":
+        return True
+    state.pruned.append(stage)
+    stats = _session().stats
+    stats["stages_pruned"] += 1
+    if decision == "cloud" and not state.cloud_now:
+        state.cloud_now = True
+        stats["early_cloud"] += 1
+    _log.info("  [BUDGET] pruned %s (%s, %.0fms left)", stage, decision, state.remaining_ms())
+    return False
+
+
+# ──────────────────────────────────────────────
+# Negative cache: query shapes that never succeed locally
+# ──────────────────────────────────────────────
+
+_NEG_CACHE_SIZE = int(os.environ.get("HYBRID_NEG_CACHE_SIZE", "1024"))
+_NEG_CACHE_TTL_S = float(os.environ.get("HYBRID_NEG_CACHE_TTL", "600"))
+_NEG_CACHE_MIN_FAILURES = int(os.environ.get("HYBRID_NEG_CACHE_MIN_FAILURES", "2"))
+# "cloud": skip local entirely on a hit; "speculate": fire cloud at once, still try local
+_NEG_CACHE_MODE = os.environ.get("HYBRID_NEG_CACHE_MODE", "cloud")
+
+_TEMPLATE_NUMBER = re.compile(r'\d')
+
+
+def _query_template(ctx):
+    """
+    Normalize a query to its template: lowercase, punctuation stripped,
+    numbers -> <num>, capitalized words after the first -> <name>.
+    "Text Dave saying I'll be late at 5" -> "text <name> saying <name>'ll be late at <num>"
+    """
+    out = []
+    for i, w in enumerate(ctx.tokens):
+        core = _strip_punct(w)
+        if not core:
+            continue
+        if _TEMPLATE_NUMBER.search(core):
+            tok = "<num>"
+        elif i > 0 and core[0].isupper() and core.split("'")[0] != "I":
+            tok = "<name>"
+        else:
+            tok = core.lower()
+        if not (out and tok == out[-1] and tok[0] == "<"):
+            out.append(tok)
+    return " ".join(out)
+
+
+def _tool_fingerprint(tools):
+    """Stable short hash of a tool set (names + schemas), order-independent."""
+    blob = json.dumps(sorted(tools, key=lambda t: t["name"]), sort_keys=True)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:12]
+
+
+class _NegativeCache:
+    """
+    Bounded LRU of query templates whose local cascade keeps failing.
+    A key becomes a hit after `min_failures` confirmed local failures and
+    stays one for `ttl_s` seconds, after which local is retried. A local
+    success removes the key.
+    """
+
+    def __init__(self, max_entries=1024, ttl_s=600.0, min_failures=2):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.min_failures = min_failures
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()   # key -> [failures, expires_at]
+
+    def hit(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < self.min_failures:
+                return False
+            if time.time() >= entry[1]:
+                del self.entries[key]
+                _session().stats["negative_cache_expired"] += 1
+                return False
+            self.entries.move_to_end(key)
+            return True
+
+    def record_failure(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = [0, 0.0]
+            entry[0] += 1
+            if entry[0] == self.min_failures:
+                entry[1] = time.time() + self.ttl_s
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def forget(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def snapshot(self):
+        with self.lock:
+            return {"negative_cache_size": len(self.entries)}
+
+
+
+# ──────────────────────────────────────────────
+# Compact call representation (hashable, immutable snapshots)
+# ──────────────────────────────────────────────
+# Scope: cascade stages pass calls as dicts, because value fixers (a public
+# extension point) edit argument dicts in place. _Call is the identity used
+# to de-duplicate and merge calls (_call_key / _new_calls) and the form
+# single-flight keeps a shared result in; dicts are rebuilt from it per follower.
+
+class _FrozenMap(tuple):
+    """Sorted (key, value) pairs standing in for a nested dict."""
+    __slots__ = ()
+
+
+class _FrozenList(tuple):
+    """Items of a frozen list (plain tuples stay tuples)."""
+    __slots__ = ()
+
+
+def _freeze(value):
+    """Hashable, key-order-independent form of a JSON-like value."""
+    if isinstance(value, dict):
+        return _FrozenMap(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return _FrozenList(_freeze(v) for v in value)
+    if isinstance(value, tuple):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _thaw(value):
+    """Inverse of _freeze: fresh dicts and lists, tuples back as tuples."""
+    if isinstance(value, _FrozenMap):
+        return {k: _thaw(v) for k, v in value}
+    if isinstance(value, _FrozenList):
+        return [_thaw(v) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_thaw(v) for v in value)
+    return value
+
+
+class _Call:
+    """
+    Immutable function call: interned tool name, arguments as sorted
+    (key, value) pairs with nested containers frozen, hash computed once.
+    Calls with the same name and arguments (in any key order) are equal.
+    """
+
+    __slots__ = ("name", "args", "_hash")
+
+    def __init__(self, name, args):
+        self.name = sys.intern(name)
+        self.args = args
+        self._hash = hash((self.name, args))
+
+    @classmethod
+    def from_dict(cls, call):
+        args = call.get("arguments") or {}
+        return cls(str(call.get("name", "")), tuple(sorted((k, _freeze(v)) for k, v in args.items())))
+
+    def to_dict(self):
+        return {"name": self.name, "arguments": {k: _thaw(v) for k, v in self.args}}
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return (isinstance(other, _Call) and self._hash == other._hash
+                and self.name == other.name and self.args == other.args)
+
+    def __repr__(self):
+        return f"_Call({self.name!r}, {self.args!r})"
+
+
+def _norm_arg(value):
+    """Argument value as compared for duplicates: strings case- and whitespace-folded."""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    return value
+
+
+def _call_key(call):
+    """Canonical identity of a call dict: name + normalized argument values, key order ignored."""
+    args = call.get("arguments") or {}
+    return _Call(str(call.get("name", "")),
+                 tuple(sorted((k, _freeze(_norm_arg(v))) for k, v in args.items())))
+
+
+def _new_calls(calls, seen):
+    """Calls whose _call_key is not in `seen`, adding each kept key to it. O(len(calls))."""
+    fresh = []
+    for c in calls:
+        key = _call_key(c)
+        if key not in seen:
+            seen.add(key)
+            fresh.append(c)
+    return fresh
+
+
+def _freeze_result(result):
+    """Immutable snapshot of a result dict: (calls as _Call, other fields frozen)."""
+    calls = tuple(_Call.from_dict(c) for c in result.get("function_calls", []))
+    rest = tuple((k, _freeze(v)) for k, v in result.items() if k != "function_calls")
+    return calls, rest
+
+
+def _thaw_result(frozen):
+    """Fresh public-shape result dict from a _freeze_result snapshot."""
+    calls, rest = frozen
+    result = {"function_calls": [c.to_dict() for c in calls]}
+    for k, v in rest:
+        result[k] = _thaw(v)
+    return result
+
+
+# ──────────────────────────────────────────────
+# Single-flight: concurrent identical requests share one computation
+# ──────────────────────────────────────────────
+
+_SINGLE_FLIGHT = os.environ.get("HYBRID_SINGLE_FLIGHT", "1") != "0"
+
+
+def _flight_key(messages, tools):
+    """Key for de-duplication: role + whitespace-normalized content, plus the tool fingerprint."""
+    msgs = [(m.get("role", ""), " ".join(str(m.get("content", "")).split())) for m in messages]
+    return json.dumps(msgs, ensure_ascii=False) + "|" + _tool_fingerprint(tools)
+
+
+def _hybrid_flight_key(messages, tools):
+    """
+    _flight_key plus the caller's priority and remaining-deadline bucket
+    (powers of two), so a follower never waits on a run admitted under a
+    lower priority or a much looser deadline than its own.
+    """
+    state = _begin_request()
+    bucket = max(0, int(state.remaining_ms())).bit_length() if state.deadline_ms else "-"
+    return "%s|p%d|d%s" % (_flight_key(messages, tools), state.priority, bucket)
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "followers", "aborted")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+        self.aborted = False   # async leader cancelled (aborted speculation): followers run fn themselves
+
+
+class _SingleFlight:
+    """
+    Collapse concurrent calls with the same key onto one computation.
+    The first caller (leader) runs fn; callers arriving while it is in
+    flight wait for it and get a fresh copy of its result (or its exception),
+    thawed from a compact _freeze_result snapshot.
+    Nothing is cached once the leader returns.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, fn, *args):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            flight.done.wait()
+            if flight.aborted:
+                return fn(*args)
+            return self._shared(flight)
+
+        result = None
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight, result)
+        return result
+
+    async def ado(self, key, fn, *args):
+        """do() for a coroutine function; the leader may be cancelled without failing its followers."""
+        import asyncio
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            else:
+                flight.followers += 1
+        if not leader:
+            await asyncio.get_running_loop().run_in_executor(None, flight.done.wait)
+            if flight.aborted:
+                return await fn(*args)
+            return self._shared(flight)
+
+        result = None
+        try:
+            result = await fn(*args)
+        except asyncio.CancelledError:
+            flight.aborted = True
+            raise
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight, result)
+        return result
+
+    def _shared(self, flight):
+        _session().stats[f"singleflight_{self.name}_shared"] += 1
+        if flight.error is not None:
+            raise flight.error
+        return _thaw_result(flight.result)
+
+    def _land(self, key, flight, result):
+        with self.lock:
+            del self.flights[key]
+            shared = flight.followers
+        if shared and flight.error is None and not flight.aborted:
+            # Snapshot before handing back, so the leader's caller can't mutate what followers copy
+            flight.result = _freeze_result(result)
+        flight.done.set()
+
+    def snapshot(self):
+        with self.lock:
+            return {f"singleflight_{self.name}_in_flight": len(self.flights)}
+
 
 
 # ──────────────────────────────────────────────
@@ -1030,80 +3391,226 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
     - JSON sanitization + regex extraction for broken-but-correct answers
     - Early text-response detection to skip retries for hopeless cases
     - Argument quality validation to prevent garbage acceptance
+    - Deadline-aware admission: shed to cloud or skip retries when the
+      local queue can't meet the request's deadline (see request_options)
+    - Single-flight: identical concurrent requests share one cascade run
+
+    Runs on the current HybridSession (the default one unless called inside
+    `with session:`); see HybridSession.generate_hybrid.
+    """
+    return _session().generate_hybrid(messages, tools, confidence_threshold)
+
+
+def _generate_hybrid_once(messages, tools, conversation=None):
+    _wait_for_warmup()
+    state = _begin_request()
+    state.conversation = conversation
+    token = _request_ctx.set(state)
+    try:
+        result = _hybrid_cascade(messages, tools, state)
+    finally:
+        _request_ctx.reset(token)
+        _cancel_cloud(state.cloud_spec)
+        if state.local_calls:
+            _session().scheduler.record_request(state.local_calls)
+    if state.pruned:
+        result["pruned_stages"] = list(state.pruned)
+    if state.neg_key:
+        negative_cache = _session().negative_cache
+        if result.get("source") == "on-device":
+            negative_cache.forget(state.neg_key)
+        elif state.local_exhausted:
+            negative_cache.record_failure(state.neg_key)
+    return result
+
+
+def _admission_decision(state):
     """
-    query = messages[-1]["content"]
-    expected_count = _count_expected_actions(query)
+    Compare projected local queue wait with the time left before the deadline.
+    Returns "full" (run the whole cascade), "step1_only" (one local pass, no
+    retries) or "shed" (go straight to cloud).
+    """
+    if not state.deadline_ms:
+        return "full"
+    remaining = state.deadline_ms - state.elapsed_ms()
+    scheduler = _session().scheduler
+    per_call = scheduler.projected_wait_ms(state.priority) + scheduler.service_ms
+    if per_call > remaining:
+        return "shed"
+    if per_call * scheduler.calls_per_request > remaining:
+        return "step1_only"
+    return "full"
+
+
+def _hybrid_cascade(messages, tools, state):
+    """The cascade behind generate_hybrid; `state` is the current _RequestState."""
+    session = _session()
+    stats = session.stats
+    ctx = QueryContext(messages[-1]["content"])
+    expected_count = ctx.expected_count
     total_time = 0
 
+    # ── ADMISSION: can the local queue meet this request's deadline? ──
+    admission = _admission_decision(state)
+    if admission == "shed":
+        _log.info("  [ADMIT] shedding to cloud (priority=%d deadline=%.0fms)",
+                  state.priority, state.deadline_ms)
+        cloud = generate_cloud_with_timeout(messages, tools)
+        if cloud.get("function_calls"):
+            stats["shed_to_cloud"] += 1
+            _fix_values(cloud, tools, ctx)
+            cloud["source"] = "cloud (fallback)"
+            return cloud
+        _log.info("  [ADMIT] shed cloud call returned nothing; running locally")
+        admission = "step1_only"
+    retries_allowed = admission == "full"
+
+    # ── NEGATIVE CACHE: this query shape keeps failing every local stage ──
+    state.neg_key = _query_template(ctx) + "#" + _tool_fingerprint(tools)
+    known_local_failure = session.negative_cache.hit(state.neg_key)
+    neg_cloud = None  # the empty answer of the up-front cloud call, reused at STEP 7
+    if known_local_failure:
+        stats["negative_cache_hits"] += 1
+        _log.info("  [NEGCACHE] hit (%s): %s", _NEG_CACHE_MODE, state.neg_key)
+        if _NEG_CACHE_MODE == "cloud":
+            cloud = generate_cloud_with_timeout(messages, tools)
+            if cloud.get("function_calls"):
+                _fix_values(cloud, tools, ctx)
+                cloud["source"] = "cloud (fallback)"
+                return cloud
+            neg_cloud = cloud
+
     # ── PARALLEL CLOUD SPECULATION for multi-action queries ──
     # Multi-action queries are risky (decomposition may fail partially).
     # Fire cloud in background so it runs in parallel with local inference.
-    cloud_future = None
-    cloud_executor = None
-    if expected_count >= 2:
-        cloud_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
-        cloud_future = cloud_executor.submit(generate_cloud, messages, tools)
-        _log.info("  [SPEC] parallel cloud fired for multi-action query")
+    # Also for any query shape the negative cache says will fail locally,
+    # unless the cloud was already asked above.
+    cloud_spec = None
+    speculating = (expected_count >= 2 or known_local_failure) and neg_cloud is None
+    if speculating:
+        cloud_spec = state.cloud_spec = _speculate_cloud(messages, tools)
+        _log.info("  [SPEC] parallel cloud fired")
 
     # ── Tool pre-filtering for single-action queries ──
     # Only narrow if a tool has positive keyword relevance; otherwise keep all
     initial_tools = tools
     if expected_count == 1 and len(tools) > 1:
-        query_words = {_strip_punct(w) for w in query.lower().split()} - {""}
-        scored = [(t, _tool_relevance(t, query_words)) for t in tools]
+        scored = [(t, _tool_relevance(t, ctx.words)) for t in tools]
         best_score = max(s for _, s in scored)
         if best_score > 0:
             best_tool = max(scored, key=lambda x: x[1])[0]
             initial_tools = [best_tool]
         # else: no keyword match — keep all tools, let model choose
 
+    # ── SLOT FILL: the parser and value fixers fill every required parameter (no model call) ──
+    if (_SLOT_FILL and expected_count == 1 and len(initial_tools) == 1
+            and _tool_relevance(initial_tools[0], ctx.words) > 0):
+        filled = _slot_fill_call(ctx, initial_tools[0])
+        if filled:
+            result = {"function_calls": [filled], "total_time_ms": total_time, "source": "on-device"}
+            _fix_values(result, tools, ctx)
+            call = result["function_calls"][0]
+            if _validate(result, tools)[0] and _args_look_good(call, ctx):
+                stats["slot_fill_accepted"] += 1
+                _log.info("  → SLOT FILL %s(%s)", call["name"], json.dumps(call["arguments"]))
+                return result
+
     # ── Dynamic max_tokens based on complexity ──
     if expected_count == 1:
         init_max_tokens = 64
     else:
         init_max_tokens = 256
 
+    # ── Learned stage plan: which local model stages to run, in what order ──
+    route_key = _route_key(ctx, expected_count, tools)
+    default_plan = ["step1", "step4_5"] if expected_count == 1 else ["step1", "step5"]
+    # STEP 1 always runs before STEP 5 (whose fallback keeps STEP 1's good calls),
+    # so a multi-action plan can only drop a stage, not reorder them
+    plan = (session.stage_router.plan(route_key, default_plan, reorder=expected_count == 1)
+            if retries_allowed else default_plan)
+    if plan != default_plan:
+        _log.info("  [ROUTE] %s plan=%s", route_key, plan)
+    tried_focused = False
+    ran_local = False  # some local model stage ran (the router may skip STEP 1)
+
+    # ── STEP 4.5 first, when it is the cheaper path to success for this tool ──
+    if expected_count == 1 and plan[0] == "step4_5" and _stage_allowed(state, "step4_5"):
+        tried_focused = ran_local = True
+        focused, total_time = _focused_stage(messages, tools, ctx, total_time, route_key)
+        if focused:
+            stats["step4_5_accepted"] += 1
+            _log.info("  → STEP4.5 (routed first) accepted (%.0fms)", total_time)
+            return focused
+
     # ── STEP 1: LOCAL INFERENCE ──
-    local = _run_local(messages, initial_tools, max_tokens=init_max_tokens)
+    if "step1" in plan:
+        ran_local = True
+        with _timed_stage("step1") as step1_timer:
+            if state.conversation is not None:
+                local = state.conversation._complete_turn(init_max_tokens)
+                # Before fixing: a fixer would rewrite a re-emitted earlier call to this turn's slots
+                local["function_calls"] = _calls_for_turn(local.get("function_calls", []), ctx, tools)
+            else:
+                local = _run_local(messages, initial_tools, max_tokens=init_max_tokens)
+    else:
+        local = {"function_calls": [], "total_time_ms": 0, "confidence": 0, "_raw": "<STEP1 skipped by router>"}
     total_time += local["total_time_ms"]
 
     # ── STEP 2: FIX VALUES (zero-latency) ──
-    _fix_values(local, tools, query)
+    _fix_values(local, tools, ctx)
 
     # ── STEP 3: VALIDATE ──
     valid, issue = _validate(local, tools)
+    if "step1" not in plan:
+        issue = "skipped"
     actual_count = len(local.get("function_calls", []))
 
     # ── STEP 4: ACCEPT if valid, complete, and args look good ──
-    good_calls = [c for c in local.get("function_calls", []) if _args_look_good(c, query)]
+    good_calls = [c for c in local.get("function_calls", []) if _args_look_good(c, ctx)]
     good_count = len(good_calls)
 
     _log.info(
         "  [STEP1] valid=%s issue=%s calls=%d good=%d/%d tools=%d time=%.0fms | %s",
         valid, issue, actual_count, good_count, expected_count,
-        len(initial_tools), total_time, query[:60],
+        len(initial_tools), total_time, ctx.text[:60],
     )
     if valid and not (good_count >= expected_count):
         for c in local.get("function_calls", []):
-            reason = _check_args(c, query)
+            reason = _check_args(c, ctx)
             if reason:
                 _log.info("    rejected call: %s(%s) reason=%s",
                           c.get("name"), json.dumps(c.get("arguments", {})), reason)
 
+    if "step1" in plan:
+        session.stage_router.record(route_key, "step1", valid and good_count >= expected_count, step1_timer["ms"])
+
     if valid and good_count >= expected_count:
-        _cancel_cloud(cloud_future, cloud_executor)
-        _stats["step4_accepted"] += 1
+        _cancel_cloud(cloud_spec)
+        stats["step4_accepted"] += 1
         _log.info("  → STEP4 accepted (%.0fms)", total_time)
         local["source"] = "on-device"
         local["total_time_ms"] = total_time
         return local
 
+    # ── Over budget for retries: keep what STEP 1 got right, else cloud ──
+    if not retries_allowed:
+        stats["admission_step1_only"] += 1
+        if valid and good_count > 0:
+            _cancel_cloud(cloud_spec)
+            _log.info("  → STEP1-only accepted %d/%d calls (%.0fms)", good_count, expected_count, total_time)
+            local["function_calls"] = good_calls
+            local["source"] = "on-device"
+            local["total_time_ms"] = total_time
+            return local
+
     # ── STEP 4.5: For single-tool queries, try each tool individually ──
-    if expected_count == 1:
-        focused, total_time = _try_each_tool(messages, tools, query, total_time)
+    if (retries_allowed and expected_count == 1 and "step4_5" in plan and not tried_focused
+            and _stage_allowed(state, "step4_5")):
+        ran_local = True
+        focused, total_time = _focused_stage(messages, tools, ctx, total_time, route_key)
         if focused:
-            _cancel_cloud(cloud_future, cloud_executor)
-            _stats["step4_5_accepted"] += 1
+            _cancel_cloud(cloud_spec)
+            stats["step4_5_accepted"] += 1
             _log.info("  → STEP4.5 accepted (%.0fms)", total_time)
             return focused
 
@@ -1111,16 +3618,16 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
     # When the model completely fails, try to construct a call from query keywords.
     # This is the "heuristic extraction" approach from the agent paper — use the tool
     # schema itself to guide extraction when the SLM can't help.
-    if expected_count == 1 and issue == "no_calls":
-        query_words = {_strip_punct(w) for w in query.lower().split()} - {""}
-        scored = [(t, _tool_relevance(t, query_words)) for t in tools]
+    if expected_count == 1 and issue in ("no_calls", "skipped"):
+        scored = [(t, _tool_relevance(t, ctx.words)) for t in tools]
         best_tool = max(scored, key=lambda x: x[1])[0]
         if max(s for _, s in scored) > 0:
-            synthetic = _construct_synthetic_call(query, best_tool)
+            synthetic = _construct_synthetic_call(ctx, best_tool)
             if synthetic:
-                _fix_values({"function_calls": [synthetic]}, tools, query)
+                _fix_values({"function_calls": [synthetic]}, tools, ctx)
                 s_valid, _ = _validate({"function_calls": [synthetic]}, tools)
-                if s_valid and _args_look_good(synthetic, query):
+                if s_valid and _args_look_good(synthetic, ctx):
+                    _cancel_cloud(cloud_spec)
                     _log.info("  → STEP4.6 synthetic call: %s(%s)",
                               synthetic["name"], json.dumps(synthetic["arguments"]))
                     return {
@@ -1130,34 +3637,41 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
                     }
 
     # ── STEP 5: IMPROVE partial/garbled results for multi-action queries ──
-    if expected_count > 1:
-        decomposed = _decompose_and_solve(query, tools, total_time)
+    if (retries_allowed and expected_count > 1 and "step5" in plan
+            and _stage_allowed(state, "step5", expected_count)):
+        with _timed_stage("step5", expected_count) as step5_timer:
+            decomposed = _decompose_and_solve(ctx, tools, total_time)
+        full = False
         if decomposed is not None:
-            _fix_values(decomposed, tools, query)
+            _fix_values(decomposed, tools, ctx)
             d_valid, _ = _validate(decomposed, tools)
             d_count = len(decomposed.get("function_calls", []))
             failed_segs = decomposed.get("_failed_segments", [])
-
-            if d_valid and d_count >= expected_count and not failed_segs:
-                _cancel_cloud(cloud_future, cloud_executor)
-                _stats["step5_decomp_full"] += 1
+            full = d_valid and d_count >= expected_count and not failed_segs
+        session.stage_router.record(route_key, "step5", full, step5_timer["ms"])
+        if decomposed is not None:
+            if full:
+                _cancel_cloud(cloud_spec)
+                stats["step5_decomp_full"] += 1
                 _log.info("  → STEP5 decomp full (%.0fms)", decomposed["total_time_ms"])
                 return decomposed
 
             if d_valid and d_count > 0 and failed_segs:
-                _stats["step5_decomp_partial"] += 1
+                stats["step5_decomp_partial"] += 1
                 _log.info("  → STEP5 decomp partial, cloud filling %s", failed_segs)
+                _cancel_cloud(cloud_spec)
                 # Always use targeted cloud for just the failed segments
                 # (more reliable than full-query cloud which may drop calls)
                 cloud = generate_cloud_with_timeout(
                     [{"role": "user", "content": " and ".join(failed_segs)}],
                     tools,
                 )
-                _fix_values(cloud, tools, query)
+                _fix_values(cloud, tools, ctx)
                 total_time_combined = max(decomposed["total_time_ms"],
                                           cloud["total_time_ms"])
                 merged = list(decomposed["function_calls"])
-                merged.extend(cloud.get("function_calls", []))
+                seen = {_call_key(c) for c in merged}
+                merged.extend(_new_calls(cloud.get("function_calls", []), seen))
                 return {
                     "function_calls": merged,
                     "total_time_ms": total_time_combined,
@@ -1165,7 +3679,7 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
                 }
 
             if d_valid and d_count >= expected_count:
-                _cancel_cloud(cloud_future, cloud_executor)
+                _cancel_cloud(cloud_spec)
                 return decomposed
 
             total_time = decomposed["total_time_ms"]
@@ -1173,20 +3687,19 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
             _log.info("  [STEP5] decomposition returned None (all segments failed)")
 
         # Decomposition failed entirely — use parallel cloud if available
-        if cloud_future is not None:
+        state.local_exhausted = not state.pruned
+        if cloud_spec is not None:
             _log.info("  → using parallel cloud result (decomp failed)")
             try:
-                cloud = cloud_future.result(timeout=10)
+                cloud = cloud_spec.result(timeout=_cloud_timeout_s(tools))
             except Exception:
+                cloud_spec.cancel()
                 cloud = generate_cloud_with_timeout(messages, tools)
-            if cloud_executor:
-                cloud_executor.shutdown(wait=False)
-            _fix_values(cloud, tools, query)
-            cloud_future = None
-            cloud_executor = None
+            _fix_values(cloud, tools, ctx)
+            cloud_spec = None
             cloud_calls = cloud.get("function_calls", [])
             if cloud_calls:
-                _stats["cloud_fallback"] += 1
+                stats["cloud_fallback"] += 1
                 cloud_time = max(total_time, cloud["total_time_ms"])
                 return {
                     "function_calls": cloud_calls,
@@ -1196,50 +3709,699 @@ def generate_hybrid(messages, tools, confidence_threshold=0.99):
 
         # No cloud result either — accept good local calls if any
         if good_count > 0:
-            _cancel_cloud(cloud_future, cloud_executor)
+            _cancel_cloud(cloud_spec)
             local["function_calls"] = good_calls
             local["source"] = "on-device"
             local["total_time_ms"] = total_time
             return local
 
     # ── STEP 6: One retry for single-action no_calls ──
-    if issue == "no_calls" and expected_count == 1:
+    if (retries_allowed and issue == "no_calls" and expected_count == 1
+            and _stage_allowed(state, "step6")):
         _log.info("  → STEP6 no_calls retry")
-        retry = _run_local(messages, tools, max_tokens=256)
+        ran_local = True
+        with _timed_stage("step6"):
+            retry = _run_local(messages, tools, max_tokens=256)
         total_time += retry["total_time_ms"]
-        _fix_values(retry, tools, query)
+        _fix_values(retry, tools, ctx)
         r_valid, _ = _validate(retry, tools)
-        if r_valid and all(_args_look_good(c, query) for c in retry.get("function_calls", [])):
-            _stats["step6_retry_accepted"] += 1
+        if r_valid and all(_args_look_good(c, ctx) for c in retry.get("function_calls", [])):
+            _cancel_cloud(cloud_spec)
+            stats["step6_retry_accepted"] += 1
             _log.info("  → STEP6 retry accepted (%.0fms)", total_time)
             retry["source"] = "on-device"
             retry["total_time_ms"] = total_time
             return retry
 
     # ── STEP 7: Cloud fallback ──
-    _log_local_failure("STEP7-cloud", local, query, issue=issue)
-    _stats["cloud_fallback"] += 1
+    state.local_exhausted = ran_local and retries_allowed and not state.pruned
+    _log_local_failure("STEP7-cloud", local, ctx, issue=issue)
+    stats["cloud_fallback"] += 1
     _log.info("  → CLOUD fallback (%.0fms local)", total_time)
     # Use parallel cloud result if still available
-    if cloud_future is not None:
+    if cloud_spec is not None:
         try:
-            cloud = cloud_future.result(timeout=10)
+            cloud = cloud_spec.result(timeout=_cloud_timeout_s(tools))
         except Exception:
+            cloud_spec.cancel()
             cloud = generate_cloud_with_timeout(messages, tools)
-        if cloud_executor:
-            cloud_executor.shutdown(wait=False)
+    elif neg_cloud is not None:
+        cloud = neg_cloud
     else:
         cloud = generate_cloud_with_timeout(messages, tools)
-    _fix_values(cloud, tools, query)
+    circuit_open = cloud.pop("_circuit_open", False)
+    if circuit_open and not cloud.get("function_calls") and good_count > 0:
+        # Cloud is known to be down: the best local calls beat an empty answer
+        stats["circuit_local_fallback"] += 1
+        _log.info("  → cloud circuit open, returning %d good local call(s)", good_count)
+        local["function_calls"] = good_calls
+        local["source"] = "on-device"
+        local["total_time_ms"] = total_time
+        return local
+    _fix_values(cloud, tools, ctx)
     cloud["source"] = "cloud (fallback)"
     # For parallel speculation, use max time (they ran simultaneously)
-    if expected_count >= 2:
+    if speculating:
         cloud["total_time_ms"] = max(total_time, cloud["total_time_ms"])
     else:
         cloud["total_time_ms"] += total_time
     return cloud
 
 
+# ──────────────────────────────────────────────
+# Conversation mode (multi-turn, incremental prefill)
+# ──────────────────────────────────────────────
+
+def _slot_agrees(value, expected):
+    if isinstance(expected, int):
+        try:
+            return int(value) == expected
+        except (TypeError, ValueError):
+            return False
+    return value == expected or expected in QueryContext(str(value)).time_strings
+
+
+def _calls_for_turn(calls, ctx, tools):
+    """
+    The STEP 1 calls (unfixed) that answer the latest turn: the tool is
+    relevant to some segment of it, not contradicted by it, and every
+    argument the segment's slots determine agrees with them. A call the
+    model re-emits for an earlier turn fails one of these and is dropped.
+    """
+    tool_map = {t["name"]: t for t in tools}
+    kept = []
+    for call in calls:
+        tool = tool_map.get(call.get("name", ""))
+        args = call.get("arguments") or {}
+        for seg in (ctx.segment_contexts() if tool else ()):
+            if not _tool_relevance(tool, seg.words) or not _tool_matches_query(call, seg):
+                continue
+            slots = ((k, _slot_value(seg, tool, k)) for k in args)
+            if all(expected is None or _slot_agrees(args[k], expected) for k, expected in slots):
+                kept.append(call)
+                break
+    dropped = len(calls) - len(kept)
+    if dropped:
+        _session().stats["conversation_calls_dropped"] += dropped
+        _log.info("  [CONV] dropped %d call(s) answering earlier turns", dropped)
+    return kept
+
+
+class Conversation:
+    """
+    Multi-turn mode on a dedicated FunctionGemma handle. The handle's KV
+    cache keeps the prompt of the last turn, so a turn that only appends
+    messages skips cactus_reset and the engine prefills just the new ones.
+    Any other change (an edited, removed or reordered message) resets the
+    handle and prefills the whole history again.
+
+    Only STEP 1 reads the history, over the conversation's whole tool set so
+    the cached prefix stays valid; the rest of the cascade and any cloud call
+    answer the latest user message alone, like a single-turn request.
+
+        with session.conversation(tools) as conv:
+            conv.send("Wake me up at 7")
+            conv.send("Also remind me to call Mom at 8:00 AM")
+    """
+
+    def __init__(self, tools, session=None):
+        self.tools = tools
+        self.session = session or _session()
+        self.messages = []     # history of send(); generate() callers keep their own
+        self.model = None
+        self.prefilled = None  # (tool fingerprint, prompt messages) held in the handle's KV cache
+        self.turn = None       # messages of the turn in progress
+        self.lock = threading.Lock()
+        self.closed = False
+        self.session.conversations.add(self)
+
+    def send(self, content):
+        """Append a user message to the history and answer it."""
+        messages = self.messages + [{"role": "user", "content": content}]
+        result = self.generate(messages)
+        self.messages = messages
+        return result
+
+    def generate(self, messages):
+        """
+        generate_hybrid for the last message of `messages`, a history that
+        usually extends the previous call's. Returns the generate_hybrid result.
+        """
+        if not messages or messages[-1].get("role") != "user":
+            raise ValueError("the last message must be from the user")
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Conversation is closed")
+            self.turn = messages
+            try:
+                with self.session._bound():
+                    self.session.stats["conversation_turns"] += 1
+                    return _generate_hybrid_once(messages[-1:], self.tools, conversation=self)
+            finally:
+                self.turn = None
+
+    def _complete_turn(self, max_tokens):
+        """STEP 1 over the whole history, prefilling only what the KV cache lacks."""
+        cactus = _cactus()
+        if self.model is None:
+            self.model = cactus.cactus_init(functiongemma_path)
+            self.prefilled = None
+            self.session.scheduler.add_dedicated(self.model)
+        prompt = [{"role": "system", "content": _DEFAULT_PROMPT}] + [dict(m) for m in self.turn]
+        key = _tool_fingerprint(self.tools)
+        cached = self.prefilled
+        if cached is not None and cached[0] == key and prompt[:len(cached[1])] == cached[1]:
+            self.session.stats["conversation_prefill_incremental"] += 1
+        else:
+            if cached is not None:
+                self.session.stats["conversation_prefill_reset"] += 1
+                _log.info("  [CONV] history edited, full prefill of %d messages", len(prompt))
+            cactus.cactus_reset(self.model)
+        self.prefilled = None   # unknown until the completion returns
+        with _counted_completion():
+            raw_str = cactus.cactus_complete(
+                self.model,
+                prompt,
+                tools=[{"type": "function", "function": t} for t in self.tools],
+                force_tools=True,
+                max_tokens=max_tokens,
+                stop_sequences=["<|im_end|>", "<end_of_turn>"],
+            )
+        self.prefilled = (key, prompt)
+        return _parse_local_output(raw_str, self.tools)
+
+    def release(self):
+        """Destroy the handle; the next turn loads a fresh one and prefills the whole history."""
+        with self.lock:
+            model, self.model, self.prefilled = self.model, None, None
+        if model is not None:
+            self.session.scheduler.remove_dedicated(model)
+            _cactus().cactus_destroy(model)
+
+    def close(self):
+        self.release()
+        self.closed = True
+        self.session.conversations.discard(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# ──────────────────────────────────────────────
+# Sessions: model handles, tool indexes, caches, stats and cloud client
+# ──────────────────────────────────────────────
+
+class HybridSession:
+    """
+    One isolated hybrid engine. Owns its FunctionGemma handles and
+    scheduler, tool keyword index, fixer and validator caches, learned
+    stage routing, negative cache, single-flight tables, cloud client,
+    dispatcher, hedger, breaker and latency windows, and stage counters.
+    Only the lazily imported backends and the speculation event loop are
+    shared by every session in the process.
+
+        with HybridSession(model_handles=2) as session:
+            session.warmup(tools)
+            session.generate_hybrid(messages, tools)
+
+    A `with` block also binds the session for module-level calls made inside
+    it (generate_hybrid, generate_cloud, warmup, get_stats, ...) and closes
+    it on exit. Outside any session those calls use the default session.
+    """
+
+    def __init__(self, model_handles=None, api_key=None, route_stats_path=_ROUTE_STATS_PATH):
+        self.api_key = api_key
+        self.stats = dict.fromkeys(_STAT_COUNTERS, 0)
+        self.scheduler = _LocalScheduler(model_handles or _MODEL_HANDLES)
+        self.warmup_lock = threading.Lock()   # held for the whole warm-up; requests wait on it
+        self.cloud_client = None
+        self.tool_keywords = {}   # tool name → set of keywords
+        self.fixers = _SchemaCache(_bind_fixer_rules)   # (tool name, parameters dict) → value-fixer rules
+        # (tool name, parameters dict) → generated validator
+        self.validators = _SchemaCache(lambda name, parameters: _compile_validator(parameters))
+        self.stage_costs = _StageCosts()
+        self.stage_router = _StageRouter(route_stats_path, _ROUTE_EXPLORE, _ROUTE_MIN_SUCCESS)
+        self.negative_cache = _NegativeCache(_NEG_CACHE_SIZE, _NEG_CACHE_TTL_S, _NEG_CACHE_MIN_FAILURES)
+        self.hybrid_flights = _SingleFlight("hybrid")
+        self.cloud_flights = _SingleFlight("cloud")
+        self.cloud_dispatcher = _CloudDispatcher(_CLOUD_BATCH_MS, _CLOUD_BATCH_MAX, _CLOUD_CONCURRENCY)
+        self.cloud_hedger = _CloudHedger(_HEDGE_PCT, _HEDGE_BUDGET)
+        self.cloud_breaker = _CircuitBreaker(_BREAKER_WINDOW, _BREAKER_MIN_CALLS, _BREAKER_FAILURE_RATE,
+                                             _BREAKER_OPEN_S)
+        self.cloud_latency = _CloudLatency(
+            _CLOUD_REGION, factor=_CLOUD_TIMEOUT_FACTOR, floor_ms=_CLOUD_TIMEOUT_FLOOR_MS,
+            ceil_ms=_CLOUD_TIMEOUT_CEIL_MS, default_ms=_CLOUD_TIMEOUT_DEFAULT_MS,
+        )
+        self.cloud_ttfc_ms = collections.deque(maxlen=256)   # streamed request → first complete call
+        self.cloud_proxy = None   # callable(messages, tools) answering generate_cloud elsewhere (pool workers)
+        self.conversations = weakref.WeakSet()               # open Conversations (own handles)
+        self.closed = False
+        self._tokens = []
+        _live_sessions.add(self)
+
+    @property
+    def model_handles(self):
+        return self.scheduler.max_handles
+
+    # ── Lifecycle ──
+
+    def __enter__(self):
+        self._check_open()
+        self._tokens.append(_session_ctx.set(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        _session_ctx.reset(self._tokens.pop())
+        if not self._tokens:
+            self.close()
+
+    def _check_open(self):
+        if self.closed:
+            raise RuntimeError("HybridSession is closed")
+
+    @contextlib.contextmanager
+    def _bound(self):
+        self._check_open()
+        token = _session_ctx.set(self)
+        try:
+            yield self
+        finally:
+            _session_ctx.reset(token)
+
+    def release_backends(self):
+        """Destroy the model handles and drop the cloud client; both come back lazily on next use."""
+        for model in self.scheduler.drain():
+            _cactus().cactus_destroy(model)
+        for conversation in list(self.conversations):
+            conversation.release()
+        self.cloud_client = None
+
+    def close(self):
+        """Release the backends, stop the cloud worker threads and persist stage stats. Idempotent."""
+        if self.closed:
+            return
+        self.closed = True
+        _live_sessions.discard(self)
+        self.cloud_dispatcher.close()
+        self.cloud_hedger.close()
+        for conversation in list(self.conversations):
+            conversation.close()
+        self.release_backends()
+        self.stage_router.save()
+
+    # ── Requests ──
+
+    def generate_hybrid(self, messages, tools, confidence_threshold=0.99):
+        """generate_hybrid on this session."""
+        with self._bound():
+            if not _SINGLE_FLIGHT:
+                return _generate_hybrid_once(messages, tools)
+            return self.hybrid_flights.do(_hybrid_flight_key(messages, tools), _generate_hybrid_once, messages, tools)
+
+    def generate_cloud(self, messages, tools):
+        """generate_cloud on this session."""
+        with self._bound():
+            return generate_cloud(messages, tools)
+
+    def conversation(self, tools):
+        """A multi-turn Conversation on this session."""
+        self._check_open()
+        return Conversation(tools, self)
+
+    def warmup(self, tools=None):
+        with self._bound():
+            return warmup(tools)
+
+    def warmup_async(self, tools=None):
+        with self._bound():
+            return warmup_async(tools)
+
+    # ── Counters ──
+
+    def reset_stats(self):
+        for k in self.stats:
+            self.stats[k] = 0
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        for part in (self.scheduler, self.stage_costs, self.stage_router, self.negative_cache,
+                     self.hybrid_flights, self.cloud_flights, self.cloud_dispatcher, self.cloud_hedger,
+                     self.cloud_breaker, self.cloud_latency):
+            stats.update(part.snapshot())
+        ttfc = list(self.cloud_ttfc_ms)
+        if ttfc:
+            stats["cloud_ttfc_p50_ms"] = round(_percentile(ttfc, 50), 1)
+            stats["cloud_ttfc_p99_ms"] = round(_percentile(ttfc, 99), 1)
+        return stats
+
+
+def default_session():
+    """The session module-level calls use outside any `with session:` block."""
+    return _default_session
+
+
+def set_default_session(session):
+    """Make `session` the default; returns the previous one (left open)."""
+    global _default_session
+    previous, _default_session = _default_session, session
+    return previous
+
+
+_default_session = HybridSession()
+
+
+# ──────────────────────────────────────────────
+# Process-pool local backend (many-core hosts)
+# ──────────────────────────────────────────────
+
+# Worker processes of a ProcessPoolBackend (0 = one per core); each owns one FunctionGemma handle
+_POOL_WORKERS = int(os.environ.get("HYBRID_POOL_WORKERS", "0")) or (os.cpu_count() or 1)
+# Requests a worker runs at once, so one can wait on the cloud while another uses the handle
+_POOL_WORKER_THREADS = max(1, int(os.environ.get("HYBRID_POOL_WORKER_THREADS", "2")))
+
+
+def _pool_encode(msg):
+    return json.dumps(msg, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class _PoolCloudProxy:
+    """Worker side of the pool: generate_cloud is answered by the parent process."""
+
+    def __init__(self, conn, send_lock):
+        self.conn = conn
+        self.send_lock = send_lock
+        self.lock = threading.Lock()
+        self.ids = itertools.count()
+        self.pending = {}     # call id → Future
+        self.tool_refs = {}   # id(tool set list) → fingerprint the parent knows it by
+
+    def __call__(self, messages, tools):
+        call_id = next(self.ids)
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.pending[call_id] = future
+        data = _pool_encode(["cloud", call_id, messages, self.tool_refs.get(id(tools), tools)])
+        with self.send_lock:
+            self.conn.send_bytes(data)
+        timeout_sec = _cloud_timeout_s(tools)
+        try:
+            return future.result(timeout=timeout_sec)
+        except concurrent.futures.TimeoutError:
+            # A wedged parent-side call must not hang this worker; a late answer is dropped
+            with self.lock:
+                self.pending.pop(call_id, None)
+            _session().stats["cloud_timeouts"] += 1
+            return {"function_calls": [], "total_time_ms": timeout_sec * 1000, "source": "cloud (fallback)"}
+
+    def resolve(self, call_id, result):
+        with self.lock:
+            future = self.pending.pop(call_id, None)
+        if future is not None:
+            future.set_result(result)
+
+
+def _pool_worker(conn, initializer, initargs, threads, warm):
+    """Worker process main: one single-handle session running whole cascades."""
+    if initializer is not None:
+        initializer(*initargs)
+    session = HybridSession(model_handles=1, route_stats_path=None)
+    set_default_session(session)
+    send_lock = threading.Lock()
+    proxy = session.cloud_proxy = _PoolCloudProxy(conn, send_lock)
+    tool_sets = {}   # fingerprint → tools, sent once by the parent
+    if warm:
+        session.warmup()
+
+    def send(msg):
+        data = _pool_encode(msg)
+        with send_lock:
+            conn.send_bytes(data)
+
+    def run(job_id, tools, messages, priority, deadline_ms, arrival):
+        try:
+            with request_options(priority=priority, deadline_ms=deadline_ms, start=arrival):
+                send(["done", job_id, session.generate_hybrid(messages, tools)])
+        except Exception as e:
+            send(["error", job_id, f"{type(e).__name__}: {e}"])
+
+    send(["ready"])
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads, thread_name_prefix="hybrid-pool-job")
+    while True:
+        try:
+            msg = json.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            break
+        if msg[0] == "job":
+            _, job_id, key, tools, messages, priority, deadline_ms, arrival = msg
+            if tools is not None:
+                tool_sets[key] = tools
+                proxy.tool_refs[id(tools)] = key
+            executor.submit(run, job_id, tool_sets[key], messages, priority, deadline_ms, arrival)
+        elif msg[0] == "cloud":
+            proxy.resolve(msg[1], msg[2])
+        elif msg[0] == "stats":
+            send(["stats", msg[1], session.get_stats()])
+        elif msg[0] == "stop":
+            break
+    executor.shutdown(wait=True)
+    session.close()
+
+
+class _PoolWorker:
+    __slots__ = ("index", "process", "conn", "send_lock", "tool_keys", "outstanding", "alive")
+
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()   # also orders "tool set first" before its references
+        self.tool_keys = set()              # tool set fingerprints this worker holds
+        self.outstanding = 0
+        self.alive = True
+
+    def send(self, msg):
+        data = _pool_encode(msg)
+        with self.send_lock:
+            self.conn.send_bytes(data)
+        return len(data)
+
+
+class ProcessPoolBackend:
+    """
+    generate_hybrid on worker processes, for many-core hosts where the
+    Python side of the cascade (JSON recovery, regexes, validation)
+    serializes on the GIL. Each worker owns one FunctionGemma handle and
+    runs the whole local cascade in its own session. Their cloud calls come
+    back to this process and run through `session.generate_cloud`, so one
+    breaker, hedger, dispatcher and single-flight table see the cloud
+    traffic of every worker.
+
+    Requests go out as compact JSON arrays: a tool set is sent to a worker
+    once and referenced by its fingerprint afterwards. A request goes to
+    the worker with the fewest outstanding requests.
+
+        with ProcessPoolBackend(workers=8) as pool:
+            pool.generate_hybrid(messages, tools)
+
+    `initializer(*initargs)` runs first in every worker (for example
+    fake_backend.install). Workers are spawned, not forked, so they never
+    share the parent's model handles or threads. Their learned stage
+    routing starts empty and is not persisted.
+    """
+
+    def __init__(self, workers=None, initializer=None, initargs=(), threads=None, warm=True, session=None):
+        import multiprocessing
+        ctx = multiprocessing.get_context("spawn")
+        self.session = session or _session()
+        self.threads = threads or _POOL_WORKER_THREADS
+        self.tool_sets = {}       # fingerprint → tools, to resolve workers' cloud calls
+        self.jobs = {}            # job id → (worker, Future)
+        self.stat_requests = {}   # request id → (worker, Future)
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+        self.payload_bytes = 0
+        self.payloads = 0
+        self.closed = False
+        self.cloud_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=_CLOUD_CONCURRENCY * 4, thread_name_prefix="hybrid-pool-cloud")
+        self.workers = []
+        for i in range(workers or _POOL_WORKERS):
+            parent_conn, child_conn = ctx.Pipe()
+            process = ctx.Process(target=_pool_worker, name=f"hybrid-pool-{i}", daemon=True,
+                                  args=(child_conn, initializer, tuple(initargs), self.threads, warm))
+            process.start()
+            child_conn.close()
+            self.workers.append(_PoolWorker(i, process, parent_conn))
+        for worker in self.workers:
+            try:
+                ready = json.loads(worker.conn.recv_bytes())
+            except (EOFError, OSError):
+                ready = None
+            if ready != ["ready"]:
+                self.close()
+                raise RuntimeError(f"hybrid pool worker {worker.index} failed to start")
+            threading.Thread(target=self._read, args=(worker,), name=f"hybrid-pool-reader-{worker.index}",
+                             daemon=True).start()
+
+    @property
+    def concurrency(self):
+        """Requests the pool runs at once."""
+        return len(self.workers) * self.threads
+
+    def submit(self, messages, tools):
+        """Send one request to the least busy worker; returns a Future of the generate_hybrid result."""
+        key = _tool_fingerprint(tools)
+        state = _request_ctx.get()
+        priority, deadline_ms = (state.priority, state.deadline_ms) if state else (PRIORITY_NORMAL, None)
+        # Same wall clock in the workers: time queued here and in the worker counts against the deadline
+        arrival = state.arrival if state and state.arrival is not None else time.time()
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("ProcessPoolBackend is closed")
+            live = [w for w in self.workers if w.alive]
+            if not live:
+                raise RuntimeError("no live hybrid pool workers")
+            worker = min(live, key=lambda w: w.outstanding)
+            worker.outstanding += 1
+            job_id = next(self.ids)
+            self.jobs[job_id] = (worker, future)
+            self.tool_sets.setdefault(key, tools)
+        with worker.send_lock:
+            first = key not in worker.tool_keys
+            worker.tool_keys.add(key)
+            data = _pool_encode(["job", job_id, key, tools if first else None, messages, priority, deadline_ms,
+                                 arrival])
+            worker.conn.send_bytes(data)
+        with self.lock:
+            self.payload_bytes += len(data)
+            self.payloads += 1
+        return future
+
+    def generate_hybrid(self, messages, tools, confidence_threshold=0.99):
+        """generate_hybrid on a worker; identical requests in flight share one."""
+        run = lambda m, t: self.submit(m, t).result()
+        if not _SINGLE_FLIGHT:
+            return run(messages, tools)
+        with self.session._bound():
+            return self.session.hybrid_flights.do(_hybrid_flight_key(messages, tools), run, messages, tools)
+
+    def _read(self, worker):
+        """Parent side of one worker's pipe: results, cloud requests and stats."""
+        while True:
+            try:
+                msg = json.loads(worker.conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            if msg[0] in ("done", "error"):
+                with self.lock:
+                    _, future = self.jobs.pop(msg[1])
+                    worker.outstanding -= 1
+                if msg[0] == "done":
+                    future.set_result(msg[2])
+                else:
+                    future.set_exception(RuntimeError(msg[2]))
+            elif msg[0] == "cloud":
+                self.cloud_pool.submit(self._serve_cloud, worker, msg[1], msg[2], msg[3])
+            elif msg[0] == "stats":
+                with self.lock:
+                    _, future = self.stat_requests.pop(msg[1], (None, None))
+                if future is not None:
+                    future.set_result(msg[2])
+        with self.lock:
+            worker.alive = False
+            lost = [(job_id, f) for job_id, (w, f) in self.jobs.items() if w is worker]
+            for job_id, _ in lost:
+                del self.jobs[job_id]
+            lost_stats = [(request_id, f) for request_id, (w, f) in self.stat_requests.items() if w is worker]
+            for request_id, _ in lost_stats:
+                del self.stat_requests[request_id]
+        for _, future in lost + lost_stats:
+            future.set_exception(RuntimeError(f"hybrid pool worker {worker.index} exited"))
+
+    def _serve_cloud(self, worker, call_id, messages, tools):
+        if isinstance(tools, str):
+            tools = self.tool_sets[tools]
+        try:
+            result = self.session.generate_cloud(messages, tools)
+        except Exception as e:
+            _log.warning("  [POOL] cloud call for worker %d failed: %s", worker.index, e)
+            result = {"function_calls": [], "total_time_ms": 0}
+        try:
+            worker.send(["cloud", call_id, result])
+        except OSError:
+            pass   # worker gone; _read fails its requests
+
+    def get_stats(self):
+        """Parent session stats with every worker's counters added, plus pool gauges."""
+        requests = []
+        with self.lock:
+            for worker in self.workers:
+                if worker.alive:
+                    request_id = next(self.ids)
+                    future = concurrent.futures.Future()
+                    self.stat_requests[request_id] = (worker, future)
+                    requests.append((worker, request_id, future))
+        sent = []
+        for worker, request_id, future in requests:
+            try:
+                worker.send(["stats", request_id])
+                sent.append((worker, request_id, future))
+            except OSError:
+                with self.lock:
+                    self.stat_requests.pop(request_id, None)
+        stats = self.session.get_stats()
+        stats["local_handles"] = 0
+        unavailable = len(requests) - len(sent)
+        for worker, request_id, future in sent:
+            try:
+                worker_stats = future.result(timeout=10)
+            except Exception as e:   # a dead or slow worker must not take the whole call down
+                _log.warning("  [POOL] no stats from worker %d: %s", worker.index, str(e) or type(e).__name__)
+                with self.lock:
+                    self.stat_requests.pop(request_id, None)
+                unavailable += 1
+                continue
+            for k in _STAT_COUNTERS:
+                stats[k] += worker_stats.get(k, 0)
+            stats["local_handles"] += worker_stats.get("local_handles", 0)
+        with self.lock:
+            stats.update({
+                "pool_workers": sum(w.alive for w in self.workers),
+                "pool_workers_unavailable": unavailable,
+                "pool_in_flight": len(self.jobs),
+                "pool_payload_avg_bytes": round(self.payload_bytes / self.payloads) if self.payloads else 0,
+            })
+        return stats
+
+    def close(self):
+        """Stop the workers after their running requests finish. Idempotent."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        for worker in self.workers:
+            try:
+                worker.send(["stop"])
+            except OSError:
+                pass
+        for worker in self.workers:
+            worker.process.join(timeout=10)
+            if worker.process.is_alive():
+                worker.process.terminate()
+            worker.conn.close()
+        self.cloud_pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 def print_result(label, result):
     """Pretty-print a generation result."""
     print(f"\n=== {label} ===\n")
@@ -1255,6 +4417,11 @@ def print_result(label, result):
         print(f"Arguments: {json.dumps(call['arguments'], indent=2)}")
 
 
+# Opt-in: HYBRID_WARMUP=1 preloads the model in the background at import time
+if os.environ.get("HYBRID_WARMUP") == "1":
+    warmup_async()
+
+
 ############## Example usage ##############
 
 if __name__ == "__main__":
@@ -0,0 +1,717 @@
+"""
+Microbenchmarks for the pure-Python hot paths in main.py.
+
+Every request runs value fixing, validation, argument checks and JSON
+recovery several times (more in the decomposition path), so small
+regressions there add up. Each benchmark times one pass over a realistic
+corpus built from the benchmark.py cases.
+
+Usage:
+    python microbench.py                       # run, compare against the stored baseline
+    python microbench.py --save-baseline       # run and store the result as the new baseline
+    python microbench.py --threshold 15        # fail when any bench is >15% slower
+    python microbench.py --check               # as a CI gate: a missing baseline fails too
+    python microbench.py --only fix_values     # run a subset (substring match)
+    python microbench.py --only result --alloc # also report peak allocation per pass
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, copy, json, platform, re, statistics, time, tracemalloc
+
+import main
+from benchmark import BENCHMARKS
+
+
+BASELINE_PATH = os.path.join("bench_baselines", "microbench.json")
+DEFAULT_THRESHOLD_PCT = float(os.environ.get("MICROBENCH_THRESHOLD", "20"))
+
+
+############## Harness ##############
+
+_BENCHES = []
+
+
+def bench(name):
+    """
+    Register a benchmark. The function takes a loop count and returns the
+    elapsed seconds for that many passes, so per-loop setup (e.g. copying
+    dicts that the function under test mutates) stays outside the timer.
+    """
+    def register(fn):
+        _BENCHES.append((name, fn))
+        return fn
+    return register
+
+
+def _calibrate(fn, min_time):
+    """Double the loop count until one repeat takes at least min_time seconds."""
+    loops = 1
+    while True:
+        if fn(loops) >= min_time or loops >= 1 << 20:
+            return loops
+        loops *= 2
+
+
+def run_bench(fn, warmup=3, repeats=15, min_time=0.02):
+    """
+    Warm up, calibrate, then time `repeats` runs.
+    Returns a dict of per-loop timings in microseconds.
+    """
+    for _ in range(warmup):
+        fn(1)
+    loops = _calibrate(fn, min_time)
+    samples = [fn(loops) / loops * 1e6 for _ in range(repeats)]
+    return {
+        "median_us": statistics.median(samples),
+        "min_us": min(samples),
+        "stdev_us": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "loops": loops,
+        "repeats": repeats,
+    }
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+
+
+def compare(results, baseline, threshold_pct):
+    """Print a comparison table and return the names that regressed beyond the threshold."""
+    base = (baseline or {}).get("results", {})
+    regressions = []
+    print(f"\n  {'Benchmark':<32} | {'Median (us)':>12} | {'Baseline':>12} | {'Change':>8}")
+    print(f"  {'-'*32}-+-{'-'*12}-+-{'-'*12}-+-{'-'*8}")
+    for name, r in results.items():
+        cur = r["median_us"]
+        if name in base:
+            ref = base[name]["median_us"]
+            change = (cur - ref) / ref * 100 if ref else 0.0
+            mark = ""
+            if change > threshold_pct:
+                regressions.append(name)
+                mark = "  REGRESSION"
+            print(f"  {name:<32} | {cur:>12.2f} | {ref:>12.2f} | {change:>+7.1f}%{mark}")
+        else:
+            print(f"  {name:<32} | {cur:>12.2f} | {'-':>12} | {'new':>8}")
+    return regressions
+
+
+############## Realistic inputs ##############
+
+def _query(case):
+    return case["messages"][-1]["content"]
+
+
+def _context(case):
+    return main.QueryContext(_query(case))
+
+
+def _noisy_calls(calls):
+    """Perturb expected calls the way FunctionGemma typically gets them wrong."""
+    noisy = []
+    for c in calls:
+        args = {}
+        for k, v in c["arguments"].items():
+            if isinstance(v, int):
+                args[k] = -v if v else v
+            elif k in ("recipient", "query"):
+                args[k + " "] = v + " in my contacts"
+            else:
+                args[k] = v + "."
+        noisy.append({"name": c["name"], "arguments": args})
+    return noisy
+
+
+def _routed_context(case):
+    """The context after routing, which has already built the segment contexts."""
+    ctx = _context(case)
+    ctx.segment_contexts()
+    return ctx
+
+
+# (query context, tools, noisy result) — what _fix_values / _validate see after STEP 1
+FIX_CORPUS = [
+    (_routed_context(c), c["tools"], {"function_calls": _noisy_calls(c["expected_calls"])})
+    for c in BENCHMARKS
+]
+
+# (query, tools, clean result) — what _validate sees after _fix_values
+VALIDATE_CORPUS = [
+    (_query(c), c["tools"], {"function_calls": copy.deepcopy(c["expected_calls"])})
+    for c in BENCHMARKS
+]
+
+# (tools, result) — a SaaS-style schema with number, boolean, enum, array and nested object
+# parameters, half of the calls needing coercion
+_TICKET_TOOL = {
+    "name": "create_ticket",
+    "description": "Open a support ticket",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "Ticket title"},
+            "priority": {"type": "string", "enum": ["low", "normal", "high"]},
+            "estimate_hours": {"type": "number"},
+            "notify": {"type": "boolean"},
+            "labels": {"type": "array", "items": {"type": "string"}},
+            "assignee": {
+                "type": "object",
+                "properties": {"name": {"type": "string"}, "team_id": {"type": "integer"}},
+                "required": ["name"],
+            },
+        },
+        "required": ["title", "priority"],
+    },
+}
+NESTED_CORPUS = [
+    ([_TICKET_TOOL], {"function_calls": [{"name": "create_ticket", "arguments": args}]})
+    for args in (
+        {"title": "Login fails", "priority": "high", "estimate_hours": 2.5, "notify": True,
+         "labels": ["auth", "web"], "assignee": {"name": "Ana", "team_id": 4}},
+        {"title": "Export is slow", "priority": "Normal", "estimate_hours": "3", "notify": "yes",
+         "labels": "perf", "assignee": {"name": "Raj", "team_id": "7"}},
+    ) * 15
+]
+
+# (call, query context) pairs — _check_args and _tool_matches_query run once per call
+CALL_CORPUS = [
+    (call, _context(c))
+    for c in BENCHMARKS
+    for call in c["expected_calls"]
+]
+
+QUERIES = [_query(c) for c in BENCHMARKS]
+
+# Alarm / timer / reminder phrasings, most of which the regex slots missed
+TEMPORAL_QUERIES = [
+    "Set an alarm for 10 AM.",
+    "Wake me up at half past six",
+    "Set an alarm for quarter to 8 tonight",
+    "Set an alarm for six thirty pm",
+    "Set an alarm for noon",
+    "Set a timer for twenty-five minutes",
+    "Set a timer for an hour and a half",
+    "Set a timer for half an hour",
+    "Remind me to call mom in two hours",
+    "Remind me to stretch at 4:00 PM.",
+    "Set an alarm for 7 o'clock in the morning",
+    "Set a 15 minute timer and remind me about the meeting at ten past nine am",
+]
+SEGMENTS = [seg for q in QUERIES for seg in main.QueryContext(q).segment_contexts()]
+
+_ALL_TOOLS = {}
+for _c in BENCHMARKS:
+    for _t in _c["tools"]:
+        _ALL_TOOLS[_t["name"]] = _t
+TOOLS = list(_ALL_TOOLS.values())
+
+# Raw cactus_complete outputs, covering every recovery path in _parse_local_output
+RAW_OUTPUTS = [
+    # Clean JSON
+    '{"success":true,"response":"","function_calls":[{"name":"get_weather","arguments":{"location":"Paris"}}],'
+    '"confidence":0.91,"total_time_ms":143.2}',
+    # Chinese colon + <escape> tags (sanitizer path)
+    '{"success":true,"response":"","function_calls":[{"name"："play_music","arguments":{"song"："<escape>jazz<escape>"}}],'
+    '"confidence":0.72,"total_time_ms":151.0}',
+    # Leading zeros (sanitizer path)
+    '{"success":true,"response":"","function_calls":[{"name":"set_alarm","arguments":{"hour":07,"minute":030}}],'
+    '"confidence":0.66,"total_time_ms":160.4}',
+    # Call emitted as text in the response field
+    '{"success":true,"response":"<start_function_declaration> call:get_weather(location:\\"London\\")",'
+    '"function_calls":[],"confidence":0.55,"total_time_ms":170.9}',
+    # Truncated / unrecoverable JSON with recoverable values (regex path)
+    '{"success":true,"response":"","function_calls":[{"name":"send_message","arguments":{"recipient":"Alice",'
+    '"message":"good morning"}}],"confidence":0.8,"total_time_ms":180.1,"prefill',
+    # Bare unquoted string value (regex path)
+    '{"function_calls":[{"name":"search_contacts","arguments":{"query：<escape>Bob<escape>}}]'
+    ',"total_time_ms":120.5',
+    # Hopeless output
+    '{"success":false,"response":"I cannot help with that","function_calls":[],"total_time_ms":98.0}',
+]
+
+
+############## Benchmarks ##############
+
+@bench("fix_values")
+def bench_fix_values(loops):
+    batches = [copy.deepcopy(FIX_CORPUS) for _ in range(loops)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for ctx, tools, result in batch:
+            main._fix_values(result, tools, ctx)
+    return time.perf_counter() - t0
+
+
+# The regex slot patterns the parser replaced, kept for the reference implementations
+_TIME_PATTERN = re.compile(r'(\d{1,2}):(\d{2})\s*(AM|PM|am|pm)?')
+_HOUR_PATTERN = re.compile(r'(\d{1,2})\s*(AM|PM|am|pm)')
+_MINUTES_PATTERN = re.compile(r'(\d+)\s*minute')
+
+
+def _fix_values_chain(result, tools, query):
+    """The previous if-chain over every rule, for reference."""
+    for call in result.get("function_calls", []):
+        name = call.get("name", "")
+        args = call.get("arguments", {})
+
+        # Strip whitespace from argument keys (model sometimes outputs "location " instead of "location")
+        clean_args = {k.strip(): v for k, v in args.items()}
+        if clean_args != args:
+            call["arguments"] = clean_args
+            args = call["arguments"]
+
+        # Fix list-typed string arguments (model sometimes returns ["val"] instead of "val")
+        tool = next((t for t in tools if t["name"] == name), None)
+        if tool:
+            props = tool["parameters"].get("properties", {})
+            for key, val in list(args.items()):
+                if key in props and props[key].get("type") == "string" and isinstance(val, list) and val:
+                    args[key] = str(val[0])
+
+        # Strip trailing punctuation from all string arguments
+        for key, val in list(args.items()):
+            if isinstance(val, str):
+                args[key] = val.strip().rstrip(".!?,;:")
+
+        # Fix negative integers
+        tool = next((t for t in tools if t["name"] == name), None)
+        if tool:
+            props = tool["parameters"].get("properties", {})
+            for key, val in list(args.items()):
+                if key in props and props[key].get("type") == "integer" and isinstance(val, int):
+                    if val < 0:
+                        args[key] = abs(val)
+
+        # Fix alarm values by parsing query
+        if name == "set_alarm":
+            m = _TIME_PATTERN.search(query)
+            if m:
+                hour = int(m.group(1))
+                minute = int(m.group(2))
+                if m.group(3) and m.group(3).upper() == "PM" and hour < 12:
+                    hour += 12
+                args["hour"] = hour
+                args["minute"] = minute
+            else:
+                m = _HOUR_PATTERN.search(query)
+                if m:
+                    hour = int(m.group(1))
+                    if m.group(2).upper() == "PM" and hour < 12:
+                        hour += 12
+                    args["hour"] = hour
+                    args["minute"] = 0
+
+        # Fix timer values by parsing query
+        if name == "set_timer":
+            m = _MINUTES_PATTERN.search(query)
+            if m:
+                args["minutes"] = int(m.group(1))
+
+        # Fix play_music: "play some X music" → genre is X, strip filler "music"
+        if name == "play_music":
+            song = args.get("song", "")
+            if (song.lower().endswith(" music")
+                    and len(song.split()) >= 2
+                    and re.search(r'\bsome\b', query, re.IGNORECASE)):
+                args["song"] = song.rsplit(" ", 1)[0].strip()
+
+        # Fix name/query string params: strip filler context the model may include
+        # e.g. "Tom in my contacts" → "Tom", "Alice from work" → "Alice"
+        if tool:
+            props = tool["parameters"].get("properties", {})
+            for key, val in list(args.items()):
+                if isinstance(val, str) and key in props:
+                    pdesc = props[key].get("description", "").lower()
+                    if "name" in pdesc or key in ("query", "recipient"):
+                        # Strip trailing filler phrases
+                        cleaned = re.sub(
+                            r'\s+(?:in\s+(?:my\s+)?contacts?|from\s+\w+|\'s?\s+name).*$',
+                            '', val, flags=re.IGNORECASE,
+                        ).strip()
+                        if cleaned and len(cleaned) < len(val):
+                            args[key] = cleaned
+
+        # Fix reminder time and title by parsing query
+        if name == "create_reminder":
+            m = main._REMINDER_TIME_PATTERN.search(query)
+            if m:
+                args["time"] = m.group(1).strip()
+            m = main._REMINDER_TITLE_PATTERN.search(query)
+            if m:
+                title = m.group(1).strip()
+                title = re.sub(r'^(the|a|an)\s+', '', title, flags=re.IGNORECASE)
+                args["title"] = title
+
+
+@bench("fix_values_chain")
+def bench_fix_values_chain(loops):
+    batches = [copy.deepcopy(FIX_CORPUS) for _ in range(loops)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for ctx, tools, result in batch:
+            _fix_values_chain(result, tools, ctx.text)
+    return time.perf_counter() - t0
+
+
+@bench("validate")
+def bench_validate(loops):
+    batches = [copy.deepcopy(VALIDATE_CORPUS) for _ in range(loops)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for _, tools, result in batch:
+            main._validate(result, tools)
+    return time.perf_counter() - t0
+
+
+def _validate_interpreted(result, tools):
+    """The previous schema-interpreting loop (integer/string only), for reference."""
+    calls = result.get("function_calls", [])
+    if not calls:
+        return False, "no_calls"
+
+    tool_map = {t["name"]: t for t in tools}
+
+    for call in calls:
+        name = call.get("name", "")
+        if name not in tool_map:
+            return False, "bad_tool_name"
+
+        schema = tool_map[name]
+        args = call.get("arguments", {})
+        required = schema["parameters"].get("required", [])
+
+        for req in required:
+            if req not in args:
+                return False, "missing_arg"
+
+        props = schema["parameters"].get("properties", {})
+        for key, val in list(args.items()):
+            if key in props and props[key].get("type") == "integer":
+                if not isinstance(val, int):
+                    try:
+                        call["arguments"][key] = int(float(val))
+                    except (ValueError, TypeError):
+                        return False, "bad_type"
+            if key in props and props[key].get("type") == "string":
+                if not isinstance(val, str):
+                    return False, "bad_type"
+
+    return True, None
+
+
+@bench("validate_interpreted")
+def bench_validate_interpreted(loops):
+    batches = [copy.deepcopy(VALIDATE_CORPUS) for _ in range(loops)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for _, tools, result in batch:
+            _validate_interpreted(result, tools)
+    return time.perf_counter() - t0
+
+
+@bench("validate_nested")
+def bench_validate_nested(loops):
+    batches = [copy.deepcopy(NESTED_CORPUS) for _ in range(loops)]
+    t0 = time.perf_counter()
+    for batch in batches:
+        for tools, result in batch:
+            main._validate(result, tools)
+    return time.perf_counter() - t0
+
+
+@bench("check_args")
+def bench_check_args(loops):
+    corpus = CALL_CORPUS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for call, ctx in corpus:
+            main._check_args(call, ctx)
+    return time.perf_counter() - t0
+
+
+@bench("tool_matches_query")
+def bench_tool_matches_query(loops):
+    corpus = CALL_CORPUS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for call, ctx in corpus:
+            main._tool_matches_query(call, ctx)
+    return time.perf_counter() - t0
+
+
+@bench("query_context")
+def bench_query_context(loops):
+    queries = QUERIES
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for q in queries:
+            main.QueryContext(q)
+    return time.perf_counter() - t0
+
+
+@bench("parse_slots")
+def bench_parse_slots(loops):
+    queries = TEMPORAL_QUERIES
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for q in queries:
+            main._parse_slots(q)
+    return time.perf_counter() - t0
+
+
+def _regex_slots(query):
+    """The previous per-slot regex scans, for reference (finds far fewer slots)."""
+    return (_TIME_PATTERN.search(query) or _HOUR_PATTERN.search(query),
+            _MINUTES_PATTERN.search(query), main._REMINDER_TIME_PATTERN.search(query))
+
+
+@bench("parse_slots_regex")
+def bench_parse_slots_regex(loops):
+    queries = TEMPORAL_QUERIES
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for q in queries:
+            _regex_slots(q)
+    return time.perf_counter() - t0
+
+
+@bench("get_tool_keywords_cold")
+def bench_get_tool_keywords_cold(loops):
+    tools = TOOLS
+    cache = main.default_session().tool_keywords
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        cache.clear()
+        for t in tools:
+            main._get_tool_keywords(t)
+    return time.perf_counter() - t0
+
+
+@bench("get_tool_keywords_warm")
+def bench_get_tool_keywords_warm(loops):
+    tools = TOOLS
+    for t in tools:
+        main._get_tool_keywords(t)
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for t in tools:
+            main._get_tool_keywords(t)
+    return time.perf_counter() - t0
+
+
+@bench("match_tools_to_segment")
+def bench_match_tools_to_segment(loops):
+    segments, tools = SEGMENTS, TOOLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for seg in segments:
+            main._match_tools_to_segment(seg, tools)
+    return time.perf_counter() - t0
+
+
+@bench("parse_local_output")
+def bench_parse_local_output(loops):
+    raws, tools = RAW_OUTPUTS, TOOLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for raw in raws:
+            main._parse_local_output(raw, tools)
+    return time.perf_counter() - t0
+
+
+@bench("extract_from_broken_json")
+def bench_extract_from_broken_json(loops):
+    raws, tools = RAW_OUTPUTS, TOOLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for raw in raws:
+            main._extract_from_broken_json(raw, tools)
+    return time.perf_counter() - t0
+
+
+@bench("extract_from_response_field")
+def bench_extract_from_response_field(loops):
+    raws, tools = RAW_OUTPUTS, TOOLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for raw in raws:
+            main._extract_from_response_field(raw, tools)
+    return time.perf_counter() - t0
+
+
+# Hybrid results as single-flight followers receive them
+RESULTS = [
+    {"function_calls": copy.deepcopy(c["expected_calls"]), "total_time_ms": 143.2, "source": "on-device"}
+    for c in BENCHMARKS
+]
+FROZEN_RESULTS = [main._freeze_result(r) for r in RESULTS]
+CALLS = [call for call, _ in CALL_CORPUS]
+
+
+@bench("result_share_deepcopy")
+def bench_result_share_deepcopy(loops):
+    results = RESULTS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for r in results:
+            copy.deepcopy(r)
+    return time.perf_counter() - t0
+
+
+@bench("result_freeze")
+def bench_result_freeze(loops):
+    results = RESULTS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for r in results:
+            main._freeze_result(r)
+    return time.perf_counter() - t0
+
+
+@bench("result_thaw")
+def bench_result_thaw(loops):
+    frozen = FROZEN_RESULTS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for f in frozen:
+            main._thaw_result(f)
+    return time.perf_counter() - t0
+
+
+@bench("call_key_json")
+def bench_call_key_json(loops):
+    calls = CALLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for c in calls:
+            hash(json.dumps(c, sort_keys=True))
+    return time.perf_counter() - t0
+
+
+@bench("call_key_frozen")
+def bench_call_key_frozen(loops):
+    calls = CALLS
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        for c in calls:
+            hash(main._Call.from_dict(c))
+    return time.perf_counter() - t0
+
+
+# A long chained request: ~4x the corpus calls made distinct, then every one
+# repeated with its arguments in reverse key order (the duplicates to drop)
+_DISTINCT = [
+    {"name": c["name"], "arguments": {k: f"{v} {i}" if isinstance(v, str) else v + i
+                                      for k, v in c["arguments"].items()}}
+    for i in range(4) for c in CALLS
+]
+CHAIN = _DISTINCT + [
+    {"name": c["name"], "arguments": dict(reversed(list(c["arguments"].items())))} for c in _DISTINCT
+]
+
+
+def _dedupe_pairwise(calls):
+    """The previous approach (full dict equality against every kept call), for reference."""
+    kept = []
+    for c in calls:
+        if not any(c["name"] == e["name"] and c.get("arguments") == e.get("arguments") for e in kept):
+            kept.append(c)
+    return kept
+
+
+@bench("dedupe_pairwise")
+def bench_dedupe_pairwise(loops):
+    chain = CHAIN
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        _dedupe_pairwise(chain)
+    return time.perf_counter() - t0
+
+
+@bench("dedupe_keyed")
+def bench_dedupe_keyed(loops):
+    chain = CHAIN
+    t0 = time.perf_counter()
+    for _ in range(loops):
+        main._new_calls(chain, set())
+    return time.perf_counter() - t0
+
+
+############## Entry point ##############
+
+def measure_alloc(fn):
+    """Peak bytes traced during one pass (includes any per-loop input copies the bench makes)."""
+    tracemalloc.start()
+    try:
+        fn(1)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_all(only=None, warmup=3, repeats=15, min_time=0.02, alloc=False):
+    results = {}
+    for name, fn in _BENCHES:
+        if only and not any(o in name for o in only):
+            continue
+        print(f"  running {name}...", end=" ", flush=True)
+        r = run_bench(fn, warmup=warmup, repeats=repeats, min_time=min_time)
+        if alloc:
+            r["peak_alloc_bytes"] = measure_alloc(fn)
+            print(f"{r['median_us']:.2f}us (loops={r['loops']}, peak alloc {r['peak_alloc_bytes'] / 1024:.1f}KiB)")
+        else:
+            print(f"{r['median_us']:.2f}us (loops={r['loops']})")
+        results[name] = r
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmarks for main.py hot paths")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON path")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--check", action="store_true", help="Fail when there is no baseline to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD_PCT,
+                        help="Max allowed slowdown in percent before failing (default: %(default)s)")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--min-time", type=float, default=0.02, help="Min seconds per repeat")
+    parser.add_argument("--only", nargs="*", help="Run benchmarks whose name contains any of these")
+    parser.add_argument("--alloc", action="store_true", help="Also report peak allocation of one pass")
+    args = parser.parse_args()
+
+    print("=== Microbenchmarks ===\n")
+    results = run_all(args.only, args.warmup, args.repeats, args.min_time, args.alloc)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+        sys.exit(0)
+
+    baseline = load_baseline(args.baseline)
+    regressions = compare(results, baseline, args.threshold)
+    if baseline is None:
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to create one.")
+        sys.exit(1 if args.check else 0)
+    if regressions:
+        print(f"\nFAIL: {len(regressions)} benchmark(s) regressed more than {args.threshold:.0f}%: "
+              + ", ".join(regressions))
+        sys.exit(1)
+    print(f"\nOK: no benchmark regressed more than {args.threshold:.0f}%")
@@ -33,7 +33,7 @@ except ImportError:
 # Add cactus path
 sys.path.insert(0, "cactus/python/src")
 try:
-    from main import generate_hybrid
+    from main import generate_hybrid, warmup_async, request_options, PRIORITY_INTERACTIVE
 except ImportError as e:
     print(f"Error importing main: {e}")
     print("Make sure you are running this from the functiongemma-hackathon root.")
@@ -125,7 +125,9 @@ class GenerateWorker(QThread):
     def run(self):
         try:
             messages = [{"role": "user", "content": self.query}]
-            result = generate_hybrid(messages, TOOLS)
+            # A person is watching: jump ahead of batch work on the local model
+            with request_options(priority=PRIORITY_INTERACTIVE):
+                result = generate_hybrid(messages, TOOLS)
             self.result_signal.emit(result)
         except Exception as e:
             self.result_signal.emit({"error": str(e)})
@@ -546,6 +548,9 @@ if __name__ == "__main__":
     # Optional: Font setup
     QFont.insertSubstitution("Inter", "Helvetica Neue")
     
+    # Load FunctionGemma and prefill the SaaS tool prompts while the UI comes up
+    warmup_async(TOOLS)
+
     window = SmartAPIAssistant()
     window.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,348 @@
+"""
+OpenAI-compatible local HTTP server for generate_hybrid.
+
+Several apps on one box can share a single warm FunctionGemma pool instead
+of each loading the model. Stdlib only.
+
+Endpoints:
+    POST /v1/chat/completions   tool-calling chat completion (maps onto generate_hybrid)
+    GET  /health                liveness, queue depth and cascade stats
+
+Requests go into a bounded priority queue served by one worker per model handle
+(HYBRID_MODEL_HANDLES). When the queue is full the server answers 429
+with Retry-After instead of piling up latency. A request that times out
+gets a 504, and its job is dropped if no worker has started it yet.
+Connections are HTTP/1.1 keep-alive.
+
+Besides the OpenAI fields, a request body may carry "priority"
+("interactive", "normal" or "batch") and "deadline_ms"; they map onto
+main.request_options for admission control.
+
+Usage:
+    python server.py --port 8000
+    HYBRID_MODEL_HANDLES=2 python server.py --queue-size 32
+    python server.py --fake                  # fake backend, for load tests
+    python server.py --pool 16               # 16 worker processes (many-core hosts)
+
+With --pool N the cascades run in a main.ProcessPoolBackend of N worker
+processes, each with its own model handle, and the queue gets one worker
+thread per request the pool runs at once.
+"""
+
+import sys, os
+sys.path.insert(0, "cactus/python/src")
+os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
+
+import argparse, itertools, json, logging, queue, threading, time, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+
+_log = logging.getLogger("hybrid.server")
+
+
+class BadRequest(Exception):
+    pass
+
+
+PRIORITIES = {
+    "interactive": main.PRIORITY_INTERACTIVE,
+    "normal": main.PRIORITY_NORMAL,
+    "batch": main.PRIORITY_BATCH,
+}
+
+
+############## OpenAI <-> generate_hybrid mapping ##############
+
+def parse_chat_request(body):
+    """Map an OpenAI chat.completions request onto (messages, tools) for generate_hybrid."""
+    messages = body.get("messages")
+    if not isinstance(messages, list) or not messages:
+        raise BadRequest("'messages' must be a non-empty list")
+    out_messages = []
+    for m in messages:
+        if not isinstance(m, dict) or "role" not in m:
+            raise BadRequest("each message needs a 'role'")
+        content = m.get("content") or ""
+        if isinstance(content, list):
+            # Content parts: keep the text ones
+            content = " ".join(p.get("text", "") for p in content if isinstance(p, dict))
+        if m["role"] in ("user", "system", "assistant"):
+            out_messages.append({"role": m["role"], "content": content})
+    if not out_messages or out_messages[-1]["role"] != "user":
+        raise BadRequest("the last message must be from the user")
+
+    tools = []
+    for t in body.get("tools") or []:
+        fn = t.get("function", t) if isinstance(t, dict) else None
+        if not isinstance(fn, dict) or "name" not in fn:
+            raise BadRequest("each tool needs a function with a 'name'")
+        tools.append({
+            "name": fn["name"],
+            "description": fn.get("description", ""),
+            "parameters": fn.get("parameters") or {"type": "object", "properties": {}, "required": []},
+        })
+    if not tools:
+        raise BadRequest("'tools' must be a non-empty list")
+    return out_messages, tools
+
+
+def parse_request_options(body):
+    """Read the optional priority / deadline_ms extension fields."""
+    priority = body.get("priority", "normal")
+    if not isinstance(priority, str) or priority not in PRIORITIES:
+        raise BadRequest("'priority' must be one of " + ", ".join(PRIORITIES))
+    deadline_ms = body.get("deadline_ms")
+    if deadline_ms is not None and (not isinstance(deadline_ms, (int, float)) or deadline_ms <= 0):
+        raise BadRequest("'deadline_ms' must be a positive number")
+    return {"priority": PRIORITIES[priority], "deadline_ms": deadline_ms}
+
+
+def build_chat_response(result, model_name):
+    """Wrap a generate_hybrid result as an OpenAI chat.completion."""
+    tool_calls = [
+        {
+            "id": "call_" + uuid.uuid4().hex[:24],
+            "type": "function",
+            "function": {
+                "name": c["name"],
+                "arguments": json.dumps(c.get("arguments", {}), ensure_ascii=False),
+            },
+        }
+        for c in result.get("function_calls", [])
+    ]
+    return {
+        "id": "chatcmpl-" + uuid.uuid4().hex[:24],
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model_name,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": None, "tool_calls": tool_calls},
+            "finish_reason": "tool_calls" if tool_calls else "stop",
+        }],
+        "hybrid": {
+            "source": result.get("source", "unknown"),
+            "total_time_ms": result.get("total_time_ms", 0),
+        },
+    }
+
+
+############## Bounded work queue ##############
+
+class _Job:
+    __slots__ = ("messages", "tools", "options", "done", "result", "error", "enqueued", "cancelled")
+
+    def __init__(self, messages, tools, options):
+        self.messages = messages
+        self.tools = tools
+        self.options = options
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.enqueued = time.time()
+        self.cancelled = False   # the client got a 504; a worker that has not started it skips it
+
+
+class InferenceQueue:
+    """
+    Bounded queue of generate_hybrid jobs, drained by one worker per model
+    handle in (priority, arrival) order.
+    """
+
+    def __init__(self, capacity, workers, generate=None):
+        self.generate = generate or main.generate_hybrid
+        self.jobs = queue.PriorityQueue(maxsize=capacity)
+        self.seq = itertools.count()
+        self.capacity = capacity
+        self.workers = workers
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._work, name=f"hybrid-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, messages, tools, options=None):
+        """Enqueue a job; returns None when the queue is full."""
+        job = _Job(messages, tools, options or {})
+        priority = job.options.get("priority", main.PRIORITY_NORMAL)
+        try:
+            self.jobs.put_nowait((priority, next(self.seq), job))
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return None
+        return job
+
+    def _work(self):
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                return
+            with self.lock:
+                if job.cancelled:
+                    self.cancelled += 1
+                    continue
+                self.in_flight += 1
+            try:
+                # The deadline runs from arrival, so admission control sees the time spent queued
+                with main.request_options(**job.options, start=job.enqueued):
+                    job.result = self.generate(job.messages, job.tools)
+            except Exception as e:
+                _log.exception("generate_hybrid failed")
+                job.error = e
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.completed += 1
+                job.done.set()
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put((sys.maxsize, next(self.seq), None))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "queue_depth": self.jobs.qsize(),
+                "queue_capacity": self.capacity,
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+            }
+
+
+############## HTTP layer ##############
+
+class HybridHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    server_version = "HybridServer/1.0"
+
+    def log_message(self, fmt, *args):
+        _log.debug("%s - " + fmt, self.address_string(), *args)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status, message, err_type, headers=None):
+        self._send_json(status, {"error": {"message": message, "type": err_type}}, headers)
+
+    def do_GET(self):
+        if self.path == "/health":
+            pool = self.server.pool
+            self._send_json(200, {
+                "status": "ok",
+                "model_handles": len(pool.workers) if pool else main.default_session().model_handles,
+                **self.server.inference.snapshot(),
+                "stats": pool.get_stats() if pool else main.get_stats(),
+            })
+        else:
+            self._error(404, f"no route for GET {self.path}", "not_found")
+
+    def do_POST(self):
+        if self.path != "/v1/chat/completions":
+            self._error(404, f"no route for POST {self.path}", "not_found")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise BadRequest("invalid Content-Length")
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise BadRequest("the request body must be a JSON object")
+            messages, tools = parse_chat_request(body)
+            options = parse_request_options(body)
+        except (ValueError, TypeError, BadRequest) as e:
+            self._error(400, str(e), "invalid_request_error")
+            return
+
+        job = self.server.inference.submit(messages, tools, options)
+        if job is None:
+            self._error(429, "request queue is full", "overloaded", {"Retry-After": "1"})
+            return
+        if not job.done.wait(self.server.request_timeout):
+            with self.server.inference.lock:
+                job.cancelled = True
+            self._error(504, "timed out waiting for inference", "timeout")
+            return
+        if job.error is not None:
+            self._error(500, str(job.error), "server_error")
+            return
+        self._send_json(200, build_chat_response(job.result, body.get("model", "functiongemma-hybrid")))
+
+
+class HybridServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue_size=64, request_timeout=30.0, pool=None):
+        super().__init__(address, HybridHandler)
+        self.pool = pool
+        if pool is not None:
+            self.inference = InferenceQueue(queue_size, pool.concurrency, pool.generate_hybrid)
+        else:
+            self.inference = InferenceQueue(queue_size, main.default_session().model_handles)
+        self.request_timeout = request_timeout
+
+    def server_close(self):
+        self.inference.stop()
+        if self.pool is not None:
+            self.pool.close()
+        super().server_close()
+
+
+def serve(host="127.0.0.1", port=8000, queue_size=64, request_timeout=30.0, warm=True,
+          pool_workers=0, pool_initializer=None):
+    """Build a HybridServer; the caller runs serve_forever()."""
+    pool = None
+    if pool_workers:
+        pool = main.ProcessPoolBackend(pool_workers, pool_initializer, warm=warm)
+    elif warm:
+        main.warmup_async()
+    return HybridServer((host, port), queue_size=queue_size, request_timeout=request_timeout, pool=pool)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI-compatible server for generate_hybrid")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--queue-size", type=int, default=64, help="Max queued requests before 429")
+    parser.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds")
+    parser.add_argument("--no-warmup", action="store_true", help="Skip background model warm-up")
+    parser.add_argument("--fake", action="store_true", help="Use the fake backend (no weights/API key)")
+    parser.add_argument("--pool", type=int, default=0,
+                        help="Run cascades in this many worker processes (0 = in-process)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    initializer = None
+    if args.fake:
+        import fake_backend
+        fake_backend.install()
+        initializer = fake_backend.install
+
+    httpd = serve(args.host, args.port, args.queue_size, args.timeout, warm=not args.no_warmup,
+                  pool_workers=args.pool, pool_initializer=initializer)
+    handles = len(httpd.pool.workers) if httpd.pool else main.default_session().model_handles
+    print(f"Serving generate_hybrid on http://{args.host}:{httpd.server_address[1]} "
+          f"({handles} model handle(s){' in worker processes' if httpd.pool else ''}, queue={args.queue_size})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()